@@ -0,0 +1,545 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Generar extractos sintéticos de Binance y medir el rendimiento (tiempo y
+memoria) de las distintas fases de conversión de binance.py.
+
+Uso: benchmark.py [número de transacciones] [opciones] (ver --help)
+"""
+
+import collections as cl
+import datetime as dt
+import functools as ft
+import itertools as it
+import argparse
+import json
+import multiprocessing as mp
+import os
+import platform
+import random
+import tempfile as tf
+import time
+import tracemalloc
+import csv
+
+import binance as bn
+
+
+# Peso por defecto de cada tipo de evento en el extracto sintético:
+# - trade: compra, venta y comisión en el mismo segundo.
+# - staking: ráfaga de intereses de staking/ahorro en el mismo segundo.
+# - dust: conversión de polvo a BNB (venta de la moneda y compra de BNB).
+# - deposit, withdraw: depósito o retirada de una moneda.
+statementMix = cl.OrderedDict((("trade", 0.35), ("staking", 0.40), \
+        ("dust", 0.10), ("deposit", 0.10), ("withdraw", 0.05)))
+# Número medio de transacciones de cada tipo de evento.
+eventMeanRows = {"trade": 3, "staking": 3.5, "dust": 2, "deposit": 1, \
+        "withdraw": 1}
+
+coins = ["BTC", "ETH", "DOT", "ATOM", "ADA", "SOL", "BTTC"]
+quoteCoins = ["USDT", "BUSD"]
+stakingTypes = [bn.inTypes[7], bn.inTypes[8], bn.inTypes[9]]
+
+
+
+
+def parseMix(strMix):
+    """
+    Parsear la mezcla de eventos del extracto sintético.
+
+    ARGUMENTOS:
+        - strMix: cadena con pares evento=peso separados por comas, p. ej.
+        "trade=0.5,staking=0.5". Los eventos que no aparecen tienen peso 0.
+
+    RETORNO:
+        OrderedDict evento: peso.
+    """
+
+    mix = cl.OrderedDict()
+    for pair in strMix.split(","):
+        event, weight = pair.split("=")
+        if event.strip() not in statementMix:
+            raise argparse.ArgumentTypeError(f"Evento desconocido: {event}")
+        mix[event.strip()] = float(weight)
+
+    return mix
+
+
+
+
+def getEventRows(event, rng, strTime):
+    """
+    Obtener las transacciones (listas con los campos inFieldNames) de un
+    evento del extracto sintético.
+    """
+
+    if event == "trade":
+        coin, quoteCoin = rng.choice(coins), rng.choice(quoteCoins)
+        amount = rng.random() * 3
+        feeCoin = rng.choice([coin, quoteCoin, "BNB"])
+        feeAmount = amount * 0.001 * (40 if feeCoin == quoteCoin else 1)
+        return [["1", strTime, "Spot", bn.inTypes[4], coin, \
+                    f"{amount:.8f}", ""], \
+                ["1", strTime, "Spot", bn.inTypes[5], quoteCoin, \
+                    f"{-amount * 40:.8f}", ""], \
+                ["1", strTime, "Spot", bn.inTypes[3], feeCoin, \
+                    f"{-feeAmount:.8f}", ""]]
+    if event == "staking":
+        return [["1", strTime, "Spot", rng.choice(stakingTypes), coin, \
+                f"{rng.random() * 0.01:.8f}", ""] \
+                for coin in rng.sample(coins, rng.randint(1, 6))]
+    if event == "dust":
+        return [["1", strTime, "Spot", bn.inTypes[2], rng.choice(coins), \
+                    f"{-rng.random() * 0.001:.8f}", ""], \
+                ["1", strTime, "Spot", bn.inTypes[2], "BNB", \
+                    f"{rng.random() * 0.0001:.8f}", ""]]
+    if event == "deposit":
+        return [["1", strTime, "Spot", bn.inTypes[0], rng.choice(coins), \
+                f"{rng.random() * 10:.8f}", ""]]
+
+    return [["1", strTime, "Spot", bn.inTypes[1], rng.choice(coins), \
+            f"{-rng.random() * 10:.8f}", "Retirada"]]
+
+
+
+
+def writeSyntheticStatement(fileName, numTrxns, numDays=365, mix=None, \
+        seed=1, startDate=dt.datetime(2021, 1, 1)):
+    """
+    Escribir un extracto sintético de Binance con los campos inFieldNames,
+    ordenado por UTC_Time de manera ascendente. Cada evento tiene su propio
+    segundo, así que los grupos de transacciones son siempre unibles.
+
+    ARGUMENTOS:
+        - fileName: archivo csv de salida.
+        - numTrxns: número mínimo de transacciones a escribir. El último
+        evento se escribe completo, así que puede haber alguna más.
+        - numDays: número aproximado de días que abarca el extracto. Si hay
+        más eventos que segundos en esos días, el extracto abarca más días.
+        - mix: diccionario con el peso de cada tipo de evento (ver
+        statementMix). Si None se usa statementMix.
+        - seed: semilla del generador aleatorio.
+        - startDate: fecha de la primera transacción.
+
+    RETORNO:
+        Número de transacciones escritas.
+    """
+
+    rng = random.Random(seed)
+    mix = statementMix if mix is None else mix
+    events = [event for event, weight in mix.items() if weight > 0]
+    weights = [mix[event] for event in events]
+    meanRows = sum(eventMeanRows[e] * w for e, w in zip(events, weights)) / \
+            sum(weights)
+    meanStep = numDays * 86400 * meanRows / numTrxns
+
+    seconds = 0
+    numRows = 0
+    with open(fileName, "w", newline="") as outFile:
+        csvOut = csv.writer(outFile)
+        csvOut.writerow(bn.inFieldNames)
+        while numRows < numTrxns:
+            seconds += max(1, round(rng.expovariate(1 / meanStep)))
+            strTime = (startDate + dt.timedelta(seconds=seconds)).strftime( \
+                    bn.dateFormat)
+            rows = getEventRows(rng.choices(events, weights)[0], rng, strTime)
+            csvOut.writerows(rows)
+            numRows += len(rows)
+
+    return numRows
+
+
+
+
+def timeRows(function, trxns):
+    """
+    Medir cuántas transacciones por segundo procesa una función.
+
+    ARGUMENTOS:
+        - function: función que recibe una transacción.
+        - trxns: lista de transacciones a procesar.
+
+    RETORNO:
+        Tupla (segundos, transacciones por segundo).
+    """
+
+    start = time.perf_counter()
+    for trxn in trxns:
+        function(trxn)
+    seconds = time.perf_counter() - start
+    return seconds, len(trxns) / seconds
+
+
+
+
+def measure(run, numRows, setup=tuple, repeat=3, isMemory=True):
+    """
+    Medir el tiempo y la memoria de una función.
+
+    ARGUMENTOS:
+        - run: función a medir.
+        - numRows: número de transacciones que procesa cada llamada.
+        - setup: función que devuelve la tupla de argumentos de run. Se llama
+        antes de cada medición, fuera del tiempo medido (p. ej. para copiar
+        las transacciones que run modifica).
+        - repeat: número de mediciones de tiempo. Se guarda la mejor.
+        - isMemory: si True, se hace otra llamada con tracemalloc para medir
+        el pico de memoria reservada por run.
+
+    RETORNO:
+        Diccionario con seconds, rowsPerSec y, si isMemory, peakBytes.
+    """
+
+    seconds = float("inf")
+    for _ in range(repeat):
+        args = setup()
+        start = time.perf_counter()
+        run(*args)
+        seconds = min(seconds, time.perf_counter() - start)
+    result = {"seconds": seconds, "rowsPerSec": numRows / seconds}
+
+    if isMemory:
+        args = setup()
+        tracemalloc.start()
+        run(*args)
+        result["peakBytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return result
+
+
+
+
+def benchProcessTrxn(trxns, repeat=3, isMemory=True):
+    """
+    Comparar processNewTrxnKeys con el plan de campos compilado.
+
+    ARGUMENTOS:
+        - trxns: lista de transacciones de entrada.
+        - repeat, isMemory: ver measure.
+
+    RETORNO:
+        Diccionario con los resultados (ver measure) de cada modo.
+    """
+
+    outFieldsPlan = bn.getOutFieldsPlan()
+    outFieldsGetsValues = bn.planToGetsValues(outFieldsPlan)
+    processTrxns = cl.OrderedDict(( \
+            ("processNewTrxnKeys", lambda trxn: bn.processNewTrxnKeys( \
+                bn.parseTrxnFields(trxn, bn.inFieldsParsers), \
+                outFieldsGetsValues)), \
+            ("compileNewTrxnKeys", bn.compileNewTrxnKeys(outFieldsPlan, \
+                bn.inFieldsParsers))))
+
+    results = cl.OrderedDict()
+    for name, processTrxn in processTrxns.items():
+        results[name] = measure(lambda: timeRows(processTrxn, trxns), \
+                len(trxns), repeat=repeat, isMemory=isMemory)
+
+    return results
+
+
+
+
+def benchMerges(trxns, repeat=3, isMemory=True):
+    """
+    Medir las funciones de unión de grupos de transacciones procesadas:
+    mergeStakingTrxns y mergeTradeTrxns sobre los grupos de su tipo, y
+    mergeTrxnsGroupsByType sobre todos los grupos.
+
+    ARGUMENTOS:
+        - trxns: lista de transacciones de entrada.
+        - repeat, isMemory: ver measure.
+
+    RETORNO:
+        Diccionario con los resultados (ver measure) de cada función.
+    """
+
+    trxnsProcess = bn.getTrxnsProcess()
+    typeMerges = trxnsProcess["typeMerges"]
+    trxnsGroups = cl.OrderedDict()
+    for trxn in map(trxnsProcess["processTrxn"], trxns):
+        groupId = trxnsProcess["getTrxnGroupId"](trxn)
+        if groupId is not None:
+            trxnsGroups.setdefault(groupId, []).append(trxn)
+    typesGroups = cl.defaultdict(list)
+    for trxnsGroup in trxnsGroups.values():
+        typesGroups[trxnsGroup[0][bn.outFieldNames[0]]].append(trxnsGroup)
+
+    # Las uniones modifican las transacciones: cada medición usa una copia.
+    copyGroups = lambda groups: ([[trxn.copy() for trxn in trxnsGroup] \
+            for trxnsGroup in groups],)
+    mergeGroups = lambda merge: lambda groups: [merge(trxnsGroup) \
+            for trxnsGroup in groups]
+    benchs = cl.OrderedDict(( \
+            ("mergeStakingTrxns", (mergeGroups(typeMerges[bn.outTypes[0]]), \
+                typesGroups[bn.outTypes[0]])), \
+            ("mergeTradeTrxns", (mergeGroups(typeMerges[bn.outTypes[1]]), \
+                typesGroups[bn.outTypes[1]])), \
+            ("mergeTrxnsGroupsByType", \
+                (trxnsProcess["mergeTrxnsGroupsByType"], \
+                list(trxnsGroups.values())))))
+
+    results = cl.OrderedDict()
+    for name, (run, groups) in benchs.items():
+        results[name] = measure(run, sum(map(len, groups)), \
+                ft.partial(copyGroups, groups), repeat, isMemory)
+
+    return results
+
+
+
+
+def benchCsvProcessTrxns(fileName, trxns, outDirName, repeat=3, \
+        isMemory=True):
+    """
+    Medir csvProcessTrxns de principio a fin (leer, procesar, unir y escribir
+    el csv) en cada combinación de entrada y salida: en memoria (lista de
+    transacciones) o por flujo (reader csv / writer csv por bloques de un
+    día).
+
+    ARGUMENTOS:
+        - fileName: extracto de entrada, ordenado por UTC_Time.
+        - trxns: transacciones del extracto ya leídas en memoria.
+        - outDirName: directorio donde escribir los csv de salida.
+        - repeat, isMemory: ver measure.
+
+    RETORNO:
+        Diccionario con los resultados (ver measure) de cada combinación.
+    """
+
+    trxnsProcess = bn.getTrxnsProcess()
+    outFileName = os.path.join(outDirName, "out.csv")
+
+    def run(isInStream, isOutStream):
+        with open(fileName, newline="") as inFile, \
+                open(outFileName, "w", newline="") as outFile:
+            trxnsIn = bn.csvOpen(inFile, "r", dialect="excel") if isInStream \
+                    else trxns
+            csvOut = bn.csvOpen(outFile, "w", dialect="excel", \
+                    fieldnames=bn.outFieldNames, \
+                    amountKeys=bn.outAmountFieldNames)
+            outTrxns = bn.csvProcessTrxns(trxnsIn, \
+                    trxnsProcess["processTrxn"], \
+                    csvOut if isOutStream else None, \
+                    trxnsProcess["mergeTrxnsGroups"], \
+                    trxnsProcess["getTrxnGroupId"], \
+                    trxnsProcess["getTrxnBlockId"] if isOutStream else None)
+            if not isOutStream:
+                csvOut.writeheader()
+                csvOut.writerows(outTrxns)
+
+    results = cl.OrderedDict()
+    for isInStream, isOutStream in it.product((False, True), repeat=2):
+        name = f"csvProcessTrxns in={'stream' if isInStream else 'mem'} " \
+                f"out={'stream' if isOutStream else 'mem'}"
+        results[name] = measure(ft.partial(run, isInStream, isOutStream), \
+                len(trxns), repeat=repeat, isMemory=isMemory)
+
+    return results
+
+
+
+
+def getPeakRssBytes():
+    """
+    Obtener el pico de memoria residente (RSS) del proceso en bytes. En Linux
+    se lee VmHWM de /proc/self/status, que empieza de cero en cada proceso
+    nuevo; ru_maxrss (ver getPeakMemoryBytes) conserva tras exec el pico del
+    proceso padre del que se creó. Si no, se usa getPeakMemoryBytes.
+    """
+    try:
+        with open("/proc/self/status", encoding="ascii") as statusFile:
+            for line in statusFile:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return bn.getPeakMemoryBytes()
+
+
+
+def holdProcessedTrxns(fileName, outTypeName):
+    """
+    Procesar todas las transacciones de un extracto guardándolas en una lista,
+    como en la conversión en memoria. Se ejecuta en un proceso nuevo para que
+    su pico de memoria (RSS) solo incluya estas transacciones.
+
+    ARGUMENTOS:
+        - fileName: extracto de entrada.
+        - outTypeName: tipo de las transacciones procesadas: "OrderedDict" u
+        "OutTrxn".
+
+    RETORNO:
+        Diccionario con seconds, rows y los picos de RSS en bytes antes
+        (baseRssBytes) y después (peakRssBytes) de procesarlas.
+    """
+
+    outType = {"OrderedDict": cl.OrderedDict, "OutTrxn": bn.OutTrxn}
+    processTrxn = bn.compileNewTrxnKeys(bn.getOutFieldsPlan(), \
+            bn.inFieldsParsers, bn.InTrxn, outType[outTypeName])
+    baseRssBytes = getPeakRssBytes()
+    start = time.perf_counter()
+    with open(fileName, newline="") as inFile:
+        trxns = [processTrxn(trxn) for trxn in bn.csvReadTrxns(inFile)[0]]
+    return {"seconds": time.perf_counter() - start, "rows": len(trxns), \
+            "baseRssBytes": baseRssBytes, "peakRssBytes": getPeakRssBytes()}
+
+
+
+def convertPeakRss(fileName, outFileName):
+    """
+    Convertir un extracto en memoria con convertTrxnsFile en un proceso nuevo.
+
+    RETORNO:
+        Diccionario con seconds, rows y el pico de RSS en bytes
+        (peakRssBytes).
+    """
+
+    summary = bn.convertTrxnsFile(fileName, outFileName)
+    return {"seconds": summary["seconds"], "rows": summary["rowsIn"], \
+            "peakRssBytes": getPeakRssBytes()}
+
+
+
+def benchRecordsMemory(fileName, outDirName):
+    """
+    Comparar el pico de memoria residente (RSS) de guardar todas las
+    transacciones procesadas como OrderedDict y como OutTrxn, y el de la
+    conversión completa en memoria. Cada medición se hace en un proceso nuevo
+    (spawn), ya que el RSS máximo de un proceso no baja.
+
+    ARGUMENTOS:
+        - fileName: extracto de entrada.
+        - outDirName: directorio donde escribir el csv de salida.
+
+    RETORNO:
+        Diccionario con los resultados de cada medición: seconds, rowsPerSec,
+        peakRssBytes y, al guardar las transacciones, rssBytesPerRow.
+        Vacío si no se puede medir el RSS.
+    """
+
+    results = cl.OrderedDict()
+    if getPeakRssBytes() is None:
+        return results
+
+    runs = [(f"records {outTypeName}", holdProcessedTrxns, \
+            (fileName, outTypeName)) for outTypeName in ("OrderedDict", \
+            "OutTrxn")]
+    runs.append(("convertTrxnsFile mem RSS", convertPeakRss, \
+            (fileName, os.path.join(outDirName, "out.csv"))))
+    context = mp.get_context("spawn")
+    for name, run, args in runs:
+        with context.Pool(1) as pool:
+            result = pool.apply(run, args)
+        results[name] = {"seconds": result["seconds"], \
+                "rowsPerSec": result["rows"] / result["seconds"], \
+                "peakRssBytes": result["peakRssBytes"]}
+        if "baseRssBytes" in result:
+            results[name]["rssBytesPerRow"] = (result["peakRssBytes"] - \
+                    result["baseRssBytes"]) / result["rows"]
+
+    return results
+
+
+
+
+def printResults(results, baseline=None):
+    """
+    Mostrar los resultados y, si hay resultados de referencia (p. ej. de otra
+    versión), la relación de tiempos respecto a ellos.
+    """
+
+    for name, result in results.items():
+        line = f"{name:<40} {result['seconds']:8.3f} s " \
+                f"{result['rowsPerSec']:12,.0f} filas/s"
+        if "peakBytes" in result:
+            line += f" {result['peakBytes'] / 2**20:9.1f} MiB"
+        if "peakRssBytes" in result:
+            line += f" {result['peakRssBytes'] / 2**20:9.1f} MiB RSS"
+        if "rssBytesPerRow" in result:
+            line += f" {result['rssBytesPerRow']:7.0f} B/fila"
+        if baseline and name in baseline:
+            line += f"  x{result['seconds'] / baseline[name]['seconds']:.2f}"
+        print(line)
+
+
+
+
+def main():
+    """
+    Función principal.
+    """
+    argParser = argparse.ArgumentParser(description="Generar un extracto " \
+            "sintético de Binance y medir el rendimiento de la conversión.")
+    argParser.add_argument("numTrxns", type=int, nargs="?", default=100000, \
+            help="número de transacciones del extracto (por defecto: " \
+            "%(default)s)")
+    argParser.add_argument("--days", type=int, default=365, help="días " \
+            "que abarca el extracto (por defecto: %(default)s)")
+    argParser.add_argument("--mix", type=parseMix, default=statementMix, \
+            help="peso de cada tipo de evento, p. ej. " \
+            "trade=0.35,staking=0.4,dust=0.1,deposit=0.1,withdraw=0.05")
+    argParser.add_argument("--seed", type=int, default=1, help="semilla del " \
+            "generador aleatorio (por defecto: %(default)s)")
+    argParser.add_argument("--statement", metavar="ARCHIVO", help="extracto " \
+            "a usar. Si no existe se genera en él; si no se indica, se genera " \
+            "en un directorio temporal")
+    argParser.add_argument("--generate-only", action="store_true", help=\
+            "solo generar el extracto --statement, sin medir nada")
+    argParser.add_argument("--repeat", type=int, default=3, help="número de " \
+            "mediciones de tiempo de cada prueba (por defecto: %(default)s)")
+    argParser.add_argument("--no-memory", action="store_true", help="no " \
+            "medir el pico de memoria con tracemalloc ni el RSS de las " \
+            "transacciones procesadas")
+    argParser.add_argument("--out", metavar="ARCHIVO", default=\
+            "benchmark.json", help="archivo JSON de resultados (por " \
+            "defecto: %(default)s)")
+    argParser.add_argument("--label", default="", help="etiqueta de la " \
+            "ejecución en los resultados, p. ej. la versión")
+    argParser.add_argument("--compare", metavar="ARCHIVO", help="archivo " \
+            "JSON de resultados anteriores con los que comparar")
+    args = argParser.parse_args()
+    if args.generate_only and args.statement is None:
+        argParser.error("--generate-only necesita --statement")
+
+    with tf.TemporaryDirectory() as tmpDirName:
+        fileName = args.statement or os.path.join(tmpDirName, "statement.csv")
+        if not os.path.exists(fileName):
+            numTrxns = writeSyntheticStatement(fileName, args.numTrxns, \
+                    args.days, args.mix, args.seed)
+            print(f"Extracto {fileName}: {numTrxns:,} transacciones")
+        if args.generate_only:
+            return
+
+        with open(fileName, newline="") as inFile:
+            trxns = list(bn.csvOpen(inFile, "r", dialect="excel"))
+
+        isMemory = not args.no_memory
+        results = cl.OrderedDict()
+        results.update(benchProcessTrxn(trxns, args.repeat, isMemory))
+        results.update(benchMerges(trxns, args.repeat, isMemory))
+        results.update(benchCsvProcessTrxns(fileName, trxns, tmpDirName, \
+                args.repeat, isMemory))
+        if isMemory:
+            results.update(benchRecordsMemory(fileName, tmpDirName))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as baselineFile:
+            baseline = json.load(baselineFile)["results"]
+    printResults(results, baseline)
+
+    with open(args.out, "w", encoding="utf-8") as outFile:
+        json.dump({"label": args.label, \
+                "date": dt.datetime.now().isoformat(timespec="seconds"), \
+                "python": platform.python_version(), \
+                "numTrxns": len(trxns), "days": args.days, \
+                "mix": args.mix, "seed": args.seed, "repeat": args.repeat, \
+                "results": results}, outFile, indent=2)
+
+
+
+if __name__ in ("__main__", "__console__"):
+    main()
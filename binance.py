@@ -35,13 +35,157 @@ MEJORAS:
 
 #import utilidades.util as u
 import datetime as dt
+import decimal as dc
 import collections as cl
 import logging as log
+import logging.handlers
 import operator as op
+import argparse
+import atexit
+import contextlib
+import array
+import itertools as it
+import concurrent.futures as cf
+import glob
+import gzip
+import hashlib as hl
+import io
+import json
+import mmap
+import multiprocessing.util
+import os
+import queue
+import shutil as sh
+import sqlite3
+import struct
+import time
+import types
+import heapq as hq
+import tempfile as tf
+import threading
 import sys
 import csv
+import zipfile
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
+# El módulo no configura el log al importarse: por defecto los registros no
+# se escriben en ningún sitio (ver setupLogging).
+logger = log.getLogger("binance")
+logger.addHandler(log.NullHandler())
+
+
+# *** LOG ***
+
+class TrxnWarningsFilter(log.Filter):
+    """
+    Filtro de log que agrega los avisos repetidos de transacciones. Los
+    registros con el atributo trxnKey (pasado en extra, p. ej. la Operation de
+    la transacción) se cuentan por clave y solo pasan los maxPerKey primeros de
+    cada clave. El resto de registros pasan siempre.
+    """
+
+    def __init__(self, maxPerKey=10):
+        super().__init__()
+        self.maxPerKey = maxPerKey
+        self.counts = cl.Counter()
+
+
+    def filter(self, record):
+        if not hasattr(record, "trxnKey"):
+            return True
+        self.counts[record.trxnKey] += 1
+        return self.counts[record.trxnKey] <= self.maxPerKey
+
+
+
+
+# Configuración del log activa (ver setupLogging). None si no hay ninguna.
+logState = None
+
+
+def setupLogging(fileName="binance.log", level=log.WARNING, maxPerKey=10, \
+        isAsync=True):
+    """
+    Configurar el log del módulo en un archivo. Sustituye a la configuración
+    anterior, si existe.
+
+    ARGUMENTOS:
+        - fileName: archivo de log, que se abre para añadir.
+        - level: nivel mínimo de los registros a escribir.
+        - maxPerKey: número máximo de avisos por clave de transacción (ver
+        TrxnWarningsFilter). Al terminar se anota cuántos se han omitido.
+        - isAsync: si True, los registros se pasan por una cola a un hilo que
+        los escribe en el archivo (QueueHandler/QueueListener), sin bloquear
+        el procesamiento. Si False se escriben directamente.
+    """
+    global logState
+    stopLogging()
+
+    fileHandler = log.FileHandler(fileName, encoding="utf-8")
+    fileHandler.setFormatter(log.Formatter( \
+            "%(asctime)s %(levelname)s %(processName)s %(message)s"))
+    if isAsync:
+        logQueue = queue.SimpleQueue()
+        handler = log.handlers.QueueHandler(logQueue)
+        listener = log.handlers.QueueListener(logQueue, fileHandler)
+        listener.start()
+    else:
+        handler = fileHandler
+        listener = None
+
+    trxnWarningsFilter = TrxnWarningsFilter(maxPerKey)
+    handler.addFilter(trxnWarningsFilter)
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    logState = {"config": {"fileName": fileName, "level": level, \
+                "maxPerKey": maxPerKey}, \
+            "pid": os.getpid(), "handler": handler, \
+            "fileHandler": fileHandler, "listener": listener, \
+            "filter": trxnWarningsFilter}
+
+
+
+
+@atexit.register
+def stopLogging():
+    """
+    Anotar cuántos avisos de transacciones se han omitido por clave, vaciar la
+    cola de registros pendientes y quitar la configuración de setupLogging.
+    En un proceso hijo creado con fork solo se quita la configuración
+    heredada.
+    """
+    global logState
+    if logState is None:
+        return
+    state, logState = logState, None
+
+    if state["pid"] == os.getpid():
+        maxPerKey = state["filter"].maxPerKey
+        for key, count in state["filter"].counts.items():
+            if count > maxPerKey:
+                logger.warning("%d avisos más de %s omitidos (%d en total)", \
+                        count - maxPerKey, key, count)
+        if state["listener"] is not None:
+            state["listener"].stop()
+        state["fileHandler"].close()
+
+    logger.removeHandler(state["handler"])
+
 
-log.basicConfig(filename='binance.log', encoding='utf-8', level=log.DEBUG)
 
 
 # *** FUNCIONES UTIL ***
@@ -123,16 +267,216 @@ def wrapf(function, *endArgs, **kwEndArgs):
 
 # *** FUNCIONES CSV ***
 
-def csvOpen(file, mode="r", dialect=None, isDict=True, fieldnames=None):
+class AmountsDictWriter(csv.DictWriter):
+    """
+    DictWriter que formatea las cantidades enteras de cada fila (ver
+    formatTrxnAmounts) justo antes de escribirla. Cuenta en rowsWritten las
+    filas escritas, sin contar la cabecera. Si los campos son outFieldNames,
+    las filas OutTrxn se escriben directamente con sus valores, sin pasar por
+    un diccionario.
+    """
+
+    def __init__(self, file, fieldnames, amountKeys=(), **kwargs):
+        super().__init__(file, fieldnames, **kwargs)
+        self.amountKeys = tuple(amountKeys)
+        self.rowsWritten = 0
+        self.isOutTrxnFields = list(fieldnames) == outFieldNames
+
+    def writeheader(self):
+        return self.writer.writerow(self.fieldnames)
+
+    def getRow(self, rowdict):
+        rowdict = formatTrxnAmounts(rowdict, self.amountKeys)
+        if self.isOutTrxnFields and isinstance(rowdict, OutTrxn):
+            return rowdict.values()
+        return self._dict_to_list(rowdict)
+
+    def writerow(self, rowdict):
+        self.rowsWritten += 1
+        return self.writer.writerow(self.getRow(rowdict))
+
+    def writerows(self, rowdicts):
+        rowdicts = list(rowdicts)
+        self.rowsWritten += len(rowdicts)
+        return self.writer.writerows(map(self.getRow, rowdicts))
+
+
+
+# Dialectos csv ya detectados por cabecera de archivo (ver sniffDialect).
+dialectsCache = {}
+# Delimitadores probados con la cabecera antes de usar csv.Sniffer.
+headerDelimiters = ",;\t|"
+
+
+def sniffDialect(sample):
+    """
+    Detectar el dialecto csv de un archivo de entrada a partir de su comienzo.
+    Si la cabecera tiene todos los campos inFieldNames al separarla por alguno
+    de headerDelimiters, el dialecto es excel con ese delimitador, sin usar
+    csv.Sniffer (que puede confundir el delimitador en extractos con pocas
+    columnas distintas). Si no, se usa csv.Sniffer sobre sample. El dialecto
+    se guarda en dialectsCache por la línea de cabecera, para no volver a
+    detectarlo en archivos con la misma cabecera.
+
+    ARGUMENTOS:
+        - sample: comienzo (p. ej. 1024 caracteres) del archivo como texto.
+
+    RETORNO:
+        Dialecto csv.
+    """
+
+    headerLine = sample.lstrip("\ufeff").split("\n", 1)[0].rstrip("\r")
+    dialect = dialectsCache.get(headerLine)
+    if dialect is not None:
+        return dialect
+
+    for delimiter in headerDelimiters:
+        header = next(csv.reader([headerLine], "excel", delimiter=delimiter))
+        if set(inFieldNames).issubset(header):
+            dialect = type("InDialect", (csv.excel,), \
+                    {"delimiter": delimiter})
+            break
+    else:
+        dialect = csv.Sniffer().sniff(sample)
+
+    dialectsCache[headerLine] = dialect
+    return dialect
+
+
+
+# Extensiones de archivo comprimido admitidas (ver openTrxnsFile).
+compressionExtensions = (".gz", ".zst", ".zip")
+
+
+def getCompression(fileName):
+    """
+    Obtener la extensión de compresión de un archivo (ver
+    compressionExtensions), o None si no está comprimido.
+    """
+    extension = os.path.splitext(fileName)[1].lower()
+    return extension if extension in compressionExtensions else None
+
+
+
+class ArchiveTextFile(io.TextIOWrapper):
+    """
+    Archivo de texto sobre un miembro de un archivo zip que, al cerrarse,
+    cierra también el archivo zip.
+    """
+
+    def __init__(self, archive, member, **kwargs):
+        super().__init__(member, **kwargs)
+        self.archive = archive
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self.archive.close()
+
+
+
+def openTrxnsFile(fileName, mode="r", buffering=-1, encoding=None, \
+        memberExtension=".csv"):
+    """
+    Abrir en modo texto (con newline='') un archivo de entrada o salida, sin
+    comprimir o comprimido según su extensión: .gz (gzip), .zst (zstandard,
+    si está instalado) o .zip. Se descomprime o comprime conforme se lee o
+    escribe, sin pasar por un archivo intermedio en disco. Un .zip de entrada
+    debe tener un solo archivo, o se lee el primero con memberExtension; al
+    escribir se crea con un solo archivo con su nombre sin .zip (y
+    memberExtension si no tiene extensión).
+
+    ARGUMENTOS:
+        - fileName: nombre del archivo.
+        - mode: "r" o "w".
+        - buffering: búfer del archivo (ver open). De los comprimidos solo se
+        usa al leer .zst, como búfer de los datos ya descomprimidos.
+        - encoding: codificación del texto. Si None la de open.
+        - memberExtension: extensión del archivo dentro de un .zip.
+
+    RETORNO:
+        Archivo de texto.
+
+    EXCEPCIONES:
+        Si es .zst y no está instalado zstandard, o si el .zip de entrada no
+        tiene un archivo que leer.
+    """
+
+    compression = getCompression(fileName)
+    if compression is None:
+        return open(fileName, mode, newline='', buffering=buffering, \
+                encoding=encoding)
+
+    bufferSize = buffering if buffering > 1 else io.DEFAULT_BUFFER_SIZE
+    if compression == ".gz":
+        binFile = gzip.open(fileName, mode + "b", compresslevel=6)
+    elif compression == ".zst":
+        assert zstd is not None, trxnErrors["NO_ZSTD"]
+        rawFile = open(fileName, mode + "b")
+        if mode == "r":
+            binFile = io.BufferedReader(zstd.ZstdDecompressor().stream_reader(\
+                    rawFile, closefd=True), bufferSize)
+        else:
+            binFile = zstd.ZstdCompressor().stream_writer(rawFile, \
+                    closefd=True)
+    else:
+        archive = zipfile.ZipFile(fileName, mode, zipfile.ZIP_DEFLATED)
+        if mode == "r":
+            names = [info.filename for info in archive.infolist() \
+                    if not info.is_dir()]
+            members = names if len(names) == 1 else [name for name in names \
+                    if name.lower().endswith(memberExtension)]
+            if not members:
+                archive.close()
+            assert members, trxnErrors["ZIP_MEMBERS"] + f": {fileName}"
+            member = archive.open(members[0])
+        else:
+            memberName = os.path.basename(fileName)[:-len(compression)]
+            if not os.path.splitext(memberName)[1]:
+                memberName += memberExtension
+            memberInfo = zipfile.ZipInfo(memberName, time.localtime()[:6])
+            memberInfo.compress_type = zipfile.ZIP_DEFLATED
+            member = archive.open(memberInfo, "w", force_zip64=True)
+        return ArchiveTextFile(archive, member, encoding=encoding, \
+                newline='')
+
+    return io.TextIOWrapper(binFile, encoding=encoding, newline='')
+
+
+
+def peekText(file, size=1024):
+    """
+    Obtener los primeros caracteres de un archivo de texto recién abierto sin
+    consumirlos, para detectar su dialecto. Si el archivo tiene un búfer con
+    peek (archivos normales, gzip, zip y zstandard de openTrxnsFile) se
+    decodifica el comienzo del búfer y no hace falta volver atrás, lo que no
+    admiten los flujos comprimidos. Si no, se lee y se vuelve al inicio.
+    """
+    peek = getattr(getattr(file, "buffer", None), "peek", None)
+    if peek is None:
+        sample = file.read(size)
+        file.seek(0)
+        return sample
+    return peek(size)[:size * 4].decode(file.encoding, "ignore")[:size]
+
+
+
+def csvOpen(file, mode="r", dialect=None, isDict=True, fieldnames=None, \
+        amountKeys=None):
     """
     Abrir un archivo csv para acceder a sus datos parseados.
 
+    ARGUMENTOS:
+        - amountKeys: en modo escritura de diccionarios, claves de los campos
+        con cantidades enteras a formatear al escribir (ver
+        AmountsDictWriter).
+
     MEJORAS:
         Intentar meter la opción extrasaction en DictWriter.
     """
     if dialect is None and 'r' == mode:
-        dialect = csv.Sniffer().sniff(file.read(1024))
-        file.seek(0)
+        dialect = sniffDialect(peekText(file))
     elif dialect is None and "w" == mode:
         dialect = "excel"
     elif "r" != mode != "w" :
@@ -141,6 +485,9 @@ def csvOpen(file, mode="r", dialect=None, isDict=True, fieldnames=None):
     if isDict:
         csvParser = csv.DictReader if 'r' in mode else csv.DictWriter
         args = {"dialect":dialect, "fieldnames":fieldnames}
+        if amountKeys is not None and 'w' in mode:
+            csvParser = AmountsDictWriter
+            args["amountKeys"] = amountKeys
     else:
         csvParser = csv.reader if 'r' in mode else csv.writer
         args = {"dialect":dialect}
@@ -165,22 +512,141 @@ def csvWriteRows(csvWriter, rows, mapFieldNames=None):
     antiguo de campo, y el valor el nuevo nombre. Si None, los nombres de
     campo no cambian y se mantienen igual a los nombres de los campos de entrada
 
+    RETORNO:
+        Número de caracteres escritos. Si csvWriter escribe por lotes
+        (isBatched, ver TrxnsSink), rows se le pasa entero a writerows y se
+        devuelve lo que retorne.
+
     MEJORAS:
         - Gestionar errores.
     """
 
     # Meter todo el código en un try para lanzar excepciones.
+    if mapFieldNames is None and getattr(csvWriter, "isBatched", False):
+        return csvWriter.writerows(rows)
     if mapFieldNames is None:
-        return csWriter.writerows(rows)
+        return sum(map(csvWriter.writerow, rows))
+
+    return sum(csvWriter.writerow(changeKeys(row, mapFieldNames)) \
+            for row in rows)
+
+
+
+def csvReadOffsets(binFile, fieldNames, dialect, encoding="utf-8"):
+    """
+    Leer filas csv de un archivo binario indicando la posición en bytes donde
+    empieza cada fila, de manera que se pueda volver a ella con seek.
 
-    for row in rows:
-        csvWriter.writerow(changeKeys(row, mapFieldNames))
-    return
+    ARGUMENTOS:
+        - binFile: archivo abierto en modo binario, posicionado al inicio de
+        una fila.
+        - fieldNames: nombres de los campos de cada fila.
+        - dialect: dialecto csv de las filas.
+        - encoding: codificación del archivo.
+
+    RETORNO:
+        Generador de tuplas (posición, fila), donde fila es un diccionario
+        como los de DictReader. Las filas vacías se saltan.
+    """
+
+    position = [binFile.tell()]
+
+    def readLines():
+        for line in binFile:
+            position[0] += len(line)
+            yield line.decode(encoding)
+
+    rowStart = position[0]
+    for row in csv.reader(readLines(), dialect):
+        if row:
+            yield rowStart, dict(zip(fieldNames, row))
+        rowStart = position[0]
 
 
 
 # *** FUNCIONES PARA OBTENER UN VALOR A PARTIR DE VARIOS ***
 
+def parseDateYmd(strDate):
+    """
+    Parsear por posiciones una cadena fecha con formato "%Y-%m-%d %H:%M:%S".
+    """
+    if len(strDate) != 19 or strDate[4] != "-" or strDate[7] != "-" or \
+            strDate[10] != " " or strDate[13] != ":" or strDate[16] != ":":
+        raise ValueError(strDate)
+    return dt.datetime(int(strDate[0:4]), int(strDate[5:7]), \
+            int(strDate[8:10]), int(strDate[11:13]), int(strDate[14:16]), \
+            int(strDate[17:19]))
+
+
+
+def parseDateDmy(strDate):
+    """
+    Parsear por posiciones una cadena fecha con formato "%d-%m-%Y %H:%M:%S".
+    """
+    if len(strDate) != 19 or strDate[2] != "-" or strDate[5] != "-" or \
+            strDate[10] != " " or strDate[13] != ":" or strDate[16] != ":":
+        raise ValueError(strDate)
+    return dt.datetime(int(strDate[6:10]), int(strDate[3:5]), \
+            int(strDate[0:2]), int(strDate[11:13]), int(strDate[14:16]), \
+            int(strDate[17:19]))
+
+
+
+# Pseudoformato de salida con los segundos desde epoch (UTC) de la fecha, para
+# ordenar o comparar tiempos. Solo sirve para formatear, no para parsear.
+epochSecondsFormat = "epoch"
+epochDate = dt.datetime(1970, 1, 1)
+# Formatos de fecha con parseo/formateo rápido por posiciones. El resto de
+# formatos usa strptime/strftime.
+fastDateParsers = {"%Y-%m-%d %H:%M:%S": parseDateYmd, \
+                   "%d-%m-%Y %H:%M:%S": parseDateDmy}
+fastDateFormatters = \
+        {"%Y-%m-%d %H:%M:%S": lambda d: f"{d.year:04d}-{d.month:02d}-" \
+            f"{d.day:02d} {d.hour:02d}:{d.minute:02d}:{d.second:02d}", \
+         "%d-%m-%Y %H:%M:%S": lambda d: f"{d.day:02d}-{d.month:02d}-" \
+            f"{d.year:04d} {d.hour:02d}:{d.minute:02d}:{d.second:02d}", \
+         "%d-%m-%Y": lambda d: f"{d.day:02d}-{d.month:02d}-{d.year:04d}", \
+         epochSecondsFormat: lambda d: (d - epochDate).total_seconds()}
+
+
+
+def parseDate(strDate, dateFormat):
+    """
+    Obtener el datetime de una cadena fecha. Si el formato tiene parser rápido
+    en fastDateParsers se usa, y si la cadena no encaja se recurre a strptime.
+
+    ARGUMENTOS:
+        - strDate: Cadena con la fecha.
+        - dateFormat: Cadena representando el formato completo de la fecha.
+
+    RETORNO:
+        datetime representando la fecha.
+
+    EXCEPCIONES:
+        ValueError si la cadena no tiene el formato dateFormat.
+    """
+    fastParser = fastDateParsers.get(dateFormat)
+    if fastParser is not None:
+        try:
+            return fastParser(strDate)
+        except ValueError:
+            pass
+    return dt.datetime.strptime(strDate, dateFormat)
+
+
+
+def formatDate(date, dateFormat):
+    """
+    Obtener la cadena de un datetime con un formato, usando el formateo rápido
+    de fastDateFormatters si existe para ese formato.
+    """
+    fastFormatter = fastDateFormatters.get(dateFormat)
+    if fastFormatter is not None:
+        return fastFormatter(date)
+    return date.strftime(dateFormat)
+
+
+
 def applyDateFormat(strDate, dateFormat, newDateFormat):
     """
     Transformar una cadena fecha de un formato determinado a una cadena fecha
@@ -194,8 +660,135 @@ def applyDateFormat(strDate, dateFormat, newDateFormat):
     RETORNO:
         Cadena representando la fecha con el nuevo formato.
     """
-    fechaTrxn = dt.datetime.strptime(strDate, dateFormat)
-    return fechaTrxn.strftime(newDateFormat)
+    return formatDate(parseDate(strDate, dateFormat), newDateFormat)
+
+
+
+def wrapDateStage(dateFormat, newDateFormats, cacheSize=4096):
+    """
+    Obtener una función que parsea una única vez cada cadena fecha y devuelve
+    la fecha en todos los nuevos formatos a la vez. Los resultados se guardan
+    en una caché LRU acotada, indexados tanto por la cadena original como por
+    cada una de las cadenas resultado, de manera que, p.ej, el día de una
+    Fecha ya transformada se obtiene sin volver a parsearla. Con
+    epochSecondsFormat entre los nuevos formatos, la misma caché da también los
+    segundos de cada fecha para ordenar o comparar tiempos.
+
+    ARGUMENTOS:
+        - dateFormat: formato por defecto de las cadenas fecha recibidas.
+        - newDateFormats: secuencia de formatos en los que devolver la fecha.
+        - cacheSize: número máximo de entradas en la caché.
+
+    RETORNO:
+        Función getDates(strDate, strFormat=dateFormat) que devuelve una tupla
+        con la fecha en cada uno de los formatos de newDateFormats.
+    """
+
+    newDateFormats = tuple(newDateFormats)
+    cache = cl.OrderedDict()
+
+    def getDates(strDate, strFormat=dateFormat):
+        key = (strDate, strFormat)
+        dates = cache.get(key)
+        if dates is not None:
+            cache.move_to_end(key)
+            return dates
+
+        date = parseDate(strDate, strFormat)
+        dates = tuple(formatDate(date, newFormat) for newFormat in \
+                newDateFormats)
+        cache[key] = dates
+        for newDate, newFormat in zip(dates, newDateFormats):
+            if newFormat != epochSecondsFormat:
+                cache[(newDate, newFormat)] = dates
+        while len(cache) > cacheSize:
+            cache.popitem(last=False)
+        return dates
+
+    return getDates
+
+
+
+def getDateField(strDate, getDates, strFormat, pos):
+    """
+    Obtener uno de los formatos de una fecha a partir de la función devuelta
+    por wrapDateStage.
+
+    ARGUMENTOS:
+        - strDate: Cadena con la fecha.
+        - getDates: función obtenida con wrapDateStage.
+        - strFormat: formato de strDate.
+        - pos: posición del formato deseado dentro de los newDateFormats
+        pasados a wrapDateStage.
+
+    RETORNO:
+        Cadena con la fecha en el formato de la posición pos.
+    """
+    return getDates(strDate, strFormat)[pos]
+
+
+
+# Las cantidades se guardan como enteros en unidades de 1e-8 (la precisión de
+# Binance) y solo se formatean como cadena al escribirlas.
+AMOUNT_DECIMALS = 8
+AMOUNT_SCALE = 10 ** AMOUNT_DECIMALS
+
+
+def parseAmount(value):
+    """
+    Parsear una cadena cantidad a un entero en unidades de 1e-8 sin pasar por
+    float.
+
+    ARGUMENTOS:
+        - value: cadena con la cantidad, p.ej: "-0.00150000". Si tiene más de
+        AMOUNT_DECIMALS decimales o notación científica se redondea.
+
+    RETORNO:
+        Entero con la cantidad escalada por AMOUNT_SCALE.
+
+    EXCEPCIONES:
+        ValueError si la cadena no representa un número.
+    """
+    intPart, point, decPart = value.strip().partition(".")
+    if len(decPart) <= AMOUNT_DECIMALS and \
+            (intPart + decPart).lstrip("+-").isdigit():
+        return int(intPart + decPart.ljust(AMOUNT_DECIMALS, "0"))
+
+    try:
+        return int(dc.Decimal(value).scaleb(AMOUNT_DECIMALS).to_integral_value())
+    except dc.InvalidOperation:
+        raise ValueError(f"Cantidad incorrecta: {value!r}")
+
+
+
+def formatAmount(units):
+    """
+    Formatear una cantidad en unidades de 1e-8 como cadena con
+    AMOUNT_DECIMALS decimales.
+    """
+    sign = "-" if units < 0 else ""
+    intPart, decPart = divmod(abs(units), AMOUNT_SCALE)
+    return f"{sign}{intPart}.{decPart:0{AMOUNT_DECIMALS}d}"
+
+
+
+def formatTrxnAmounts(trxn, amountKeys):
+    """
+    Formatear in-place las cantidades enteras de una transacción.
+
+    ARGUMENTOS:
+        - trxn: transacción (mapping) a formatear.
+        - amountKeys: claves de la transacción con cantidades. Los valores que
+        no son enteros (p.ej: "") se dejan igual.
+
+    RETORNO:
+        La misma transacción trxn con las cantidades como cadena.
+    """
+    for key in amountKeys:
+        value = trxn.get(key)
+        if type(value) is int:
+            trxn[key] = formatAmount(value)
+    return trxn
 
 
 
@@ -216,6 +809,22 @@ def joinStrValues(*values):
 
 
 
+def tupleValues(*values):
+    """
+    Agrupar varios valores en una tupla sin convertirlos. A diferencia de
+    joinStrValues, valores distintos nunca dan el mismo resultado (p.e.
+    "ab"+"c" y "a"+"bc"), y la tupla es hashable si lo son sus valores.
+
+    ARGUMENTOS:
+        - values: lista de valores a agrupar.
+
+    RETORNO:
+        Tupla con los valores en el mismo orden.
+    """
+    return values
+
+
+
 def getParsedValue(*values, getValue=joinStrValues, valueParsers=None):
     """
     Obtener un valor a partir de una serie de valores. Antes de obtener el valor
@@ -247,7 +856,7 @@ def getParsedValue(*values, getValue=joinStrValues, valueParsers=None):
 
 
 # Intentar hacer las funciones que obtienen valores de grupo de manera genérica.
-def getGroupId(typeValue, *values, getValue=joinStrValues, valueParsers=None):
+def getGroupId(typeValue, *values, getValue=tupleValues, valueParsers=None):
     """
     Obtener el valor que representa el groupId a partir de los valores de una
     serie de campos pertenecientes a una transacción. Antes de obtener el valor
@@ -270,6 +879,7 @@ def getGroupId(typeValue, *values, getValue=joinStrValues, valueParsers=None):
 
     RETORNO:
         GroupId resultado de aplicar getValue a la lista de valores parseados.
+        Por defecto una tupla (typeValue, *values) con los valores parseados.
     """
     values = (typeValue,) + values
     return getParsedValue(*values, getValue=getValue, valueParsers=valueParsers)
@@ -294,12 +904,39 @@ trxnErrors = \
             "Falta transacción de venta o compra en el mismo grupo", \
          "NUM_GROUP_TRXNS": \
             "Número incorrecto de transacciones en el grupo.", \
+         "AMBIGUOUS_GROUP_PAIRS": \
+            "No se pueden emparejar compras y ventas de varias monedas en el " \
+            "mismo grupo", \
          "TYPE_GROUP_TRXNS": \
             "Tipo incorrecto de transacciones en el grupo.", \
          "COIN_GROUP_STAKING": \
             "Distintas monedas al agrupar por staking", \
+         "EMPTY_COIN_STAKING": \
+            "Transacción de staking con valor obtenido pero sin moneda", \
          "EMPTY_GET_PROCESS_TRXN": \
-            "No existe la función para obtener el nuevo valor del campo."
+            "No existe la función para obtener el nuevo valor del campo.", \
+         "NO_NUMPY": \
+            "El motor numpy y el formato columnar necesitan tener " \
+            "instalado numpy.", \
+         "SAME_IN_OUT_FILE": \
+            "El archivo de salida sobrescribiría el de entrada", \
+         "DAY_BEFORE_CHECKPOINT": \
+            "Transacción de un día ya cerrado en el checkpoint", \
+         "CACHE_MODE": \
+            "La caché solo se usa con el motor rows, en memoria y un proceso", \
+         "CACHE_FORMAT": \
+            "Archivo de caché de transacciones incorrecto", \
+         "SQLITE_MODE": \
+            "El motor sqlite solo se usa en un proceso y sin caché", \
+         "NO_ZSTD": \
+            "Los archivos .zst necesitan tener instalado zstandard.", \
+         "ZIP_MEMBERS": \
+            "No hay ningún archivo que leer en el zip", \
+         "MAPPING_RULES": \
+            "Reglas de clasificación de operaciones incorrectas", \
+         "COMPRESSED_MODE": \
+            "Un archivo comprimido no se puede leer con --mmap, --from/--to " \
+            "ni --incremental"
         }
 
 
@@ -420,7 +1057,7 @@ def wrapGetTrxnValueByType(typeKey, mapGetValueKeysByType):
 
 # Los campos que no tienen valores se dejan sin clave si es diccionario. Si
 # es lista se deja vacío.
-def processNewTrxnKeys(trxn, newKeysProcess):
+def processNewTrxnKeys(trxn, newKeysProcess, outType=cl.OrderedDict):
     """
     A partir de una transacción obtener una nueva cambiando sus claves/índices y
     valores.
@@ -439,10 +1076,12 @@ def processNewTrxnKeys(trxn, newKeysProcess):
             asociada solo puede tener una clave/índice, cuyo valor en la
             transacción se tomará directamente como el nuevo valor para la
             nueva clave/índice en la nueva transacción.
+        - outType: tipo mapping de la nueva transacción si newKeysProcess es
+        un diccionario (p.ej: OutTrxn).
 
     RETORNO:
         Si newKeysProcess es un diccionario, retorna una transacción de tipo
-        OrderedDict. Si desea que las claves estén ordenadas, el diccionario
+        outType. Si desea que las claves estén ordenadas, el diccionario
         pasado como argumento debe ser OrderedDict.
         Si newKeysProcess es una secuencia, devuelve una transacción de tipo
         lista. Los índices de la lista actúan como las nuevas claves.
@@ -455,7 +1094,7 @@ def processNewTrxnKeys(trxn, newKeysProcess):
     # Depósito y retrada ****
     try:
         newKeysProcess = newKeysProcess.items()
-        outTrxn = cl.OrderedDict()
+        outTrxn = outType()
     except AttributeError:
         newKeysProcess = newKeysProcess.enumerate()
         outTrxn = [None] * len(newKeysProcess)
@@ -501,157 +1140,378 @@ def wrapProcessNewTrxnKeys(newKeysProcess):
 
 
 
-def mergeStakingTrxns(trxns, coinIndex, stakedIndex):
+def getPlanEntry(planEntry):
     """
-    Unir transacciones de tipo staking.
+    Normalizar una entrada del plan de campos de salida a la tupla
+    (getValue, keys, endArgs).
 
     ARGUMENTOS:
-        - trxns: lista de transacciones a unir como un solo staking. Las
-        transacciones de la lista serán modificados in-place.
-        - coinIndex: moneda conseguida en staking.
-        - stakedIndex: clave/índice de la transacción donde se encuentra la
-        el valor obtenido en staking.
+        - planEntry: tupla (getValue, keys) o (getValue, keys, endArgs), o
+        función que recibe la transacción completa. Si getValue es None, keys
+        solo puede tener una clave, cuyo valor se toma directamente.
 
     RETORNO:
-        Devuelve la transacción resultado de la unión, que es la transacción
-        base modificada in-place. El valor resultado de la unión se guarda como
-        str.
+        Tupla (getValue, keys, endArgs). Si planEntry es una función se
+        devuelve (planEntry, None, ()), indicando que recibe la transacción.
 
     EXCEPCIONES:
-        Si el tipo de moneda de dos transacciones es distinta se lanza excepción
+        Si getValue es None y keys no tiene una sola clave.
     """
 
-    assert trxns, trxnErrors["NUM_GROUP_TRXNS"] + ": 0"
-
-    outTrxn = trxns.pop(0)
-    outTrxns = [outTrxn]
-    for trxn in trxns:
-        assert outTrxn[coinIndex] == trxn[coinIndex], \
-                    trxnErrors["COIN_GROUP_STAKING"] + \
-                    f": {outTrxn[coinIndex]}, {trxn[coinIndex]}"
-
-        outTrxn[stakedIndex] = float(outTrxn[stakedIndex]) + \
-                float(trxn[stakedIndex])
+    if callable(planEntry):
+        return planEntry, None, ()
 
-    outTrxn[stakedIndex] = str(outTrxn[stakedIndex])
-    return outTrxns
+    getValue, keys, *endArgs = planEntry
+    endArgs = tuple(endArgs[0]) if endArgs else ()
+    assert getValue is not None or len(keys) == 1, \
+            trxnErrors["EMPTY_GET_PROCESS_TRXN"] + f": {keys}"
+    return getValue, tuple(keys), endArgs
 
 
 
 
-def mergeTradeTrxns(trxns, buyCoinIndex, buyValueIndex, sellCoinIndex, \
-        sellValueIndex, feeCoinIndex, feeValueIndex, commentIndex):
+def planToGetsValues(newKeysPlan):
     """
-    Unir hasta tres transacciones de tipo trading. Si la transacción comisión
-    no puede unirse se devuelve como trxns aparte.
+    Obtener, a partir de un plan de campos de salida, el diccionario de
+    funciones usado por processNewTrxnKeys.
 
     ARGUMENTOS:
-        - trxns: lista de transacciones del mismo grupo trading.
-        - buyCoinIndex: clave/índice de la moneda de compra.
-        - buyValueIndex: clave/índice de la cantidad de moneda comprada.
-        - sellCoinIndex: clave/índice de la moneda de venta.
-        - sellValueIndex: clave/índice de la cantidad de moneda vendida.
-        - feeCoinIndex: clave/índice de la moneda de comisión.
-        - feeValueIndex: clave/índice de la cantidad de moneda en comisión.
-        - commentIndex: clave/índice del comentario.
+        - newKeysPlan: diccionario donde cada clave es la nueva clave de la
+        transacción y el valor una entrada del plan (ver getPlanEntry).
 
     RETORNO:
-        Devuelve lista con transacciones resultado de unirlas. Si la transacción
-        comisión no se puede unir se devuelve dentro de la lista.
-        La lista de transacciones de entrada quedan modificadas.
-
-    EXCEPCIONES:
-        Si el número de transacciones del grupo es mayor que 3
-        Si hay compra, venta o comisión repetida dentro de las transacciones.
-        Si falta compra o venta en las transacciones.
+        OrderedDict donde cada nueva clave tiene asociada la función que recibe
+        la transacción y devuelve el nuevo valor.
     """
 
-    trxnsNum = len(trxns)
-    assert trxns or trxnsNum > 3, \
-            trxnErrors["NUM_GROUP_TRXNS"] + ": " + len(trxns)
-
-    feeTrxn = outTrxn = None
-    for trxn in trxns:
-        feeCoin = getItem(trxn, feeCoinIndex, "")
-        assert feeCoin == "" or feeTrxn is None, \
-                trxnErrors["DOUBLE_GROUP_FEE"] + f": {feeTrxn} | {trxn}"
-        if feeCoin != "":
-            assert trxnsNum != 2, \
-                    trxnErrors["EMPTY_GROUP_OP"] + f": {trxn}"
-            if trxnsNum == 1:
-                return [trxn]
-            feeTrxn = trxn
-            continue
-
-        if outTrxn is None:
-            assert trxnsNum != 1, \
-                    trxnErrors["EMPTY_GROUP_OP"] + f": {trxn}"
-            outTrxn = trxn
-            outTrxns = [outTrxn]
+    getsValues = cl.OrderedDict()
+    for newKey, planEntry in newKeysPlan.items():
+        getValue, keys, endArgs = getPlanEntry(planEntry)
+        if keys is None:
+            getsValues[newKey] = getValue
             continue
+        if getValue is None:
+            getValue = lambda value: value
+        getsValues[newKey] = wrapGetTrxnValue(wrapf(getValue, *endArgs), \
+                *keys)
 
-        for coinIndex, valueIndex in {buyCoinIndex: buyValueIndex, \
-                sellCoinIndex: sellValueIndex}.items():
-            inCoin = getItem(trxn, coinIndex, "")
-            outCoin = getItem(outTrxn, coinIndex, "")
-            assert outCoin == "" or inCoin == "", \
-                    trxnErrors["DOUBLE_GROUP_OP"] + f": {outTrxn} | {trxn}"
-            assert outCoin != "" or inCoin != "", \
-                    trxnErrors["EMPTY_GROUP_OP"] + f": {outTrxn} | {trxn}"
-            if outCoin == "" and inCoin != "":
-                outTrxn[coinIndex] = inCoin
-                outTrxn[valueIndex] = getItem(trxn, valueIndex, "")
-
-    outTrxn[commentIndex] = f"{outTrxn[sellCoinIndex]} a {outTrxn[buyCoinIndex]}"
-
-    if feeTrxn is None:
-        return outTrxns
-
-    if getItem(outTrxn, buyCoinIndex) == getItem(feeTrxn, feeCoinIndex):
-        buyValue = float(getItem(outTrxn, buyValueIndex, 0))
-        feeValue = float(getItem(feeTrxn, feeValueIndex, 0))
-        if buyValue > feeValue:
-            outTrxn[buyValueIndex] = str(buyValue - feeValue)
-            outTrxn[feeCoinIndex] = getItem(feeTrxn, feeCoinIndex)
-            outTrxn[feeValueIndex] = getItem(feeTrxn, feeValueIndex)
-            return outTrxns
-    elif getItem(outTrxn, sellCoinIndex) == getItem(feeTrxn, feeCoinIndex):
-        sellValue = float(getItem(outTrxn, sellValueIndex, 0))
-        feeValue = float(getItem(feeTrxn, feeValueIndex, 0))
-        outTrxn[sellValueIndex] = str(sellValue + feeValue)
-        outTrxn[feeCoinIndex] = getItem(feeTrxn, feeCoinIndex)
-        outTrxn[feeValueIndex] = getItem(feeTrxn, feeValueIndex)
-        return outTrxns
-
-    feeTrxn[commentIndex] = f"{outTrxn[sellCoinIndex]} a {outTrxn[buyCoinIndex]}"
-
-    outTrxns.append(feeTrxn)
-    return outTrxns
+    return getsValues
 
 
 
 
-# Cada groupId debe ser único, sean los grupos del mismo tipo o no
-def mergeTrxnsGroupsByType(trxnsGroups, typeIndex, typeMerges):
+def parseTrxnFields(trxn, inParsers):
     """
-    Realiza la unión, por cada grupo, de una lista de transacciones candidatas
-    a ser juntadas en una sola transacción. El método usado para realizar el
-    merge de las transacciones depende de un campo de la transacción.
+    Obtener una copia de la transacción con algunos de sus campos parseados,
+    de manera que cada campo se parsee una sola vez por transacción.
 
     ARGUMENTOS:
-        - trxnsGroups: lista de listas o grupos de transacciones a realizar
-        merge por grupo.
-        - typeIndex: clave/índice de la transacción donde se encuentra el valor
-        del campo. Se parte del hecho de que todas las transacciones de un
-        mismo grupo tienen el mismo valor para ese campo.
-        - typeMerges: diccionario que empareja por tipo de transacción del
-        grupo una función para unir las transacciones de un mismo grupo.
-        Esta función recibirá como argumentos una lista de transacciones del
-        mismo grupo a realizar el merge. Si un tipo no tiene merge en este
-        diccionario, las transacciones del grupo no se agrupan ni modifican.
+        - trxn: transacción (mapping) de entrada.
+        - inParsers: diccionario donde por cada clave de la transacción existe
+        la función que parsea su valor.
 
     RETORNO:
-        Transacción resultado de la unión de las transacciones del mismo grupo.
+        Diccionario copia de trxn con los campos de inParsers parseados.
+    """
+    trxn = dict(trxn)
+    for key, parser in inParsers.items():
+        trxn[key] = parser(trxn.get(key, ""))
+    return trxn
+
+
+
+
+def compileNewTrxnKeys(newKeysPlan, inParsers=None, inSeqType=None, \
+        outType=cl.OrderedDict):
+    """
+    Compilar un plan de campos de salida en una sola función especializada
+    que transforma cada transacción sin pasar por wrapf, getTrxnValue ni
+    getItem. Cada campo de entrada se lee una única vez por transacción y las
+    funciones y argumentos fijos quedan enlazados como constantes.
+
+    ARGUMENTOS:
+        - newKeysPlan: diccionario donde cada clave es la nueva clave de la
+        transacción y el valor una entrada del plan (ver getPlanEntry). Las
+        transacciones de entrada deben ser mappings.
+        - inParsers: diccionario opcional donde por cada clave de entrada
+        existe una función que parsea su valor una única vez por transacción
+        antes de pasarlo a las funciones del plan (ver parseTrxnFields).
+        - inSeqType: tipo opcional de tupla (p.ej: InTrxn) con atributo
+        fieldIndexes (clave -> posición). Las transacciones de este tipo se
+        leen por posición, desempaquetando la tupla, en vez de por clave.
+        - outType: tipo de la transacción de salida. Un mapping que se crea a
+        partir de pares (clave, valor), como OrderedDict, o un tipo con
+        __slots__ y fieldKeys, como OutTrxn, cuyos campos se asignan
+        directamente como atributos ("" los que no están en el plan, y False
+        los atributos de __slots__ que no son campos).
+
+    RETORNO:
+        Función equivalente a aplicar parseTrxnFields(trxn, inParsers) y
+        después wrapProcessNewTrxnKeys(planToGetsValues(newKeysPlan)): recibe
+        una transacción y devuelve una de tipo outType.
+
+    EXCEPCIONES:
+        Si una función del plan es None y su lista de claves no tiene una sola
+        clave.
+    """
+
+    if inParsers is None:
+        inParsers = {}
+    env = {"outType": outType, "newKeys": tuple(newKeysPlan), \
+            "seqType": inSeqType}
+    inVars = {}
+    outValues = []
+
+    for pos, planEntry in enumerate(newKeysPlan.values()):
+        getValue, keys, endArgs = getPlanEntry(planEntry)
+        if keys is None:
+            env[f"f{pos}"] = getValue
+            outValues.append(f"f{pos}(trxn)")
+            continue
+
+        args = []
+        for key in keys:
+            if key not in inVars:
+                inVars[key] = f"v{len(inVars)}"
+                env[f"k{inVars[key]}"] = key
+                if key in inParsers:
+                    env[f"p{inVars[key]}"] = inParsers[key]
+            args.append(inVars[key])
+        if getValue is None:
+            outValues.append(args[0])
+            continue
+
+        env[f"f{pos}"] = getValue
+        for argPos, arg in enumerate(endArgs):
+            env[f"c{pos}_{argPos}"] = arg
+            args.append(f"c{pos}_{argPos}")
+        outValues.append(f"f{pos}({', '.join(args)})")
+
+    def getInLines(getIn, indent):
+        lines = []
+        for key, var in inVars.items():
+            value = getIn(key, var)
+            if key in inParsers:
+                value = f"p{var}({value})"
+            lines.append(f"{indent}{var} = {value}")
+        return lines
+
+    lines = ["def processTrxn(trxn):"]
+    getLines = getInLines(lambda key, var: f"get(k{var}, '')", "    ")
+    if inSeqType is not None:
+        seqLen = len(inSeqType.fieldIndexes)
+        seqVars = [f"s{i}" for i in range(seqLen)]
+        lines += ["    if type(trxn) is seqType:", \
+                f"        {', '.join(seqVars)}, = trxn"]
+        lines += getInLines(lambda key, var: \
+                seqVars[inSeqType.fieldIndexes[key]] if key in \
+                inSeqType.fieldIndexes else "''", "        ")
+        lines += ["    else:", "        get = trxn.get"]
+        lines += ["    " + line for line in getLines]
+    else:
+        lines += ["    get = trxn.get"] + getLines
+
+    if hasattr(outType, "fieldKeys"):
+        outValues = dict(zip(newKeysPlan, outValues))
+        lines.append("    out = outType.__new__(outType)")
+        lines.append("    " + ", ".join(f"out.{key}" for key in \
+                outType.__slots__) + " = " + ", ".join(outValues.get(key, \
+                "''" if key in outType.fieldKeys else "False") for key in \
+                outType.__slots__))
+        lines.append("    return out")
+    else:
+        outTuple = "".join(value + ", " for value in outValues)
+        lines.append(f"    return outType(zip(newKeys, ({outTuple})))")
+    exec(compile("\n".join(lines), "<compileNewTrxnKeys>", "exec"), env)
+    return env["processTrxn"]
+
+
+
+
+def mergeStakingTrxns(trxns, coinIndex, stakedIndex):
+    """
+    Unir transacciones de tipo staking.
+
+    ARGUMENTOS:
+        - trxns: lista de transacciones a unir como un solo staking. Las
+        transacciones de la lista serán modificados in-place.
+        - coinIndex: moneda conseguida en staking.
+        - stakedIndex: clave/índice de la transacción donde se encuentra la
+        el valor obtenido en staking, como entero en unidades de 1e-8.
+
+    RETORNO:
+        Devuelve la transacción resultado de la unión, que es la primera
+        transacción con valor obtenido modificada in-place. El valor resultado
+        de la unión se guarda como entero en unidades de 1e-8. Las
+        transacciones sin valor obtenido (intereses cero o negativos) no se
+        unen: se devuelven tal cual, en su orden.
+
+    EXCEPCIONES:
+        Si el tipo de moneda de dos transacciones es distinta, o si una
+        transacción con valor obtenido no tiene moneda, se lanza excepción
+    """
+
+    assert trxns, trxnErrors["NUM_GROUP_TRXNS"] + ": 0"
+
+    outTrxn = None
+    outTrxns = []
+    for trxn in trxns:
+        if trxn[stakedIndex] == "":
+            outTrxns.append(trxn)
+            continue
+
+        assert trxn[coinIndex], trxnErrors["EMPTY_COIN_STAKING"] + \
+                f": {trxn}"
+        if outTrxn is None:
+            outTrxn = trxn
+            outTrxns.append(outTrxn)
+            continue
+
+        assert outTrxn[coinIndex] == trxn[coinIndex], \
+                    trxnErrors["COIN_GROUP_STAKING"] + \
+                    f": {outTrxn[coinIndex]}, {trxn[coinIndex]}"
+
+        outTrxn[stakedIndex] += trxn[stakedIndex]
+
+    return outTrxns
+
+
+
+
+def mergeTradeTrxns(trxns, buyCoinIndex, buyValueIndex, sellCoinIndex, \
+        sellValueIndex, feeCoinIndex, feeValueIndex, commentIndex):
+    """
+    Unir las transacciones de un grupo de tipo trading, sin límite en su
+    número (p. ej. una orden ejecutada contra muchas órdenes en el mismo
+    segundo). En una sola pasada se separan compras y ventas, y se suman las
+    comisiones por moneda. Las compras y las ventas se suman en una sola
+    transacción de salida, para lo que el grupo debe tener una sola moneda
+    de compra y una de venta: con varias (p. ej. conversiones de polvo de
+    varias monedas) no se sabe qué cantidad se cambió por cuál. Cada
+    comisión se descuenta de la compra si es de su moneda y mayor, o se suma
+    a la venta si es de su moneda. Si no puede unirse, se devuelve como
+    transacción aparte.
+
+    ARGUMENTOS:
+        - trxns: lista de transacciones del mismo grupo trading.
+        - buyCoinIndex: clave/índice de la moneda de compra.
+        - buyValueIndex: clave/índice de la cantidad de moneda comprada.
+        - sellCoinIndex: clave/índice de la moneda de venta.
+        - sellValueIndex: clave/índice de la cantidad de moneda vendida.
+        - feeCoinIndex: clave/índice de la moneda de comisión.
+        - feeValueIndex: clave/índice de la cantidad de moneda en comisión.
+        - commentIndex: clave/índice del comentario.
+        Las cantidades son enteros en unidades de 1e-8.
+
+    RETORNO:
+        Devuelve lista con transacciones resultado de unirlas: la de compra y
+        venta y una por cada moneda de comisión que no se pueda unir. Si el
+        grupo solo tiene comisiones, una por moneda de comisión.
+        La lista de transacciones de entrada quedan modificadas.
+
+    EXCEPCIONES:
+        Si el grupo está vacío.
+        Si hay compras pero no ventas, o ventas pero no compras.
+        Si hay varias monedas de compra o varias de venta.
+    """
+
+    assert trxns, trxnErrors["NUM_GROUP_TRXNS"] + ": 0"
+
+    # Por moneda de comisión: [primera transacción, comisión, venta]. Las
+    # transacciones de comisión también tienen la cantidad como venta.
+    buyTrxns, sellTrxns = [], []
+    fees = cl.OrderedDict()
+    for pos, trxn in enumerate(trxns):
+        feeCoin = getItem(trxn, feeCoinIndex, "")
+        if feeCoin != "":
+            if feeCoin not in fees:
+                fees[feeCoin] = [trxn, 0, getItem(trxn, sellValueIndex, "")]
+            elif type(fees[feeCoin][2]) is int:
+                fees[feeCoin][2] += getItem(trxn, sellValueIndex, 0) or 0
+            fees[feeCoin][1] += getItem(trxn, feeValueIndex, 0)
+        elif getItem(trxn, buyCoinIndex, "") != "":
+            buyTrxns.append((pos, trxn))
+        else:
+            assert getItem(trxn, sellCoinIndex, "") != "", \
+                    trxnErrors["EMPTY_GROUP_OP"] + f": {trxn}"
+            sellTrxns.append((pos, trxn))
+
+    def setFeeValues(feeTrxn, feeValue, sellValue):
+        feeTrxn[feeValueIndex] = feeValue
+        feeTrxn[sellValueIndex] = sellValue
+
+    if not buyTrxns and not sellTrxns:
+        for fee in fees.values():
+            setFeeValues(*fee)
+        return [feeTrxn for feeTrxn, _, _ in fees.values()]
+
+    assert buyTrxns and sellTrxns, \
+            trxnErrors["EMPTY_GROUP_OP"] + f": {(buyTrxns or sellTrxns)[0][1]}"
+
+    # Sin precios no se sabe qué cantidad de cada moneda se cambió por cuál,
+    # así que solo se unen los grupos con una moneda por parte.
+    buyCoins = {trxn[buyCoinIndex] for _, trxn in buyTrxns}
+    sellCoins = {trxn[sellCoinIndex] for _, trxn in sellTrxns}
+    assert len(buyCoins) == 1 and len(sellCoins) == 1, \
+            trxnErrors["AMBIGUOUS_GROUP_PAIRS"] + \
+            f": {sorted(sellCoins)} a {sorted(buyCoins)}"
+
+    # La transacción de salida es la primera compra o venta del grupo.
+    buyCoin, sellCoin = buyCoins.pop(), sellCoins.pop()
+    _, outTrxn = min(buyTrxns[0], sellTrxns[0], key=op.itemgetter(0))
+    outTrxn[buyCoinIndex] = buyCoin
+    outTrxn[buyValueIndex] = sum(getItem(trxn, buyValueIndex, 0) \
+            for _, trxn in buyTrxns)
+    outTrxn[sellCoinIndex] = sellCoin
+    outTrxn[sellValueIndex] = sum(getItem(trxn, sellValueIndex, 0) \
+            for _, trxn in sellTrxns)
+    outTrxn[commentIndex] = f"{sellCoin} a {buyCoin}"
+
+    outTrxns = [outTrxn]
+    for feeCoin, (feeTrxn, feeValue, feeSellValue) in fees.items():
+        if getItem(outTrxn, feeCoinIndex, "") == "":
+            if feeCoin == buyCoin:
+                if outTrxn[buyValueIndex] > feeValue:
+                    outTrxn[buyValueIndex] -= feeValue
+                    outTrxn[feeCoinIndex] = feeCoin
+                    outTrxn[feeValueIndex] = feeValue
+                    continue
+            elif feeCoin == sellCoin:
+                outTrxn[sellValueIndex] += feeValue
+                outTrxn[feeCoinIndex] = feeCoin
+                outTrxn[feeValueIndex] = feeValue
+                continue
+
+        setFeeValues(feeTrxn, feeValue, feeSellValue)
+        feeTrxn[commentIndex] = outTrxn[commentIndex]
+        outTrxns.append(feeTrxn)
+
+    return outTrxns
+
+
+
+
+# Cada groupId debe ser único, sean los grupos del mismo tipo o no
+def mergeTrxnsGroupsByType(trxnsGroups, typeIndex, typeMerges):
+    """
+    Realiza la unión, por cada grupo, de una lista de transacciones candidatas
+    a ser juntadas en una sola transacción. El método usado para realizar el
+    merge de las transacciones depende de un campo de la transacción.
+
+    ARGUMENTOS:
+        - trxnsGroups: lista de listas o grupos de transacciones a realizar
+        merge por grupo.
+        - typeIndex: clave/índice de la transacción donde se encuentra el valor
+        del campo. Se parte del hecho de que todas las transacciones de un
+        mismo grupo tienen el mismo valor para ese campo.
+        - typeMerges: diccionario que empareja por tipo de transacción del
+        grupo una función para unir las transacciones de un mismo grupo.
+        Esta función recibirá como argumentos una lista de transacciones del
+        mismo grupo a realizar el merge. Si un tipo no tiene merge en este
+        diccionario, las transacciones del grupo no se agrupan ni modifican.
+
+    RETORNO:
+        Transacción resultado de la unión de las transacciones del mismo grupo.
     """
 
     outTrxns = []
@@ -660,7 +1520,8 @@ def mergeTrxnsGroupsByType(trxnsGroups, typeIndex, typeMerges):
         try:
             outTrxns.extend(typeMerges.get(groupType, lambda x:x)(trxnsGroup))
         except BaseException as e:
-            log.exception(f"Error merge grupo {groupType}: {trxnsGroup}")
+            logger.exception("Error merge grupo %s: %s", groupType, \
+                    trxnsGroup)
             raise e
             # Lanzar excepción creada
 
@@ -669,6 +1530,126 @@ def mergeTrxnsGroupsByType(trxnsGroups, typeIndex, typeMerges):
 
 
 
+def matchTradeGroups(trxnsGroups, tolerance, getTrxnTime, typeIndex, \
+        tradeType, buyCoinIndex, sellCoinIndex, feeCoinIndex, isTradeLeg=None):
+    """
+    Juntar los grupos de trading incompletos cuyas partes (compra, venta o
+    comisión) tienen Fechas a una distancia de como mucho tolerance segundos.
+    El groupId de trading es la Fecha exacta y Binance a veces anota las
+    partes de una misma orden en segundos consecutivos.
+
+    Primero, los grupos con compras pero sin ventas se juntan con los grupos
+    con ventas pero sin compras más cercanos en el tiempo: recorriendo los
+    grupos ordenados por Fecha se obtienen todas las parejas posibles dentro
+    de la tolerancia, y se juntan de la más cercana a la más lejana (a igual
+    distancia, la más antigua primero) sin repetir grupo. Así, dos órdenes
+    cuyas partes se solapan dentro de la tolerancia no se cruzan. Después,
+    cada grupo con solo comisiones se junta con el grupo más cercano dentro
+    de la tolerancia que tenga compra y venta pero no comisión. Las dos
+    listas se recorren ordenadas por Fecha con dos punteros. El coste es el
+    número de grupos por el de grupos dentro de la tolerancia, más su
+    ordenación.
+
+    ARGUMENTOS:
+        - trxnsGroups: iterable de grupos (listas) de transacciones
+        procesadas.
+        - tolerance: diferencia máxima en segundos entre las partes.
+        - getTrxnTime: función que obtiene los segundos de una transacción.
+        - typeIndex: clave/índice del tipo de la transacción.
+        - tradeType: tipo de las transacciones de trading.
+        - buyCoinIndex: clave/índice de la moneda de compra.
+        - sellCoinIndex: clave/índice de la moneda de venta.
+        - feeCoinIndex: clave/índice de la moneda de comisión.
+        - isTradeLeg: función que indica si una transacción es parte de una
+        orden (ver isTradeLeg en OutTrxn). Solo se juntan los grupos con
+        todas sus transacciones partes de órdenes, no p. ej. dos Transaction
+        Related sueltas. Si None, todos los grupos de trading se pueden
+        juntar.
+
+    RETORNO:
+        Lista de grupos en el orden original. Cada grupo juntado va en la
+        posición del primero de los grupos que lo forman.
+    """
+
+    trxnsGroups = list(trxnsGroups)
+    groupsSides = {}
+    for pos, trxnsGroup in enumerate(trxnsGroups):
+        if trxnsGroup[0][typeIndex] != tradeType or isTradeLeg is not None \
+                and not all(map(isTradeLeg, trxnsGroup)):
+            continue
+        sides = set()
+        for trxn in trxnsGroup:
+            if getItem(trxn, feeCoinIndex, "") != "":
+                sides.add("fee")
+            elif getItem(trxn, buyCoinIndex, "") != "":
+                sides.add("buy")
+            else:
+                sides.add("sell")
+        if sides != {"buy", "sell", "fee"}:
+            groupsSides[pos] = sides
+    if not groupsSides:
+        return trxnsGroups
+
+    groupsTimes = {pos: getTrxnTime(trxnsGroups[pos][0]) for pos in groupsSides}
+    absorbed = set()
+
+    def joinGroups(pos, otherPos):
+        pos, otherPos = min(pos, otherPos), max(pos, otherPos)
+        trxnsGroups[pos].extend(trxnsGroups[otherPos])
+        groupsSides[pos] |= groupsSides.pop(otherPos)
+        groupsTimes[pos] = min(groupsTimes[pos], groupsTimes.pop(otherPos))
+        absorbed.add(otherPos)
+        return pos
+
+    # Parejas (distancia, Fecha, grupo, grupo) de un grupo con compras y otro
+    # con ventas, sin la otra parte, dentro de la tolerancia.
+    halfPositions = sorted((pos for pos, sides in groupsSides.items() \
+            if ("buy" in sides) != ("sell" in sides)), key=groupsTimes.get)
+    pairs = []
+    for i, pos in enumerate(halfPositions):
+        isBuy = "buy" in groupsSides[pos]
+        for otherPos in it.islice(halfPositions, i + 1, None):
+            distance = groupsTimes[otherPos] - groupsTimes[pos]
+            if distance > tolerance:
+                break
+            if ("buy" in groupsSides[otherPos]) != isBuy:
+                pairs.append((distance, groupsTimes[pos], pos, otherPos))
+    paired = set()
+    for _, _, pos, otherPos in sorted(pairs):
+        if pos not in paired and otherPos not in paired:
+            paired.update([pos, otherPos])
+            joinGroups(pos, otherPos)
+
+    getSortedGroups = lambda isSides: sorted((pos for pos, sides in \
+            groupsSides.items() if isSides(sides)), key=groupsTimes.get)
+    feePositions = getSortedGroups(lambda sides: sides == {"fee"})
+    tradePositions = getSortedGroups(lambda sides: "fee" not in sides and \
+            {"buy", "sell"} <= sides)
+    first = 0
+    for feePos in feePositions:
+        feeTime = groupsTimes[feePos]
+        while first < len(tradePositions) and \
+                (tradePositions[first] not in groupsTimes or \
+                groupsTimes[tradePositions[first]] < feeTime - tolerance):
+            first += 1
+        nearestPos = None
+        for tradePos in it.islice(tradePositions, first, None):
+            if tradePos not in groupsTimes or "fee" in groupsSides[tradePos]:
+                continue
+            if groupsTimes[tradePos] > feeTime + tolerance:
+                break
+            if nearestPos is None or abs(groupsTimes[tradePos] - feeTime) < \
+                    abs(groupsTimes[nearestPos] - feeTime):
+                nearestPos = tradePos
+        if nearestPos is not None:
+            joinGroups(nearestPos, feePos)
+
+    return [trxnsGroup for pos, trxnsGroup in enumerate(trxnsGroups) \
+            if pos not in absorbed]
+
+
+
+
 def wrapMergeGroupTrxnsByType(typeIndex, typeMerges):
     """
     """
@@ -679,6 +1660,105 @@ def wrapMergeGroupTrxnsByType(typeIndex, typeMerges):
 
 
 
+def reorderTrxns(trxns, getTrxnTime, window):
+    """
+    Reordenar por tiempo unas transacciones casi ordenadas de manera
+    ascendente, usando una ventana de reordenación: cada transacción se
+    retiene hasta que llega otra con un tiempo al menos window segundos
+    posterior (marca de agua), de manera que las transacciones desordenadas
+    dentro de la ventana salen en orden. Solo se mantienen en memoria las
+    transacciones de la ventana.
+
+    ARGUMENTOS:
+        - trxns: iterable de transacciones ordenadas de manera ascendente por
+        tiempo salvo desórdenes menores que window.
+        - getTrxnTime: función que obtiene el tiempo en segundos de una
+        transacción.
+        - window: tamaño en segundos de la ventana de reordenación.
+
+    RETORNO:
+        Generador de las transacciones ordenadas por tiempo. Las transacciones
+        con el mismo tiempo mantienen su orden de entrada. Las transacciones
+        que llegan más tarde de la ventana se avisan en el log y se devuelven
+        inmediatamente.
+    """
+
+    trxnsHeap = []
+    watermark = None
+    for pos, trxn in enumerate(trxns):
+        trxnTime = getTrxnTime(trxn)
+        if watermark is not None and trxnTime < watermark:
+            logger.warning("Transacción fuera de la ventana de reordenación: " \
+                    "%s", trxn, extra={"trxnKey": "reorderWindow"})
+            yield trxn
+            continue
+
+        hq.heappush(trxnsHeap, (trxnTime, pos, trxn))
+        if watermark is None or trxnTime - window > watermark:
+            watermark = trxnTime - window
+        while trxnsHeap and trxnsHeap[0][0] <= watermark:
+            yield hq.heappop(trxnsHeap)[2]
+
+    while trxnsHeap:
+        yield hq.heappop(trxnsHeap)[2]
+
+
+
+
+def externalSortTrxns(trxns, getTrxnKey, fieldNames, runSize=100000, \
+        tmpDir=None):
+    """
+    Ordenar transacciones sin cargarlas todas en memoria (ordenación
+    externa): se ordenan en memoria tramos de runSize transacciones, cada
+    tramo ordenado se escribe en un archivo temporal csv y, al final, se
+    mezclan todos los tramos con heapq.merge. La ordenación es estable.
+
+    ARGUMENTOS:
+        - trxns: iterable de transacciones (mappings) a ordenar.
+        - getTrxnKey: función que obtiene de cada transacción la clave por la
+        que ordenar.
+        - fieldNames: campos de las transacciones a guardar en los tramos.
+        - runSize: número máximo de transacciones en memoria por tramo.
+        - tmpDir: directorio donde crear los archivos temporales. Si None se
+        usa el de por defecto del sistema.
+
+    RETORNO:
+        Generador de las transacciones ordenadas. Si todas caben en un tramo
+        se devuelven tal cual; si no, como diccionarios leídos de los tramos
+        con valores str.
+    """
+
+    runFiles = []
+    try:
+        run = []
+        for trxn in trxns:
+            run.append(trxn)
+            if len(run) < runSize:
+                continue
+            runFiles.append(tf.TemporaryFile("w+", newline="", \
+                    encoding="utf-8", dir=tmpDir))
+            csvRun = csv.DictWriter(runFiles[-1], fieldNames, \
+                    extrasaction="ignore")
+            csvRun.writerows(sorted(run, key=getTrxnKey))
+            run = []
+
+        run.sort(key=getTrxnKey)
+        if not runFiles:
+            yield from run
+            return
+
+        csvRuns = []
+        for runFile in runFiles:
+            runFile.seek(0)
+            csvRuns.append(csv.DictReader(runFile, fieldNames))
+        yield from hq.merge(*csvRuns, run, key=getTrxnKey)
+    finally:
+        for runFile in runFiles:
+            runFile.close()
+
+
+
+
 # El valor del tipo usado para obtener la clave groupId debe estar al inicio o
 # final de los valores usados para obtener groupId. Esto se hace para evitar que
 # dos groupId de dos transacciones con tipos distinto (obtenidos a partir de
@@ -719,8 +1799,11 @@ def csvProcessTrxns(trxnsIn, processTrxn, csvOut=None, mergeTrxnsGroups=None, \
         antiguo de campo, y el valor el nuevo nombre. Si None, los nombres de
         campo no cambian y se mantienen igual a los nombres de los campos de
         entrada.
-        Valor por el que están aglutinadas u ordenadas las transacciones de
-        entrada formando bloques en memoria. Sirve para optimizar la memoria
+        - getTrxnBlockId: función que obtiene de cada transacción procesada el
+        valor por el que están aglutinadas u ordenadas las transacciones de
+        entrada formando bloques en memoria. Cada vez que cambia, los grupos
+        del bloque anterior se unen y se escriben (o añaden a la lista de
+        salida). Sirve para optimizar la memoria
         al ir almacenando solamente cada vez un solo bloque de transacciones que
         tienen este mismo valor. Al usarse esta opción, la unión de
         transacciones (merge) deben ser solo entre las transacciones de un mismo
@@ -738,7 +1821,8 @@ def csvProcessTrxns(trxnsIn, processTrxn, csvOut=None, mergeTrxnsGroups=None, \
     MEJORAS:
 
     """
-    trxnsGroups = cl.OrderedDict()
+    # Basta el orden de inserción de dict para mantener el orden de los grupos.
+    trxnsGroups = {}
     if csvOut is None:
         outTrxns = []
     else:
@@ -748,8 +1832,8 @@ def csvProcessTrxns(trxnsIn, processTrxn, csvOut=None, mergeTrxnsGroups=None, \
     doMerge = mergeTrxnsGroups is not None and getTrxnGroupId is not None
     doBlocks = getTrxnBlockId is not None
 
-    for trxn in trxnsIn:
-        trxn = processTrxn(trxn)
+    for trxnIn in trxnsIn:
+        trxn = processTrxn(trxnIn)
 
         if (not doMerge):
             if (csvOut is None):
@@ -760,217 +1844,2815 @@ def csvProcessTrxns(trxnsIn, processTrxn, csvOut=None, mergeTrxnsGroups=None, \
 
         if (doBlocks):
             blockId = getTrxnBlockId(trxn)
-        if (prevBlockId is not None and prevBlockId != blockId):
-            tempOutTrxns = mergeTrxnsGroups(trxnsGroups.values())
-            if (csvOut is None):
-                outTrxns.extend(tempOutTrxns)
-            else:
-                outTrxns += csvOut.writerows(tempOutTrxns)
+            if (prevBlockId is not None and prevBlockId != blockId):
+                tempOutTrxns = mergeTrxnsGroups(trxnsGroups.values())
+                if (csvOut is None):
+                    outTrxns.extend(tempOutTrxns)
+                else:
+                    outTrxns += csvWriteRows(csvOut, tempOutTrxns)
+                trxnsGroups = {}
             prevBlockId = blockId
-            trxnsGroups = cl.OrderedDict()
 
         groupId = getTrxnGroupId(trxn)
         if groupId is None:
-            log.warning(trxn)
+            operation = trxnIn.get(inFieldNames[3])
+            logger.warning("Transacción sin grupo (%s): %s", operation, trxn, \
+                    extra={"trxnKey": operation})
             continue
-        elif (groupId not in trxnsGroups):
-            trxnsGroups[groupId] = []
-        trxnsGroups[groupId].append(trxn)
+        group = trxnsGroups.get(groupId)
+        if group is None:
+            trxnsGroups[groupId] = [trxn]
+        else:
+            group.append(trxn)
 
     if (doMerge):
         tempOutTrxns = mergeTrxnsGroups(trxnsGroups.values())
         if (csvOut is None):
             outTrxns.extend(tempOutTrxns)
         else:
-            outTrxns += csvOut.writerows(tempOutTrxns)
+            outTrxns += csvWriteRows(csvOut, tempOutTrxns)
 
     return outTrxns
 
 
 
 
-# Los siguientes valores se podrán meter como parámetros al programa, sobre
-# todo al usar interfaz gráfica. Por defecto valores siguientes:
-dateFormat = "%Y-%m-%d %H:%M:%S"
-newDateFormat = "%d-%m-%Y %H:%M:%S"
-newDayFormat = "%d-%m-%Y"
+class SummedTrxnsGroup(list):
+    """
+    Grupo de transacciones ya unido por el motor antes de mergeTrxnsGroups
+    (el staking sumado por numpy o SQLite), con una sola transacción. rowsIn
+    guarda cuántas transacciones lo formaban, para contarlo como unido en
+    TrxnsStats.countGroups igual que con el motor rows.
+    """
 
-inFieldNames = ["User_ID", "UTC_Time", "Account", "Operation", "Coin", \
-        "Change", "Remark"]
-# Tipo es en realidad Operación y Operación es Acción. Cambiar cuando se pueda.
-outFieldNames = ["Tipo", "Operacion", "Compra", "MonedaC", "Venta", "MonedaV",\
-        "Comision", "MonedaF", "Exchange", "Grupo", "Comentario", "Fecha"]
-outTypes = ["Staking", "Trade", "Deposito", "Retirada"]
-inTypes = ["Deposit", "Withdraw", "Small assets exchange BNB", "Fee", "Buy", \
-        "Sell", "Transaction Related", "POS savings interest", \
-        "Super BNB Mining", "Savings Interest", "Large OTC trading"]
-outOps = ["Comision", "Compra", "Venta", "Polvo"]
+    __slots__ = ("rowsIn",)
 
+    def __init__(self, trxns, rowsIn):
+        super().__init__(trxns)
+        self.rowsIn = rowsIn
 
-def getType(operation):
-    parseType = { \
-            inTypes[0]: outTypes[2], \
-            inTypes[1]: outTypes[3], \
-            **dict.fromkeys([inTypes[2], inTypes[3], inTypes[4], inTypes[5], \
-                inTypes[6], inTypes[10]], outTypes[1]),
-            **dict.fromkeys([inTypes[7], inTypes[8], inTypes[9]], outTypes[0])}
-    return parseType.get(operation, None)
 
 
-def getOp(operation):
-    parseOp = { \
-            inTypes[3]: outOps[0],
-            inTypes[2]: outOps[3], \
-            }
-    return parseOp.get(operation, "")
+def getGroupRowsIn(trxnsGroup):
+    """
+    Obtener el número de transacciones de entrada de un grupo, ya esté unido
+    por el motor (SummedTrxnsGroup) o no.
+    """
+    return getattr(trxnsGroup, "rowsIn", len(trxnsGroup))
 
 
-def getOpValue(operation, value, newField):
-    value = float(value)
 
-    if (newField==outFieldNames[6] and operation==inTypes[3]) or \
-       (newField==outFieldNames[4] and (operation==inTypes[3] or value<0)) or \
-       (newField==outFieldNames[2] and operation!=inTypes[3] and value>0):
-           return f"{abs(value):.8f}"
-    return ""
+def npProcessTrxns(trxnsIn, csvOut=None, mergeTrxnsGroups=None, \
+        getDates=None):
+    """
+    Procesar todas las transacciones por columnas con numpy. Produce las
+    mismas transacciones de salida que csvProcessTrxns con el plan de campos
+    de getOutFieldsPlan y los groupId de main(), pero sin procesar fila a
+    fila: Tipo y Operacion salen de tablas de búsqueda por Operation, Compra,
+    Venta y Comision de máscaras de signo, los grupos de np.unique/lexsort y
+    las sumas de staking de np.add.reduceat. Todos los grupos, con los de
+    staking ya sumados, se pasan juntos a mergeTrxnsGroups, que une en Python
+    el resto (trading).
 
+    ARGUMENTOS:
+        - trxnsIn: Iterator con las transacciones de entrada (mappings con los
+        campos inFieldNames). Se cargan todas en memoria.
+        - csvOut: writer csv de salida. Si None, se devuelven las transacciones
+        procesadas como lista.
+        - mergeTrxnsGroups: función que une una lista de grupos de
+        transacciones (ver mergeTrxnsGroupsByType). Si None no se une ningún
+        grupo.
+        - getDates: función obtenida con wrapDateStage(dateFormat,
+        [newDateFormat, newDayFormat]). Si None se crea una nueva.
 
-def getCoin(operation, value, coin, newField):
-    parseCoin = {"DOT": "DOT2", "ATOM": "ATOM2", "BTTC": "BTT4", \
-                 "CITY": "CITY2"}
-    value = float(value)
+    RETORNO:
+        - csvOut == None: lista de transacciones de salida.
+        - csvOut != None: Número de caracteres escritos en el csv writer.
 
-    if not ((newField==outFieldNames[7] and operation==inTypes[3]) or \
-       (newField==outFieldNames[5] and (operation==inTypes[3] or value<0)) or \
-       (newField==outFieldNames[3] and operation!=inTypes[3] and value>0)):
-        return ""
+    EXCEPCIONES:
+        Si numpy no está instalado.
+    """
+
+    assert np is not None, trxnErrors["NO_NUMPY"]
+    if getDates is None:
+        getDates = wrapDateStage(dateFormat, [newDateFormat, newDayFormat])
 
-    return parseCoin.get(coin, coin)
+    trxnsIn = [(trxn.get(inFieldNames[1], ""), trxn.get(inFieldNames[3], ""), \
+            trxn.get(inFieldNames[4], ""), trxn.get(inFieldNames[5], ""), \
+            trxn.get(inFieldNames[6], "")) for trxn in trxnsIn]
+    numTrxns = len(trxnsIn)
+    outTrxns = []
+    if numTrxns:
+        utcTimes, operations, coins, changes, remarks = zip(*trxnsIn)
+    else:
+        utcTimes = operations = coins = changes = remarks = ()
+    del trxnsIn
+
+    # Tablas de búsqueda por cada valor distinto de Operation y Coin.
+    opValues, opCodes = np.unique(np.array(operations, dtype=object), \
+            return_inverse=True)
+    typeTable = np.array([getType(o) for o in opValues] + [None], dtype=object)
+    typeCodeTable = np.array([outTypes.index(t) if t in outTypes else -1 \
+            for t in typeTable], dtype=np.int64)
+    opTable = np.array([getOp(o) for o in opValues], dtype=object)
+    opSignFields = [operationSignFields.get(o, defaultSignFields) \
+            for o in opValues]
+
+    coinValues, coinCodes = np.unique(np.array(coins, dtype=object), \
+            return_inverse=True)
+    coinTable = np.array([coinRemaps.get(c, c) for c in coinValues] + [""], \
+            dtype=object)
+
+    # Compra, Venta y Comision por máscaras de signo (ver getOpValue): un
+    # campo tiene valor si la regla de signo de la Operation lo incluye para
+    # el signo de Change.
+    units = np.fromiter(map(parseAmount, changes), dtype=np.int64, \
+            count=numTrxns)
+    signs = np.sign(units)
+    masks = {}
+    for outField in amountCoinFields:
+        masks[outField] = np.zeros(numTrxns, dtype=bool)
+        for sign in (0, 1, -1):
+            hasField = np.array([outField in fields[sign] for fields in \
+                    opSignFields], dtype=bool)
+            masks[outField] |= hasField[opCodes] & (signs == sign)
+    isBuy = masks[outFieldNames[2]]
+    absUnits = np.abs(units)
+    noCoin = len(coinValues)
+    buyCoinCodes = np.where(isBuy, coinCodes, noCoin)
+    outColumns = {}
+    for outField, coinField in amountCoinFields.items():
+        mask = masks[outField]
+        values = np.full(numTrxns, "", dtype=object)
+        values[mask] = absUnits[mask].tolist()
+        outColumns[outField] = values
+        outColumns[coinField] = coinTable[np.where(mask, coinCodes, noCoin)]
+
+    # Fecha y día por cada UTC_Time distinto.
+    utcValues, utcCodes = np.unique(np.array(utcTimes, dtype=object), \
+            return_inverse=True)
+    utcDates = [getDates(u) for u in utcValues]
+    fechaValues, fechaCodes = np.unique(np.array([d[0] for d in utcDates] + \
+            [""], dtype=object)[:-1], return_inverse=True)
+    dayValues, dayCodes = np.unique(np.array([d[1] for d in utcDates] + \
+            [""], dtype=object)[:-1], return_inverse=True)
+    fechaCodes = fechaCodes[utcCodes]
+    dayCodes = dayCodes[utcCodes]
+
+    # groupId (tipo, moneda compra, fecha o día) como códigos enteros: el
+    # staking se agrupa por día y moneda, el trading por Fecha y el resto por
+    # moneda y Fecha.
+    typeCodes = typeCodeTable[opCodes]
+    isStaking = typeCodes == outTypes.index(outTypes[0])
+    isTrade = typeCodes == outTypes.index(outTypes[1])
+    groupKeys = np.stack([typeCodes, np.where(isTrade, -1, buyCoinCodes), \
+            np.where(isStaking, dayCodes, fechaCodes)], axis=1)
+    isValid = typeCodes >= 0
+    for pos in np.flatnonzero(~isValid).tolist():
+        logger.warning("Transacción sin grupo (%s): %s", operations[pos], \
+                dict(zip([inFieldNames[1]] + inFieldNames[3:], (utcTimes[pos], \
+                operations[pos], coins[pos], changes[pos], remarks[pos]))), \
+                extra={"trxnKey": operations[pos]})
+
+    validPos = np.flatnonzero(isValid)
+    if len(validPos):
+        groupKeys, groupFirsts, groupCodes = np.unique(groupKeys[validPos], \
+                axis=0, return_index=True, return_inverse=True)
+        groupCodes = groupCodes.reshape(-1)
+        groupRanks = np.empty(len(groupFirsts), dtype=np.int64)
+        groupRanks[np.argsort(groupFirsts, kind="stable")] = \
+                np.arange(len(groupFirsts))
+        rowRanks = groupRanks[groupCodes]
+        sortedPos = validPos[np.lexsort((validPos, rowRanks))]
+        sortedRanks = np.sort(rowRanks, kind="stable")
+        groupStarts = np.flatnonzero(np.r_[True, sortedRanks[1:] != \
+                sortedRanks[:-1]])
+        stakedSums = np.add.reduceat(np.where(isBuy, absUnits, 0)[sortedPos], \
+                groupStarts)
+        groupEnds = np.r_[groupStarts[1:], len(sortedPos)]
+    else:
+        sortedPos = groupStarts = groupEnds = stakedSums = np.empty(0, \
+                dtype=np.int64)
+
+    newKeys = [outFieldNames[0], outFieldNames[1], outFieldNames[2], \
+            outFieldNames[4], outFieldNames[6], outFieldNames[3], \
+            outFieldNames[5], outFieldNames[7], outFieldNames[8], \
+            outFieldNames[10], outFieldNames[11]]
+    columns = [typeTable[opCodes].tolist(), opTable[opCodes].tolist(), \
+            outColumns[outFieldNames[2]].tolist(), \
+            outColumns[outFieldNames[4]].tolist(), \
+            outColumns[outFieldNames[6]].tolist(), \
+            outColumns[outFieldNames[3]].tolist(), \
+            outColumns[outFieldNames[5]].tolist(), \
+            outColumns[outFieldNames[7]].tolist(), ["Binance"] * numTrxns, \
+            list(remarks), fechaValues[fechaCodes].tolist()]
+    # Filas con los valores en el orden de outFieldNames (ver OutTrxn).
+    columns = dict(zip(newKeys, columns))
+    rows = list(zip(*(columns.get(key) or [""] * numTrxns \
+            for key in outFieldNames)))
+    del columns
+    sortedPos = sortedPos.tolist()
+    # Solo se suman los grupos de staking con valor obtenido: los de intereses
+    # cero o negativos (sin compra) pasan fila a fila, como en
+    # mergeStakingTrxns.
+    isStakedList = (isStaking & isBuy).tolist()
+    isTradeLegList = np.array([o in tradeLegOperations for o in opValues], \
+            dtype=bool)[opCodes].tolist()
+
+    trxnsGroups = []
+    for start, end, stakedSum in zip(groupStarts.tolist(), groupEnds.tolist(),\
+            stakedSums.tolist()):
+        if isStakedList[sortedPos[start]]:
+            outTrxn = OutTrxn.fromValues(rows[sortedPos[start]])
+            outTrxn[outFieldNames[2]] = stakedSum
+            trxnsGroups.append(SummedTrxnsGroup([outTrxn], end - start))
+            continue
 
+        trxnsGroups.append([OutTrxn.fromValues(rows[pos], \
+                isTradeLegList[pos]) for pos in sortedPos[start:end]])
 
+    if mergeTrxnsGroups is None:
+        outTrxns.extend(trxn for trxnsGroup in trxnsGroups \
+                for trxn in trxnsGroup)
+    else:
+        outTrxns.extend(mergeTrxnsGroups(trxnsGroups))
 
-def getComment(oldComment, trxnType):
-    pass
+    if csvOut is None:
+        return outTrxns
 
+    csvOut.writeheader()
+    return csvWriteRows(csvOut, outTrxns)
 
-outGets = [getType, getOp, getOpValue, getCoin, getComment]
 
 
-def main():
+
+def getStageDbFileName(inFileName):
     """
-    Función principal.
+    Obtener el nombre de la base de datos SQLite de staging de un extracto.
+    """
+    return inFileName + ".stage.sqlite"
 
-    El programa permite cuatro combinaciones entrada/salida: Procesar las
-    transacciones directamente desde un reader csv o desde una lista de
-    transacciones de entrada almacenadas ya en memoria hacia un writer csv o
-    para almacenarlas en otra lista de transacciones de salida en memoria.
 
-    MEJORAS:
-        - Dar la opción de ir escribiendo en el archivo de salida cada día de
-        transacciones procesado o, en cambio, escribir todas las transacciones
-        de golpe.
-        Las opciones que maneja el programa son:
-        - Agrupar transacciones por día para reducir el número.
-        - Elegir el orden de los campos de salida.
-        - Cambiar el nombre de los campos de salida.
-        - Eliminar campos de salida.
 
-        Desde el programa principal se puede elegir los campos de salida que
-        se quiera y darle un nombre. A cada campo de salida se le asocia la
-        función get que está relacionada con el tipo de campo que es y los
-        campos de entrada necesarios para poder obtener el dato correctamente
-        para esa función. La función get a elegir y el tipo de dato de ese
-        campo de salida están ligados. La forma de dar al usuario a elegir
-        qué tipo de dato de salida es qué campo se hace eligiendo una función
-        get entre las posibles.
+def openTrxnsStage(fileName, stageKey):
     """
-    # comprobar errores de entrada
-    inFileName = sys.argv[1]
-    outFileName = sys.argv[2]
-
-
-    outFieldsGetsValues = \
-            {outFieldNames[0]: wrapGetTrxnValue(getType, inFieldNames[3]), \
-             outFieldNames[1]: wrapGetTrxnValue(getOp, inFieldNames[3]), \
-             outFieldNames[2]: wrapGetTrxnValue(wrapf(getOpValue, \
-                outFieldNames[2]), inFieldNames[3], inFieldNames[5]), \
-             outFieldNames[4]: wrapGetTrxnValue(wrapf(getOpValue, \
-                outFieldNames[4]), inFieldNames[3], inFieldNames[5]), \
-             outFieldNames[6]: wrapGetTrxnValue(wrapf(getOpValue, \
-                outFieldNames[6]), inFieldNames[3], inFieldNames[5]), \
-             outFieldNames[3]: wrapGetTrxnValue(wrapf(getCoin, \
-                outFieldNames[3]), inFieldNames[3], inFieldNames[5], \
-                inFieldNames[4]), \
-             outFieldNames[5]: wrapGetTrxnValue(wrapf(getCoin, \
-                outFieldNames[5]), inFieldNames[3], inFieldNames[5], \
-                inFieldNames[4]), \
-             outFieldNames[7]: wrapGetTrxnValue(wrapf(getCoin, \
-                outFieldNames[7]), inFieldNames[3], inFieldNames[5], \
-                inFieldNames[4]), \
-             outFieldNames[8]: lambda x: "Binance", \
-             outFieldNames[10]: op.itemgetter(inFieldNames[6]), \
-             outFieldNames[11]: wrapGetTrxnValue(wrapf(applyDateFormat, \
-                dateFormat, newDateFormat), inFieldNames[1])}
+    Abrir una base de datos de staging ya cargada con loadTrxnsStage, si
+    existe y se cargó con la misma clave.
 
-    typeMerges = \
-            {outTypes[0]: wrapf(mergeStakingTrxns, outFieldNames[3], \
-                outFieldNames[2]), \
-             outTypes[1]: wrapf(mergeTradeTrxns, outFieldNames[3], \
-                outFieldNames[2], outFieldNames[5], outFieldNames[4], \
-                outFieldNames[7], outFieldNames[6], outFieldNames[10])}
-    #getsBlockId = \
-    #        {"function": lambda v: applyDateFormat(v, dateFormat, dayFormat), \
-    #         "keys": [dateFieldNameOut]}
-    # Las distintas formas de obtener el groupId tienen que tener en común
-    # que el primer o último campo sea el tipo, ya que todos los groupId,
-    # aunque se obtengan de manera distinta dependiendo del tipo de la trxn,
-    # debe ser único entre todos los groupId de todas las trxns.
-    typeGetsGroupId = \
-            {outTypes[0]: wrapGetTrxnValue(wrapf(getGroupId, \
-                getValue=joinStrValues, valueParsers=\
-                {2: wrapf(applyDateFormat, newDateFormat, newDayFormat)}), \
-                outFieldNames[0], outFieldNames[3], outFieldNames[11]), \
-             **dict.fromkeys([outTypes[1], outTypes[1]], \
-                wrapGetTrxnValue(getGroupId, outFieldNames[0], \
-                outFieldNames[11])),
-             **dict.fromkeys([outTypes[2], outTypes[3]], \
-                wrapGetTrxnValue(getGroupId, outFieldNames[0], \
-                outFieldNames[3], outFieldNames[11])),
-            }
+    ARGUMENTOS:
+        - fileName: nombre de la base de datos.
+        - stageKey: clave de la entrada y el plan de campos con la que se
+        tiene que haber cargado (ver convertTrxnsFile).
 
-    isCsvInToMem = True
-    isCsvOutToMem = True
+    RETORNO:
+        Tupla (conexión, transacciones de entrada leídas al cargarla), o None
+        si no existe o su clave es distinta.
+    """
 
-    inFile = open(inFileName, newline='')
-    csvIn = csvOpen(inFile, 'r', isDict=True)
-    trxnsIn = [trxn for trxn in csvIn] if isCsvInToMem else csvIn
+    if not os.path.exists(fileName):
+        return None
+    connection = sqlite3.connect(fileName)
+    try:
+        row = connection.execute("SELECT key, rowsIn FROM stage").fetchone()
+    except sqlite3.DatabaseError:
+        row = None
+    if row is None or row[0] != stageKey:
+        connection.close()
+        return None
+    return connection, row[1]
 
-    outFile = open(outFileName, "w", newline='')
-    csvOut = None if isCsvOutToMem else csvOpen(outFile, 'w', dialect="excel", \
-            isDict=True, fieldnames=outFieldNames)
 
-    # Dar antes la opción de agrupar las transacciones itertools groupby
 
-    processTrxn = wrapf(processNewTrxnKeys, outFieldsGetsValues)
-    mergeTrxnsGroups = wrapf(mergeTrxnsGroupsByType, outFieldNames[0], \
-            typeMerges)
-    getTrxnBlockId = wrapGetTrxnValue(wrapf(applyDateFormat, newDateFormat, \
-            newDayFormat), outFieldNames[11])
-    getTrxnGroupId = wrapf(getTrxnValueByField, outFieldNames[0], \
-            typeGetsGroupId)
-    outTrxns = csvProcessTrxns(trxnsIn, processTrxn, csvOut, mergeTrxnsGroups, \
-            getTrxnGroupId, getTrxnBlockId)
+def loadTrxnsStage(fileName, stageKey, trxnsIn, processTrxn, getTrxnGroupId, \
+        keys, batchSize=10000, stats=None):
+    """
+    Cargar las transacciones procesadas en una base de datos SQLite de
+    staging, para unirlas con sqliteProcessTrxns sin tenerlas en memoria. La
+    tabla trxns tiene, además de los campos keys, la posición de entrada pos,
+    el UTC_Time de entrada utcTime (ordenable), su día day y si es parte de
+    una orden de trading isTradeLeg (ver OutTrxn), con índices por
+    (Tipo, utcTime, MonedaC) y (Tipo, day, MonedaC). Las cantidades vacías
+    son NULL. Las transacciones sin groupId se avisan y no se cargan. Se
+    carga en un archivo temporal, que se renombra al terminar con la clave
+    stageKey en la tabla stage, para que nunca se reutilice una carga a
+    medias.
+
+    ARGUMENTOS:
+        - fileName: nombre de la base de datos. Si existe se sobrescribe.
+        - stageKey: clave a guardar (ver openTrxnsStage).
+        - trxnsIn: iterable de transacciones de entrada.
+        - processTrxn, getTrxnGroupId: ver csvProcessTrxns.
+        - keys: campos de las transacciones procesadas, en orden.
+        - batchSize: transacciones por cada executemany.
+        - stats: objeto TrxnsStats donde medir como fase "stage" la escritura
+        en la base de datos. Si None no se mide.
+
+    RETORNO:
+        Tupla (conexión a la base de datos cargada, transacciones de entrada
+        leídas).
+    """
+
+    timeStage = (lambda name: contextlib.nullcontext()) if stats is None \
+            else stats.stage
+    tmpFileName = fileName + ".tmp"
+    if os.path.exists(tmpFileName):
+        os.remove(tmpFileName)
+    connection = sqlite3.connect(tmpFileName)
+    connection.execute("PRAGMA synchronous = OFF")
+    connection.execute("PRAGMA journal_mode = OFF")
+    columns = ", ".join(f'"{key}"' for key in keys)
+    connection.execute("CREATE TABLE trxns (pos INTEGER PRIMARY KEY, " \
+            f"utcTime TEXT, day TEXT, isTradeLeg INTEGER, {columns})")
+    insert = f"INSERT INTO trxns VALUES ({', '.join('?' * (len(keys) + 4))})"
+
+    counters = cl.Counter()
+    isOutKeys = list(keys) == outFieldNames
+
+    def getRows():
+        for pos, trxnIn in enumerate(trxnsIn):
+            counters["rowsIn"] += 1
+            trxn = processTrxn(trxnIn)
+            operation = trxnIn.get(inFieldNames[3])
+            if getTrxnGroupId(trxn) is None:
+                logger.warning("Transacción sin grupo (%s): %s", operation, \
+                        trxn, extra={"trxnKey": operation})
+                continue
+            utcTime = trxnIn[inFieldNames[1]]
+            values = trxn.values() if isOutKeys and isinstance(trxn, OutTrxn) \
+                    else [trxn.get(key, "") for key in keys]
+            yield (pos, utcTime, utcTime[:10], operation in \
+                    tradeLegOperations, *(None if v == "" else v \
+                    for v in values))
+
+    rows = getRows()
+    for batch in iter(lambda: list(it.islice(rows, batchSize)), []):
+        with timeStage("stage"):
+            connection.executemany(insert, batch)
+
+    with timeStage("stage"):
+        connection.execute(f'CREATE INDEX trxnsTime ON trxns ("{keys[0]}", ' \
+                f'utcTime, "{outFieldNames[3]}")')
+        connection.execute(f'CREATE INDEX trxnsDay ON trxns ("{keys[0]}", ' \
+                f'day, "{outFieldNames[3]}")')
+        connection.execute("CREATE TABLE stage (key TEXT, rowsIn INTEGER)")
+        connection.execute("INSERT INTO stage VALUES (?, ?)", (stageKey, \
+                counters["rowsIn"]))
+        connection.commit()
+        connection.close()
+        os.replace(tmpFileName, fileName)
+    if stats is not None:
+        stats.getStage("stage")["rows"] += counters["rowsIn"]
+    return sqlite3.connect(fileName), counters["rowsIn"]
+
+
+
+def sqliteProcessTrxns(connection, csvOut=None, mergeTrxnsGroups=None, \
+        stats=None):
+    """
+    Unir las transacciones de una base de datos de staging (ver
+    loadTrxnsStage) y obtenerlas por días en orden de Fecha. Los grupos son
+    los mismos que los groupId de getTrxnsProcess: el staking con valor
+    obtenido se suma con GROUP BY por día y moneda (contando sus
+    transacciones en rowsIn, ver SummedTrxnsGroup), y los grupos del resto
+    (staking sin valor obtenido por día, como en mergeStakingTrxns; trading
+    por Fecha; el resto por Fecha y moneda) se numeran con su primera
+    posición con una ventana MIN(pos) OVER. Las filas salen ordenadas por
+    día, grupo y posición, y los grupos de cada día, con los de staking ya
+    sumados, se pasan juntos a mergeTrxnsGroups, que une en Python el resto
+    (trading).
+    Solo se tiene en memoria un día de transacciones.
+
+    ARGUMENTOS:
+        - connection: conexión a la base de datos de staging.
+        - csvOut: writer csv de salida. Si None se devuelven las transacciones
+        de salida como lista.
+        - mergeTrxnsGroups: función que une una lista de grupos de
+        transacciones (ver mergeTrxnsGroupsByType). Si None no se une ningún
+        grupo.
+        - stats: objeto TrxnsStats donde medir como fase "query" la obtención
+        de las filas de la base de datos. Si None no se mide.
+
+    RETORNO:
+        - csvOut == None: lista de transacciones de salida.
+        - csvOut != None: Número de caracteres escritos en el csv writer.
+    """
+
+    keys = [column[1] for column in connection.execute( \
+            "PRAGMA table_info(trxns)")][4:]
+    columns = ", ".join(f'"{key}"' for key in keys)
+    stakedColumns = ", ".join(f'SUM("{key}") AS "{key}"' if key == \
+            outFieldNames[2] else f'"{key}"' for key in keys)
+    typeKey, coinKey = f'"{keys[0]}"', f'"{outFieldNames[3]}"'
+    isStaked = f'{typeKey} = :staking AND "{outFieldNames[2]}" IS NOT NULL'
+    # En el GROUP BY de staking, con un solo MIN, SQLite toma el resto de
+    # columnas de la fila con la mínima posición (la transacción base).
+    query = \
+            f"SELECT day, firstPos, rowsIn, isTradeLeg, {columns} FROM (" \
+            f"SELECT day, MIN(pos) AS firstPos, pos, COUNT(*) AS rowsIn, " \
+            f"isTradeLeg, {stakedColumns} " \
+            f"FROM trxns WHERE {isStaked} " \
+            f"GROUP BY day, {coinKey} " \
+            f"UNION ALL " \
+            f"SELECT day, MIN(pos) OVER (PARTITION BY {typeKey}, " \
+            f"CASE WHEN {typeKey} = :staking THEN day ELSE utcTime END, " \
+            f"CASE WHEN {typeKey} = :trade THEN '' ELSE {coinKey} END) " \
+            f"AS firstPos, pos, 1 AS rowsIn, isTradeLeg, {columns} " \
+            f"FROM trxns WHERE NOT ({isStaked})) " \
+            f"ORDER BY day, firstPos, pos"
+    rows = connection.execute(query, {"staking": outTypes[0], \
+            "trade": outTypes[1]})
+    if stats is not None:
+        rows = stats.wrapIter("query", rows)
+
+    if csvOut is None:
+        outTrxns = []
+    else:
+        outTrxns = 0
+        csvOut.writeheader()
+
+    makeTrxn = lambda values, isTradeLeg: OutTrxn.fromValues(values, \
+            isTradeLeg) if keys == outFieldNames else OutTrxn(zip(keys, \
+            values), isTradeLeg)
+    for _, dayRows in it.groupby(rows, op.itemgetter(0)):
+        trxnsGroups = []
+        for _, groupRows in it.groupby(dayRows, op.itemgetter(1)):
+            groupRows = list(groupRows)
+            trxnsGroup = [makeTrxn(["" if v is None else v for v in \
+                    row[4:]], bool(row[3])) for row in groupRows]
+            # rowsIn > 1 solo en los grupos de staking ya sumados.
+            rowsIn = groupRows[0][2]
+            if rowsIn > 1:
+                trxnsGroup = SummedTrxnsGroup(trxnsGroup, rowsIn)
+            trxnsGroups.append(trxnsGroup)
+        if mergeTrxnsGroups is None:
+            tempOutTrxns = [trxn for trxnsGroup in trxnsGroups \
+                    for trxn in trxnsGroup]
+        else:
+            tempOutTrxns = mergeTrxnsGroups(trxnsGroups)
+        if csvOut is None:
+            outTrxns.extend(tempOutTrxns)
+        else:
+            outTrxns += csvWriteRows(csvOut, tempOutTrxns)
+
+    return outTrxns
+
+
+
+
+# Los siguientes valores se podrán meter como parámetros al programa, sobre
+# todo al usar interfaz gráfica. Por defecto valores siguientes:
+dateFormat = "%Y-%m-%d %H:%M:%S"
+newDateFormat = "%d-%m-%Y %H:%M:%S"
+newDayFormat = "%d-%m-%Y"
+
+inFieldNames = ["User_ID", "UTC_Time", "Account", "Operation", "Coin", \
+        "Change", "Remark"]
+# Tipo es en realidad Operación y Operación es Acción. Cambiar cuando se pueda.
+outFieldNames = ["Tipo", "Operacion", "Compra", "MonedaC", "Venta", "MonedaV",\
+        "Comision", "MonedaF", "Exchange", "Grupo", "Comentario", "Fecha"]
+# Campos de salida con cantidades enteras, formateadas al escribir.
+outAmountFieldNames = [outFieldNames[2], outFieldNames[4], outFieldNames[6]]
+# Campos de entrada parseados una sola vez por transacción.
+inFieldsParsers = {inFieldNames[5]: parseAmount}
+outTypes = ["Staking", "Trade", "Deposito", "Retirada"]
+inTypes = ["Deposit", "Withdraw", "Small assets exchange BNB", "Fee", "Buy", \
+        "Sell", "Transaction Related", "POS savings interest", \
+        "Super BNB Mining", "Savings Interest", "Large OTC trading"]
+outOps = ["Comision", "Compra", "Venta", "Polvo"]
+
+
+class InTrxn(tuple):
+    """
+    Transacción de entrada compacta: tupla con los valores de los campos
+    inFieldNames en ese orden. Además permite acceder a los valores por nombre
+    de campo (get, [] y keys), igual que los diccionarios de DictReader, para
+    poder usarse en cualquier función que reciba estos.
+    """
+
+    __slots__ = ()
+    fieldIndexes = {name: pos for pos, name in enumerate(inFieldNames)}
+
+    def __getitem__(self, key):
+        if type(key) is str:
+            key = self.fieldIndexes[key]
+        return tuple.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        pos = self.fieldIndexes.get(key)
+        return default if pos is None else tuple.__getitem__(self, pos)
+
+    def keys(self):
+        return self.fieldIndexes.keys()
+
+
+
+class OutTrxn:
+    """
+    Transacción de salida compacta: un atributo (__slots__) por cada campo de
+    outFieldNames, sin diccionario por transacción. Todos los campos tienen
+    valor ("" si no se indica). Permite acceder a los valores por nombre de
+    campo ([], get, keys, values e items), igual que un diccionario, para
+    poder usarse en las funciones de unión y en los writer csv.
+
+    Además de los campos tiene el atributo isTradeLeg, que no es un campo ni
+    se escribe: True si la transacción viene de una Operation que es parte
+    de una orden de trading (ver markTradeLeg y matchTradeGroups).
+    """
+
+    __slots__ = tuple(outFieldNames) + ("isTradeLeg",)
+    fieldKeys = dict.fromkeys(outFieldNames).keys()
+    valuesGetter = op.attrgetter(*outFieldNames)
+
+    def __init__(self, items=(), isTradeLeg=False):
+        for key in self.fieldKeys:
+            setattr(self, key, "")
+        self.isTradeLeg = isTradeLeg
+        for key, value in items.items() if hasattr(items, "items") else items:
+            self[key] = value
+
+    @classmethod
+    def fromValues(cls, values, isTradeLeg=False):
+        """
+        Crear una transacción con los valores de todos los campos en el orden
+        de outFieldNames.
+        """
+        trxn = cls.__new__(cls)
+        for key, value in zip(cls.fieldKeys, values):
+            setattr(trxn, key, value)
+        trxn.isTradeLeg = isTradeLeg
+        return trxn
+
+    def __reduce__(self):
+        return (type(self).fromValues, (self.values(), self.isTradeLeg))
+
+    def __getitem__(self, key):
+        if key not in self.fieldKeys:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.fieldKeys:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.fieldKeys
+
+    def __eq__(self, other):
+        return isinstance(other, OutTrxn) and self.values() == other.values()
+
+    def __repr__(self):
+        return f"{type(self).__name__}({dict(self.items())})"
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.fieldKeys else default
+
+    def keys(self):
+        return self.fieldKeys
+
+    def values(self):
+        return self.valuesGetter(self)
+
+    def items(self):
+        return zip(self.fieldKeys, self.values())
+
+    def copy(self):
+        return type(self).fromValues(self.values(), self.isTradeLeg)
+
+
+
+def markTradeLeg(outTrxn, operation):
+    """
+    Anotar en isTradeLeg de una transacción OutTrxn procesada si su Operation
+    de entrada es parte de una orden de trading ("tradeLeg" en
+    compileMappingRules).
+
+    RETORNO:
+        La misma transacción.
+    """
+    outTrxn.isTradeLeg = operation in tradeLegOperations
+    return outTrxn
+
+
+
+def isTradeLeg(trxn):
+    """
+    Indicar si una transacción es parte de una orden de trading (ver
+    OutTrxn). Las que no son OutTrxn (p. ej. diccionarios) no lo son.
+    """
+    return getattr(trxn, "isTradeLeg", False)
+
+
+
+def mmapReadTrxns(fileName, dialect=None, encoding="utf-8", \
+        chunkSize=1 << 22):
+    """
+    Leer las transacciones de un extracto mapeando el archivo en memoria
+    (mmap). El archivo se recorre por trozos de unos chunkSize bytes cortados
+    en final de fila, y solo se decodifica cada trozo. Los trozos sin
+    comillas se dividen directamente por el delimitador; los trozos con
+    comillas (p.ej: Remark con comas o saltos de línea) se leen con
+    csv.reader. Solo se guardan los campos inFieldNames de cada fila, sin
+    crear diccionarios.
+
+    ARGUMENTOS:
+        - fileName: nombre del archivo csv de entrada.
+        - dialect: dialecto csv. Si None se detecta con sniffDialect.
+        - encoding: codificación del archivo.
+        - chunkSize: tamaño aproximado en bytes de cada trozo.
+
+    RETORNO:
+        Generador de transacciones InTrxn. Los campos de inFieldNames que no
+        estén en la cabecera o falten en una fila valen "".
+    """
+
+    with open(fileName, "rb") as binFile:
+        if os.fstat(binFile.fileno()).st_size == 0:
+            return
+        with mmap.mmap(binFile.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            size = len(mm)
+            if dialect is None:
+                dialect = sniffDialect(mm[:1024].decode(encoding, "ignore"))
+            dialect = csv.get_dialect(dialect) if isinstance(dialect, str) \
+                    else dialect
+            headerEnd = mm.find(b"\n") + 1 or size
+            header = next(csv.reader([mm[:headerEnd].decode(encoding + \
+                    "-sig")], dialect), [])
+            indexes = [header.index(name) if name in header else None for \
+                    name in inFieldNames]
+            isDirect = indexes == list(range(len(header)))
+            quoteChar = dialect.quotechar or ""
+            isSplit = dialect.doublequote and not dialect.skipinitialspace \
+                    and dialect.escapechar is None
+            quote = quoteChar.encode(encoding)
+
+            pos = headerEnd
+            while pos < size:
+                end = mm.find(b"\n", min(pos + chunkSize, size - 1))
+                end = size if end < 0 else end + 1
+                chunk = mm[pos:end]
+                # Un salto de línea solo acaba una fila si hay un número par
+                # de comillas antes.
+                while quote and chunk.count(quote) % 2 and end < size:
+                    newEnd = mm.find(b"\n", end)
+                    newEnd = size if newEnd < 0 else newEnd + 1
+                    chunk += mm[end:newEnd]
+                    end = newEnd
+                pos = end
+
+                text = chunk.decode(encoding)
+                if isSplit and quoteChar not in text:
+                    if "\r" in text:
+                        text = text.replace("\r\n", "\n")
+                    rows = (line.split(dialect.delimiter) for line in \
+                            text.split("\n") if line)
+                else:
+                    rows = csv.reader(io.StringIO(text, newline=""), dialect)
+
+                for fields in rows:
+                    if isDirect and len(fields) == len(indexes):
+                        yield InTrxn(fields)
+                    elif fields:
+                        yield InTrxn(fields[i] if i is not None and \
+                                i < len(fields) else "" for i in indexes)
+
+
+def csvReadTrxns(file, dialect=None):
+    """
+    Leer las transacciones de un extracto abierto en modo texto. Si la
+    cabecera tiene todos los campos inFieldNames, las filas se leen con
+    csv.reader y se devuelven como InTrxn con los campos en el orden de
+    inFieldNames, usando los índices de columna calculados una sola vez con
+    la cabecera. Si no, se leen con DictReader.
+
+    ARGUMENTOS:
+        - file: archivo csv de entrada abierto con newline=''.
+        - dialect: dialecto csv. Si None se detecta con sniffDialect.
+
+    RETORNO:
+        Tupla (transacciones, campos). transacciones es un iterador de InTrxn
+        o, con otra cabecera, el DictReader; campos son los nombres de campo
+        de cada transacción.
+    """
+
+    if dialect is None:
+        dialect = sniffDialect(peekText(file))
+
+    csvIn = csv.reader(file, dialect)
+    header = next(csvIn, [])
+    if header:
+        header[0] = header[0].lstrip("\ufeff")
+    if not set(inFieldNames).issubset(header):
+        return csv.DictReader(file, header, dialect=dialect), header
+
+    if header == inFieldNames:
+        getFields = None
+    else:
+        getFields = op.itemgetter(*(header.index(name) \
+                for name in inFieldNames))
+
+    def readTrxns():
+        numFields = len(header)
+        for fields in csvIn:
+            if len(fields) != numFields:
+                if not fields:
+                    continue
+                fields = (fields + [""] * numFields)[:numFields]
+            yield InTrxn(fields if getFields is None else getFields(fields))
+
+    return readTrxns(), inFieldNames
+
+
+
+# Reglas de clasificación por defecto de cada Operation de entrada (ver
+# compileMappingRules). Se pueden ampliar o cambiar con un archivo JSON con
+# el mismo formato (ver loadMappingRules y la opción --rules).
+defaultMappingRules = \
+        {"operations": \
+            {inTypes[0]: {"type": outTypes[2]}, \
+             inTypes[1]: {"type": outTypes[3]}, \
+             inTypes[2]: {"type": outTypes[1], "op": outOps[3]}, \
+             inTypes[3]: {"type": outTypes[1], "op": outOps[0], \
+                "sign": "fee", "tradeLeg": True}, \
+             **{operation: {"type": outTypes[1], "tradeLeg": True} for \
+                operation in [inTypes[4], inTypes[5]]}, \
+             **{operation: {"type": outTypes[1]} for operation in \
+                [inTypes[6], inTypes[10]]}, \
+             **{operation: {"type": outTypes[0]} for operation in \
+                [inTypes[7], inTypes[8], inTypes[9]]}}, \
+         "coinRemaps": \
+            {"DOT": "DOT2", "ATOM": "ATOM2", "BTTC": "BTT4", "CITY": "CITY2"}, \
+         "signRules": \
+            {"signed": {"positive": [outFieldNames[2]], \
+                "negative": [outFieldNames[4]], "zero": []}, \
+             "fee": dict.fromkeys(["positive", "negative", "zero"], \
+                [outFieldNames[6], outFieldNames[4]])}}
+# Secciones que pueden tener unas reglas de clasificación.
+mappingRulesSections = ("operations", "coinRemaps", "signRules")
+# Regla de signo de las Operation sin "sign".
+defaultSignRule = "signed"
+# Campo de moneda de cada campo de cantidad.
+amountCoinFields = {outFieldNames[2]: outFieldNames[3], \
+        outFieldNames[4]: outFieldNames[5], outFieldNames[6]: outFieldNames[7]}
+
+
+
+def compileMappingRules(rules):
+    """
+    Validar unas reglas de clasificación y compilarlas en tablas de búsqueda
+    inmutables, de modo que clasificar cada transacción sea una sola búsqueda
+    en un diccionario.
+
+    ARGUMENTOS:
+        - rules: diccionario con las reglas:
+            * "operations": por cada Operation de entrada, diccionario con su
+            tipo de salida "type" (uno de outTypes), su operación de salida
+            "op" (por defecto "") y su regla de signo "sign" (por defecto
+            defaultSignRule). Con "tradeLeg" true, sus transacciones son
+            partes de una orden (compra, venta o comisión) que Binance puede
+            anotar en segundos distintos, y se pueden juntar con
+            matchTradeGroups. Las Operation que no están no tienen tipo.
+            * "coinRemaps": por cada moneda de entrada, su nombre de salida.
+            * "signRules": por cada regla de signo, los campos de cantidad
+            (outAmountFieldNames) que toman el valor absoluto de Change cuando
+            es "positive", "negative" o "zero". Su moneda va en el campo de
+            moneda correspondiente (amountCoinFields).
+
+    RETORNO:
+        Diccionario de solo lectura con las tablas operationTypes,
+        operationOps, tradeLegOperations (conjunto de las Operation con
+        "tradeLeg"), operationSignFields (por Operation, tupla con los
+        campos de cantidad y moneda con valor si Change es 0, positivo o
+        negativo, indexable por el signo), defaultSignFields (la de las
+        Operation sin regla) y coinRemaps.
+
+    EXCEPCIONES:
+        ValueError si las reglas no tienen el formato correcto, con la
+        sección o la clave incorrecta en el mensaje.
+    """
+
+    # Se comprueba sin assert para que las reglas se validen también con -O.
+    def check(condition, detail):
+        if not condition:
+            raise ValueError(trxnErrors["MAPPING_RULES"] + f": {detail}")
+
+    check(isinstance(rules, dict), "no son un diccionario")
+    for section in rules:
+        check(section in mappingRulesSections, f"sección {section} " \
+                "desconocida")
+        check(isinstance(rules[section], dict), f"la sección {section} no " \
+                "es un diccionario")
+    signRules = rules.get("signRules", {})
+    signFields = {}
+    for ruleName, rule in signRules.items():
+        check(isinstance(rule, dict) and set(rule) == {"positive", \
+                "negative", "zero"}, f"regla de signo {ruleName}")
+        fieldsBySign = []
+        for sign in ("zero", "positive", "negative"):
+            check(isinstance(rule[sign], list) and set(rule[sign]) <= \
+                    set(outAmountFieldNames), f"regla de signo {ruleName}")
+            fieldsBySign.append(frozenset(rule[sign] + \
+                    [amountCoinFields[field] for field in rule[sign]]))
+        signFields[ruleName] = tuple(fieldsBySign)
+    check(defaultSignRule in signFields, f"falta la regla {defaultSignRule}")
+
+    operationTypes, operationOps, operationSignFields = {}, {}, {}
+    tradeLegOperations = set()
+    for operation, operationRules in rules.get("operations", {}).items():
+        check(isinstance(operationRules, dict) and set(operationRules) <= \
+                {"type", "op", "sign", "tradeLeg"} and \
+                operationRules.get("type") in outTypes and \
+                isinstance(operationRules.get("op", ""), str) and \
+                operationRules.get("sign", defaultSignRule) in signFields \
+                and isinstance(operationRules.get("tradeLeg", False), bool), \
+                f"operación {operation}")
+        operationTypes[operation] = sys.intern(operationRules["type"])
+        operationOps[operation] = operationRules.get("op", "")
+        if operationRules.get("tradeLeg", False):
+            tradeLegOperations.add(operation)
+        operationSignFields[operation] = signFields[operationRules.get( \
+                "sign", defaultSignRule)]
+
+    coinRemaps = rules.get("coinRemaps", {})
+    for coin, newCoin in coinRemaps.items():
+        check(isinstance(newCoin, str), f"coinRemaps {coin}")
+
+    return types.MappingProxyType( \
+            {"operationTypes": types.MappingProxyType(operationTypes), \
+             "operationOps": types.MappingProxyType(operationOps), \
+             "tradeLegOperations": frozenset(tradeLegOperations), \
+             "operationSignFields": \
+                types.MappingProxyType(operationSignFields), \
+             "defaultSignFields": signFields[defaultSignRule], \
+             "coinRemaps": types.MappingProxyType(dict(coinRemaps))})
+
+
+
+def loadMappingRules(fileName, baseRules=defaultMappingRules):
+    """
+    Leer unas reglas de clasificación de un archivo JSON con el formato de
+    compileMappingRules. Cada entrada de cada sección del archivo se añade a
+    las de baseRules o sustituye a la que tenga la misma clave.
+
+    RETORNO:
+        Diccionario con las reglas resultantes, sin compilar.
+
+    EXCEPCIONES:
+        ValueError si el archivo no es JSON o las reglas resultantes no
+        tienen el formato de compileMappingRules, con el nombre del archivo
+        y la sección o la clave incorrecta en el mensaje.
+    """
+
+    def check(condition, detail):
+        if not condition:
+            raise ValueError(trxnErrors["MAPPING_RULES"] + \
+                    f": {fileName}: {detail}")
+
+    with open(fileName, encoding="utf-8") as rulesFile:
+        try:
+            fileRules = json.load(rulesFile)
+        except json.JSONDecodeError as error:
+            check(False, error)
+    check(isinstance(fileRules, dict), "no es un objeto JSON")
+    for section, values in fileRules.items():
+        check(section in mappingRulesSections, f"sección {section} " \
+                "desconocida")
+        check(isinstance(values, dict), f"la sección {section} no es un " \
+                "objeto JSON")
+
+    rules = {section: {**baseRules.get(section, {}), **values} for section, \
+            values in it.chain(baseRules.items(), fileRules.items())}
+    try:
+        compileMappingRules(rules)
+    except ValueError as error:
+        check(False, str(error).split(": ", 1)[-1])
+    return rules
+
+
+
+def setMappingRules(rules=defaultMappingRules):
+    """
+    Compilar (ver compileMappingRules) y activar unas reglas de
+    clasificación. Deben activarse antes de obtener las funciones de proceso
+    con getTrxnsProcess, y las mismas en cada proceso trabajador.
+    """
+    global mappingRules, operationTypes, operationOps, tradeLegOperations, \
+            operationSignFields, defaultSignFields, coinRemaps
+    tables = compileMappingRules(rules)
+    mappingRules = rules
+    operationTypes = tables["operationTypes"]
+    operationOps = tables["operationOps"]
+    tradeLegOperations = tables["tradeLegOperations"]
+    operationSignFields = tables["operationSignFields"]
+    defaultSignFields = tables["defaultSignFields"]
+    coinRemaps = tables["coinRemaps"]
+
+
+setMappingRules()
+
+
+
+def getType(operation):
+    return operationTypes.get(operation)
+
+
+def getOp(operation):
+    return operationOps.get(operation, "")
+
+
+# value es la cantidad ya parseada con parseAmount. Las tuplas de
+# operationSignFields se indexan por el signo: 0, 1 (positivo) o -1.
+def getOpValue(operation, value, newField):
+    if newField in operationSignFields.get(operation, defaultSignFields)[ \
+            (value > 0) - (value < 0)]:
+        return abs(value)
+    return ""
+
+
+def getCoin(operation, value, coin, newField):
+    if newField not in operationSignFields.get(operation, \
+            defaultSignFields)[(value > 0) - (value < 0)]:
+        return ""
+
+    return coinRemaps.get(coin, coin)
+
+
+
+def getComment(oldComment, trxnType):
+    pass
+
+
+outGets = [getType, getOp, getOpValue, getCoin, getComment]
+
+
+def getOutFieldsPlan(getDates=None):
+    """
+    Obtener el plan de campos de salida: por cada campo de salida, función a
+    aplicar, campos de entrada cuyos valores recibe y argumentos fijos
+    añadidos al final (ver getPlanEntry).
+
+    ARGUMENTOS:
+        - getDates: función obtenida con wrapDateStage(dateFormat,
+        [newDateFormat, newDayFormat]) para obtener la Fecha. Si None se crea
+        una nueva.
+
+    RETORNO:
+        Diccionario con una entrada del plan por cada campo de salida.
+    """
+
+    if getDates is None:
+        getDates = wrapDateStage(dateFormat, [newDateFormat, newDayFormat])
+
+    return \
+            {outFieldNames[0]: (getType, [inFieldNames[3]]), \
+             outFieldNames[1]: (getOp, [inFieldNames[3]]), \
+             outFieldNames[2]: (getOpValue, [inFieldNames[3], \
+                inFieldNames[5]], [outFieldNames[2]]), \
+             outFieldNames[4]: (getOpValue, [inFieldNames[3], \
+                inFieldNames[5]], [outFieldNames[4]]), \
+             outFieldNames[6]: (getOpValue, [inFieldNames[3], \
+                inFieldNames[5]], [outFieldNames[6]]), \
+             outFieldNames[3]: (getCoin, [inFieldNames[3], inFieldNames[5], \
+                inFieldNames[4]], [outFieldNames[3]]), \
+             outFieldNames[5]: (getCoin, [inFieldNames[3], inFieldNames[5], \
+                inFieldNames[4]], [outFieldNames[5]]), \
+             outFieldNames[7]: (getCoin, [inFieldNames[3], inFieldNames[5], \
+                inFieldNames[4]], [outFieldNames[7]]), \
+             outFieldNames[8]: lambda x: "Binance", \
+             outFieldNames[10]: (None, [inFieldNames[6]]), \
+             outFieldNames[11]: (getDateField, [inFieldNames[1]], \
+                [getDates, dateFormat, 0])}
+
+
+
+def getTrxnsProcess(isPlanCompiled=True, stats=None, tradeTolerance=0):
+    """
+    Construir las funciones que procesan las transacciones: plan de campos de
+    salida, obtención de groupId y blockId, y unión de grupos por tipo.
+
+    ARGUMENTOS:
+        - isPlanCompiled: si True el plan de campos se compila con
+        compileNewTrxnKeys; si no, se usa processNewTrxnKeys.
+        - stats: objeto TrxnsStats donde medir el parseo y formato de fechas
+        como fase "dates" (dentro de otras fases). Si None no se mide.
+        - tradeTolerance: segundos de tolerancia al juntar grupos de trading
+        incompletos con matchTradeGroups antes de unirlos. Solo se juntan
+        grupos de Operation que son partes de órdenes (ver "tradeLeg" en
+        compileMappingRules), que processTrxn marca con isTradeLeg. Si 0
+        (por defecto) no se juntan, y los grupos son los de la Fecha exacta.
+
+    RETORNO:
+        Diccionario con tradeTolerance, el plan de campos outFieldsPlan, las
+        funciones de
+        unión por tipo typeMerges y las funciones getDates, processTrxn,
+        mergeTrxnsGroups, getTrxnGroupId y getTrxnBlockId, listas para pasar a
+        csvProcessTrxns. mergeTrxnsGroups junta los grupos con
+        matchTrxnsGroups y los une con mergeTrxnsGroupsByType, que también se
+        devuelven por separado.
+    """
+
+    # Cada UTC_Time se parsea una sola vez: Fecha, día del bloque, día del
+    # groupId de staking y segundos para ordenar o juntar trades salen del
+    # mismo resultado en caché.
+    getDates = wrapDateStage(dateFormat, [newDateFormat, newDayFormat, \
+            epochSecondsFormat])
+    if stats is not None:
+        getDates = stats.wrapStage("dates", getDates, isNested=True)
+    getDay = wrapf(getDateField, getDates, newDateFormat, 1)
+    outFieldsPlan = getOutFieldsPlan(getDates)
+
+    typeMerges = \
+            {outTypes[0]: wrapf(mergeStakingTrxns, outFieldNames[3], \
+                outFieldNames[2]), \
+             outTypes[1]: wrapf(mergeTradeTrxns, outFieldNames[3], \
+                outFieldNames[2], outFieldNames[5], outFieldNames[4], \
+                outFieldNames[7], outFieldNames[6], outFieldNames[10])}
+    #getsBlockId = \
+    #        {"function": lambda v: applyDateFormat(v, dateFormat, dayFormat), \
+    #         "keys": [dateFieldNameOut]}
+    # Las distintas formas de obtener el groupId tienen que tener en común
+    # que el primer o último campo sea el tipo, ya que todos los groupId,
+    # aunque se obtengan de manera distinta dependiendo del tipo de la trxn,
+    # debe ser único entre todos los groupId de todas las trxns.
+    # Los groupId son tuplas de valores ya parseados (tipo y moneda
+    # internados, fecha o día), no cadenas concatenadas: no se construye
+    # ninguna cadena por fila y tipos distintos no pueden colisionar.
+    internParsers = {0: sys.intern, 1: sys.intern}
+    typeGetsGroupId = \
+            {outTypes[0]: wrapGetTrxnValue(wrapf(getGroupId, \
+                valueParsers={**internParsers, 2: getDay}), \
+                outFieldNames[0], outFieldNames[3], outFieldNames[11]), \
+             **dict.fromkeys([outTypes[1], outTypes[1]], \
+                wrapGetTrxnValue(wrapf(getGroupId, \
+                valueParsers={0: sys.intern}), outFieldNames[0], \
+                outFieldNames[11])),
+             **dict.fromkeys([outTypes[2], outTypes[3]], \
+                wrapGetTrxnValue(wrapf(getGroupId, \
+                valueParsers=internParsers), outFieldNames[0], \
+                outFieldNames[3], outFieldNames[11])),
+            }
+
+    if isPlanCompiled:
+        processTrxn = compileNewTrxnKeys(outFieldsPlan, inFieldsParsers, \
+                InTrxn, OutTrxn)
+    else:
+        outFieldsGetsValues = planToGetsValues(outFieldsPlan)
+        processTrxn = lambda trxn: processNewTrxnKeys(parseTrxnFields(trxn, \
+                inFieldsParsers), outFieldsGetsValues, OutTrxn)
+
+    mergeTrxnsGroupsByTypes = wrapf(mergeTrxnsGroupsByType, \
+            outFieldNames[0], typeMerges)
+    if tradeTolerance > 0:
+        # Solo al juntar grupos hace falta distinguir las partes de órdenes.
+        processOutTrxn = processTrxn
+        processTrxn = lambda trxn: markTradeLeg(processOutTrxn(trxn), \
+                trxn.get(inFieldNames[3]))
+        getTrxnTime = wrapGetTrxnValue(wrapf(getDateField, getDates, \
+                newDateFormat, 2), outFieldNames[11])
+        matchTrxnsGroups = wrapf(matchTradeGroups, tradeTolerance, \
+                getTrxnTime, outFieldNames[0], outTypes[1], outFieldNames[3], \
+                outFieldNames[5], outFieldNames[7], isTradeLeg)
+    else:
+        matchTrxnsGroups = list
+
+    return {"getDates": getDates, \
+            "outFieldsPlan": outFieldsPlan, \
+            "tradeTolerance": tradeTolerance, \
+            "processTrxn": processTrxn, \
+            "typeMerges": typeMerges, \
+            "matchTrxnsGroups": matchTrxnsGroups, \
+            "mergeTrxnsGroupsByType": mergeTrxnsGroupsByTypes, \
+            "mergeTrxnsGroups": lambda trxnsGroups: mergeTrxnsGroupsByTypes( \
+                matchTrxnsGroups(trxnsGroups)), \
+            "getTrxnGroupId": wrapf(getTrxnValueByField, outFieldNames[0], \
+                typeGetsGroupId), \
+            "getTrxnBlockId": wrapGetTrxnValue(getDay, outFieldNames[11])}
+
+
+
+
+# Funciones de cada proceso trabajador al procesar por días en paralelo. Cada
+# proceso construye sus propias funciones, ya que no se pueden serializar.
+workerTrxnsProcess = None
+
+
+def initTrxnsProcessWorker(isPlanCompiled, logConfig=None, tradeTolerance=0, \
+        rules=None):
+    """
+    Inicializar un proceso trabajador construyendo sus funciones de proceso.
+    Si logConfig no es None (configuración de setupLogging del proceso
+    principal), el trabajador escribe su log directamente en el mismo archivo.
+    Si rules no es None, activa esas reglas de clasificación (ver
+    setMappingRules), las mismas que las del proceso principal.
+    """
+    global workerTrxnsProcess
+    if rules is not None:
+        setMappingRules(rules)
+    workerTrxnsProcess = getTrxnsProcess(isPlanCompiled, \
+            tradeTolerance=tradeTolerance)
+    if logConfig is not None:
+        setupLogging(**logConfig, isAsync=False)
+        # Los trabajadores no ejecutan atexit al terminar.
+        multiprocessing.util.Finalize(None, stopLogging, exitpriority=10)
+
+
+
+def processTrxnsShard(trxns, isStats=False):
+    """
+    Procesar y unir en un proceso trabajador las transacciones de un tramo de
+    días completos.
+
+    RETORNO:
+        Lista de transacciones de salida del tramo. Si isStats, tupla con la
+        lista y los grupos del tramo contados por tipo (ver
+        TrxnsStats.countGroups).
+    """
+
+    mergeTrxnsGroups = workerTrxnsProcess["mergeTrxnsGroups"]
+    if isStats:
+        stats = TrxnsStats()
+
+        def mergeTrxnsGroups(trxnsGroups):
+            trxnsGroups = workerTrxnsProcess["matchTrxnsGroups"](trxnsGroups)
+            stats.countGroups(trxnsGroups, outFieldNames[0], \
+                    workerTrxnsProcess["typeMerges"])
+            return workerTrxnsProcess["mergeTrxnsGroupsByType"](trxnsGroups)
+
+    outTrxns = csvProcessTrxns(trxns, workerTrxnsProcess["processTrxn"], \
+            None, mergeTrxnsGroups, workerTrxnsProcess["getTrxnGroupId"])
+    return (outTrxns, stats.groups) if isStats else outTrxns
+
+
+
+
+def shardTrxnsByDay(trxns, getTrxnDay, shardSize, isGrouped=True):
+    """
+    Dividir las transacciones en tramos de días completos.
+
+    ARGUMENTOS:
+        - trxns: iterable de transacciones de entrada.
+        - getTrxnDay: función que obtiene el día de una transacción.
+        - shardSize: número mínimo de transacciones por tramo (salvo el
+        último). Un tramo solo se cierra al cambiar de día.
+        - isGrouped: si True, las transacciones de un mismo día llegan
+        seguidas y se van leyendo conforme se necesitan. Si False, antes se
+        agrupan todas por día en memoria, en orden de aparición de cada día.
+
+    RETORNO:
+        Generador de listas de transacciones, cada una con días completos.
+    """
+
+    if not isGrouped:
+        trxnsByDay = {}
+        for trxn in trxns:
+            trxnsByDay.setdefault(getTrxnDay(trxn), []).append(trxn)
+        trxns = (trxn for dayTrxns in trxnsByDay.values() for trxn in dayTrxns)
+
+    shard = []
+    prevDay = None
+    for trxn in trxns:
+        day = getTrxnDay(trxn)
+        if len(shard) >= shardSize and day != prevDay:
+            yield shard
+            shard = []
+        shard.append(trxn)
+        prevDay = day
+
+    if shard:
+        yield shard
+
+
+
+
+def parallelProcessTrxns(trxnsIn, getTrxnDay, workers, csvOut=None, \
+        shardSize=20000, isGrouped=True, isPlanCompiled=True, \
+        tradeTolerance=0, stats=None):
+    """
+    Procesar las transacciones en paralelo por tramos de días completos. Los
+    días son independientes a la hora de unir transacciones, así que cada
+    tramo se procesa y une en un proceso distinto con csvProcessTrxns y los
+    resultados se escriben en el orden de los tramos.
+
+    ARGUMENTOS:
+        - trxnsIn: Iterator con las transacciones de entrada.
+        - getTrxnDay: función que obtiene el día de una transacción de
+        entrada.
+        - workers: número de procesos.
+        - csvOut: writer csv de salida. Si None se devuelven todas las
+        transacciones procesadas como lista.
+        - shardSize: número mínimo de transacciones por tramo.
+        - isGrouped: ver shardTrxnsByDay.
+        - isPlanCompiled, tradeTolerance: ver getTrxnsProcess.
+        - stats: objeto TrxnsStats donde sumar los grupos por tipo contados
+        en cada proceso. Si None no se cuentan.
+
+    RETORNO:
+        - csvOut == None: lista de transacciones de salida.
+        - csvOut != None: Número de caracteres escritos en el csv writer.
+    """
+
+    if csvOut is None:
+        outTrxns = []
+    else:
+        outTrxns = 0
+        csvOut.writeheader()
+
+    def getShardTrxns(future):
+        if stats is None:
+            return future.result()
+        tempOutTrxns, groups = future.result()
+        for groupType, counts in groups.items():
+            stats.groups[groupType].update(counts)
+        return tempOutTrxns
+
+    # Como mucho 2 tramos pendientes por proceso, para acotar la memoria.
+    pending = cl.deque()
+    with cf.ProcessPoolExecutor(workers, initializer=initTrxnsProcessWorker, \
+            initargs=(isPlanCompiled, logState and logState["config"], \
+            tradeTolerance, mappingRules)) as executor:
+        for shard in shardTrxnsByDay(trxnsIn, getTrxnDay, shardSize, \
+                isGrouped):
+            pending.append(executor.submit(processTrxnsShard, shard, \
+                    stats is not None))
+            while len(pending) > 2 * workers or \
+                    (pending and pending[0].done()):
+                tempOutTrxns = getShardTrxns(pending.popleft())
+                if csvOut is None:
+                    outTrxns.extend(tempOutTrxns)
+                else:
+                    outTrxns += csvWriteRows(csvOut, tempOutTrxns)
+
+        while pending:
+            tempOutTrxns = getShardTrxns(pending.popleft())
+            if csvOut is None:
+                outTrxns.extend(tempOutTrxns)
+            else:
+                outTrxns += csvWriteRows(csvOut, tempOutTrxns)
+
+    return outTrxns
+
+
+
+
+def getPeakMemoryBytes():
+    """
+    Obtener el pico de memoria residente (RSS) del proceso en bytes, o None
+    si no está disponible el módulo resource.
+    """
+    if resource is None:
+        return None
+    peakMemoryBytes = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss está en KiB salvo en macOS, que está en bytes.
+    return peakMemoryBytes if sys.platform == "darwin" else \
+            peakMemoryBytes * 1024
+
+
+
+class TrxnsStats:
+    """
+    Tiempos de reloj y de CPU, transacciones por fase, grupos por tipo y
+    contadores de una conversión. Las fases se miden envolviendo sus funciones
+    (ver wrapStage y wrapIter) solo cuando se piden estadísticas, así que sin
+    ellas la conversión no tiene ningún coste añadido.
+    """
+
+    def __init__(self):
+        self.stages = cl.OrderedDict()
+        self.nestedStages = set()
+        self.groups = cl.defaultdict(cl.Counter)
+        self.counters = cl.Counter()
+        self.startWall = time.perf_counter()
+        self.startCpu = time.process_time()
+
+
+    def getStage(self, name):
+        """
+        Obtener el diccionario de una fase (rows, wallSeconds, cpuSeconds),
+        creándolo si no existe.
+        """
+        if name not in self.stages:
+            self.stages[name] = {"rows": 0, "wallSeconds": 0.0, \
+                    "cpuSeconds": 0.0}
+        return self.stages[name]
+
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Medir como fase name el bloque de un with.
+        """
+        stage = self.getStage(name)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield stage
+        finally:
+            stage["wallSeconds"] += time.perf_counter() - wall
+            stage["cpuSeconds"] += time.process_time() - cpu
+
+
+    def wrapStage(self, name, function, getRows=None, isNested=False):
+        """
+        Envolver una función para medir sus llamadas como fase name.
+
+        ARGUMENTOS:
+            - name: nombre de la fase.
+            - function: función a medir.
+            - getRows: función que obtiene de los argumentos de cada llamada
+            el número de transacciones que procesa. Si None, una por llamada.
+            - isNested: si True, la fase se mide dentro de otras fases y no se
+            resta del tiempo total al calcular el resto ("other").
+
+        RETORNO:
+            Función envuelta.
+        """
+        stage = self.getStage(name)
+        if isNested:
+            self.nestedStages.add(name)
+        perfCounter, processTime = time.perf_counter, time.process_time
+
+        def stageFunction(*args):
+            wall, cpu = perfCounter(), processTime()
+            result = function(*args)
+            stage["wallSeconds"] += perfCounter() - wall
+            stage["cpuSeconds"] += processTime() - cpu
+            stage["rows"] += 1 if getRows is None else getRows(*args)
+            return result
+
+        return stageFunction
+
+
+    def wrapIter(self, name, trxns):
+        """
+        Generador que devuelve las transacciones de trxns midiendo como fase
+        name el tiempo de obtener cada una.
+        """
+        stage = self.getStage(name)
+        perfCounter, processTime = time.perf_counter, time.process_time
+        trxns = iter(trxns)
+        while True:
+            wall, cpu = perfCounter(), processTime()
+            trxn = next(trxns, None)
+            stage["wallSeconds"] += perfCounter() - wall
+            stage["cpuSeconds"] += processTime() - cpu
+            if trxn is None:
+                return
+            stage["rows"] += 1
+            yield trxn
+
+
+    def countGroups(self, trxnsGroups, typeIndex, typeMerges):
+        """
+        Contar por tipo los grupos unidos (más de una transacción y tipo con
+        función de unión) y los que pasan sin unir. Los grupos ya unidos por
+        el motor (SummedTrxnsGroup) cuentan con sus transacciones de entrada.
+        """
+        for trxnsGroup in trxnsGroups:
+            groupType = trxnsGroup[0][typeIndex]
+            isMerged = getGroupRowsIn(trxnsGroup) > 1 and \
+                    groupType in typeMerges
+            self.groups[groupType]["merged" if isMerged else "passed"] += 1
+
+
+    def getReport(self):
+        """
+        Obtener el informe de las estadísticas como diccionario serializable
+        a JSON. El tiempo no medido en ninguna fase va en la fase "other".
+        """
+        wallSeconds = time.perf_counter() - self.startWall
+        stages = cl.OrderedDict((name, dict(stage)) for name, stage in \
+                self.stages.items() if stage["rows"] or stage["wallSeconds"])
+        stages["other"] = {"rows": 0, "wallSeconds": wallSeconds - \
+                sum(stage["wallSeconds"] for name, stage in stages.items() \
+                if name not in self.nestedStages)}
+
+        peakMemoryBytes = getPeakMemoryBytes()
+
+        return {"wallSeconds": wallSeconds, \
+                "cpuSeconds": time.process_time() - self.startCpu, \
+                "peakMemoryBytes": peakMemoryBytes, \
+                "stages": stages, \
+                "nestedStages": sorted(self.nestedStages), \
+                "groups": {str(groupType): dict(counts) for groupType, counts \
+                    in self.groups.items()}, \
+                "counters": dict(self.counters)}
+
+
+    def formatTable(self):
+        """
+        Obtener el informe de las estadísticas como tabla de texto.
+        """
+        report = self.getReport()
+        lines = [f"{'Fase':<14}{'Filas':>12}{'Reloj (s)':>12}{'CPU (s)':>12}"]
+        for name, stage in report["stages"].items():
+            label = name + ("*" if name in self.nestedStages else "")
+            cpuSeconds = stage.get("cpuSeconds")
+            lines.append(f"{label:<14}{stage['rows']:>12,}" \
+                    f"{stage['wallSeconds']:>12.3f}" + \
+                    ("" if cpuSeconds is None else f"{cpuSeconds:>12.3f}"))
+        lines.append(f"{'total':<14}{'':>12}{report['wallSeconds']:>12.3f}" \
+                f"{report['cpuSeconds']:>12.3f}")
+        if self.nestedStages:
+            lines.append("* fase medida dentro de otras fases")
+        if report["peakMemoryBytes"] is not None:
+            lines.append(f"Memoria máxima: " \
+                    f"{report['peakMemoryBytes'] / 2**20:,.1f} MiB")
+        for groupType, counts in report["groups"].items():
+            lines.append(f"Grupos {groupType}: {counts.get('merged', 0):,} " \
+                    f"unidos, {counts.get('passed', 0):,} sin unir")
+        for name, value in report["counters"].items():
+            lines.append(f"{name}: {value:,}")
+
+        return "\n".join(lines)
+
+
+
+
+def countTrxns(trxns, counters, key):
+    """
+    Generador que devuelve las mismas transacciones contándolas en
+    counters[key].
+    """
+    for trxn in trxns:
+        counters[key] += 1
+        yield trxn
+
+
+
+def putUntilStopped(items, item, stop, timeout=0.1):
+    """
+    Meter item en la cola acotada items esperando a que haya sitio, salvo que
+    se active antes el evento stop.
+
+    RETORNO:
+        True si item se ha metido en la cola; False si se ha parado antes.
+    """
+    while not stop.is_set():
+        try:
+            items.put(item, timeout=timeout)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+
+def readAheadTrxns(trxns, batchSize=1000, queueSize=8):
+    """
+    Generador que devuelve las mismas transacciones de trxns en el mismo orden,
+    pero obteniéndolas en un hilo lector que las va dejando por lotes en una
+    cola acotada. Así la lectura (y el parseo csv) de la entrada se solapa con
+    el proceso de las transacciones que ya se han leído.
 
-    inFile.close()
+    ARGUMENTOS:
+        - trxns: iterable de transacciones de entrada. Solo se recorre en el
+        hilo lector.
+        - batchSize: transacciones por cada lote de la cola.
+        - queueSize: lotes como máximo en la cola. Si está llena, el hilo
+        lector espera a que se vayan consumiendo.
+
+    RETORNO:
+        Generador de transacciones. Las excepciones del hilo lector se lanzan
+        al llegar a ellas. Si el generador se cierra antes de terminar, el
+        hilo lector se para.
+    """
+
+    batches = queue.Queue(queueSize)
+    stop = threading.Event()
+
+    def read():
+        trxnsIter = iter(trxns)
+        try:
+            for batch in iter(lambda: list(it.islice(trxnsIter, batchSize)), \
+                    []):
+                if not putUntilStopped(batches, (batch, None), stop):
+                    return
+            item = (None, None)
+        except BaseException as error:
+            item = (None, error)
+        putUntilStopped(batches, item, stop)
+
+    reader = threading.Thread(target=read, name="readAheadTrxns", daemon=True)
+    reader.start()
+    try:
+        while True:
+            batch, error = batches.get()
+            if batch is None:
+                if error is not None:
+                    raise error
+                return
+            yield from batch
+    finally:
+        stop.set()
+
+
+
+class ThreadedTrxnsWriter:
+    """
+    Writer csv que escribe las filas en un hilo escritor. Las filas se
+    acumulan en lotes de batchSize y cada lote se deja en una cola acotada de
+    queueSize lotes, que el hilo escritor va escribiendo con writerows en
+    csvWriter, en el mismo orden. Si la cola está llena, writerow espera.
+    writerow y writerows devuelven 0 (los caracteres se escriben más tarde) y
+    rowsWritten cuenta las filas ya pasadas al writer. Hay que llamar a close
+    al terminar para escribir el último lote, esperar al hilo escritor y
+    lanzar sus posibles excepciones.
+    """
+
+    isBatched = True
+
+    def __init__(self, csvWriter, batchSize=1000, queueSize=8):
+        self.csvWriter = csvWriter
+        self.batchSize = batchSize
+        self.batch = []
+        self.rowsWritten = 0
+        self.error = None
+        self.items = queue.Queue(queueSize)
+        self.stop = threading.Event()
+        self.writer = threading.Thread(target=self.write, \
+                name="ThreadedTrxnsWriter", daemon=True)
+        self.writer.start()
+
+    def write(self):
+        while True:
+            write, args = self.items.get()
+            if write is None:
+                return
+            try:
+                write(*args)
+            except BaseException as error:
+                self.error = error
+                self.stop.set()
+                return
+
+    def put(self, write, *args):
+        if not putUntilStopped(self.items, (write, args), self.stop):
+            raise self.error
+
+    def flush(self):
+        if self.batch:
+            self.put(self.csvWriter.writerows, self.batch)
+            self.batch = []
+
+    def writeheader(self):
+        self.flush()
+        self.put(self.csvWriter.writeheader)
+
+    def writerow(self, rowdict):
+        self.batch.append(rowdict)
+        self.rowsWritten += 1
+        if len(self.batch) >= self.batchSize:
+            self.flush()
+        return 0
+
+    def writerows(self, rowdicts):
+        rowdicts = iter(rowdicts)
+        while True:
+            rows = list(it.islice(rowdicts, self.batchSize - len(self.batch)))
+            if not rows:
+                return 0
+            self.batch.extend(rows)
+            self.rowsWritten += len(rows)
+            if len(self.batch) >= self.batchSize:
+                self.flush()
+
+    def close(self):
+        self.flush()
+        self.put(None)
+        self.writer.join()
+        if self.error is not None:
+            raise self.error
+
+
+
+
+def convertTrxnsFile(inFileName, outFileName, trxnsProcess=None, \
+        engine="rows", isStream=False, reorderWindow=60, isSort=False, \
+        sortRunSize=100000, workers=1, isPlanCompiled=True, isMmap=False, \
+        dayRange=None, cacheDir=None, stats=None, tradeTolerance=0, \
+        isPipeline=False, pipelineBatchSize=1000, outFormat="csv", \
+        stageDbFileName=None):
+    """
+    Convertir un archivo extracto de Binance en el archivo csv de salida.
+
+    ARGUMENTOS:
+        - inFileName: nombre del archivo csv de entrada.
+        - outFileName: nombre del archivo csv de salida.
+        - trxnsProcess: funciones de proceso obtenidas con getTrxnsProcess.
+        Si None se construyen.
+        - engine: "rows" para procesar fila a fila, "numpy" por columnas o
+        "sqlite" para unir las transacciones en una base de datos de staging
+        (ver loadTrxnsStage y sqliteProcessTrxns), leyendo y escribiendo
+        siempre por bloques y sin tener en memoria más de un día.
+        - isStream: leer y escribir por bloques de un día en vez de en
+        memoria.
+        - reorderWindow: segundos de la ventana de reordenación en isStream.
+        - isSort: ordenar antes la entrada con externalSortTrxns.
+        - sortRunSize: transacciones por tramo al ordenar.
+        - workers: número de procesos para procesar los días en paralelo.
+        - isPlanCompiled: ver getTrxnsProcess.
+        - isMmap: leer la entrada con mmapReadTrxns en vez de DictReader.
+        - dayRange: tupla (fromDay, toDay) para convertir solo ese rango de
+        días con readDayRange. Si None se convierte todo.
+        - cacheDir: directorio de la caché binaria de transacciones ya
+        procesadas, indexada por el hash del contenido de la entrada y la
+        huella del plan de campos (ver getPlanFingerprint). Si existe, no se
+        lee ni procesa la entrada. Solo con engine "rows", en memoria y un
+        proceso. Si None no se usa caché.
+        - stats: objeto TrxnsStats donde medir cada fase de la conversión.
+        Con engine "numpy" el proceso, la agrupación y la suma del staking
+        van en la fase "numpy", y con varios procesos el proceso y la unión
+        de los trabajadores van en la fase "workers" (sus grupos sí se
+        cuentan por tipo). Si None no se mide nada.
+        - tradeTolerance: ver getTrxnsProcess. Solo se usa si trxnsProcess es
+        None o con varios procesos.
+        - isPipeline: leer la entrada en un hilo lector (readAheadTrxns) y
+        escribir la salida en un hilo escritor (ThreadedTrxnsWriter) con un
+        búfer de archivo grande, solapando la E/S con el proceso. Con stats,
+        la fase "read" mide la espera de la entrada y "write" la de la cola
+        de salida.
+        - pipelineBatchSize: transacciones por lote en las colas de isPipeline.
+        - outFormat: formato de salida: "csv" o uno de trxnsSinks.
+        - stageDbFileName: con engine "sqlite", base de datos de staging. Se
+        reutiliza sin leer la entrada si se cargó con la misma entrada, plan
+        de campos y dayRange. Si None, se usa getStageDbFileName.
+
+    RETORNO:
+        Diccionario resumen con los archivos, las transacciones de entrada
+        (rowsIn) y de salida (rowsOut), los grupos de más de una transacción
+        unidos (groupsMerged, None si se procesa en paralelo o con los motores
+        numpy o sqlite) y los segundos empleados.
+    """
+
+    startTime = time.perf_counter()
+    counters = cl.Counter()
+    if trxnsProcess is None:
+        trxnsProcess = getTrxnsProcess(isPlanCompiled, stats, tradeTolerance)
+    timeStage = (lambda name: contextlib.nullcontext()) if stats is None \
+            else stats.stage
+
+    # En memoria solo se guardan las transacciones ya procesadas: las de
+    # entrada se procesan conforme se leen, sin guardarlas en una lista.
+    isCsvOutToMem = not isStream and engine != "sqlite"
+
+    cacheFileName = processedTrxns = None
+    if cacheDir is not None:
+        assert engine == "rows" and not isStream and workers == 1, \
+                trxnErrors["CACHE_MODE"]
+        os.makedirs(cacheDir, exist_ok=True)
+        cacheFileName = os.path.join(cacheDir, hashFile(inFileName) + "-" + \
+                getPlanFingerprint(trxnsProcess["outFieldsPlan"], isSort, \
+                dayRange, trxnsProcess["tradeTolerance"] > 0) + ".trxns")
+        if os.path.exists(cacheFileName):
+            with timeStage("cache"):
+                processedTrxns = loadTrxnsCache(cacheFileName)
+            counters["rowsIn"] = len(processedTrxns)
+
+    assert getCompression(inFileName) is None or not isMmap and \
+            dayRange is None, trxnErrors["COMPRESSED_MODE"] + f": {inFileName}"
+
+    stage = None
+    if engine == "sqlite":
+        assert workers == 1 and cacheDir is None, trxnErrors["SQLITE_MODE"]
+        stageFileName = stageDbFileName or getStageDbFileName(inFileName)
+        stageKey = hashFile(inFileName) + "-" + getPlanFingerprint( \
+                trxnsProcess["outFieldsPlan"], dayRange, outFieldNames)
+        stage = openTrxnsStage(stageFileName, stageKey)
+        if stage is not None:
+            counters["rowsIn"] = stage[1]
+
+    if processedTrxns is not None or stage is not None:
+        inFile = None
+        trxnsIn = processedTrxns
+    elif dayRange is not None:
+        inFile = None
+        csvIn = readDayRange(inFileName, *dayRange, trxnsProcess["getDates"])
+        inFieldNamesRead = inFieldNames
+    elif isMmap:
+        inFile = None
+        csvIn = mmapReadTrxns(inFileName)
+        inFieldNamesRead = inFieldNames
+    else:
+        inFile = openTrxnsFile(inFileName)
+        with timeStage("sniff"):
+            csvIn, inFieldNamesRead = csvReadTrxns(inFile)
+    getTrxnSeconds = lambda trxn: trxnsProcess["getDates"]( \
+            trxn[inFieldNames[1]])[2]
+    if processedTrxns is None and stage is None:
+        if isPipeline:
+            csvIn = readAheadTrxns(csvIn, pipelineBatchSize)
+        trxnsIn = countTrxns(csvIn, counters, "rowsIn")
+        if stats is not None:
+            trxnsIn = stats.wrapIter("read", trxnsIn)
+        if isSort:
+            trxnsIn = externalSortTrxns(trxnsIn, getTrxnSeconds, \
+                    inFieldNamesRead, sortRunSize)
+        if isStream and reorderWindow > 0 and not isSort and \
+                engine != "sqlite":
+            trxnsIn = reorderTrxns(trxnsIn, getTrxnSeconds, reorderWindow)
+
+    processTrxn = trxnsProcess["processTrxn"]
+    getTrxnGroupId = trxnsProcess["getTrxnGroupId"]
+    matchTrxnsGroups = trxnsProcess["matchTrxnsGroups"]
+    mergeTrxnsGroupsByType = trxnsProcess["mergeTrxnsGroupsByType"]
+    processNpTrxns = npProcessTrxns
+    if stats is not None:
+        processTrxn = stats.wrapStage("process", processTrxn)
+        matchTrxnsGroups = stats.wrapStage("match", matchTrxnsGroups, len, \
+                engine == "numpy")
+        getTrxnGroupId = stats.wrapStage("group", getTrxnGroupId)
+        # Con numpy la unión de grupos se hace dentro de npProcessTrxns.
+        mergeTrxnsGroupsByType = stats.wrapStage("merge", \
+                mergeTrxnsGroupsByType, \
+                lambda groups: sum(map(getGroupRowsIn, groups)), \
+                engine == "numpy")
+        processNpTrxns = stats.wrapStage("numpy", processNpTrxns, \
+                lambda *args: counters["rowsIn"])
+    if cacheFileName is not None:
+        # La caché guarda las transacciones ya procesadas, antes de unirlas.
+        if processedTrxns is None:
+            processedTrxns = [processTrxn(trxn) for trxn in trxnsIn]
+            saveTrxnsCache(cacheFileName, processedTrxns)
+        trxnsIn = processedTrxns
+        processTrxn = lambda trxn: trxn
+
+    sink = csvOut = openTrxnsSink(outFileName, outFormat, \
+            (1 << 20) if isPipeline else -1)
+    if isPipeline:
+        csvOut = ThreadedTrxnsWriter(sink, pipelineBatchSize)
+    if stats is not None:
+        csvOut.writerow = stats.wrapStage("write", csvOut.writerow)
+        csvOut.writerows = stats.wrapStage("write", csvOut.writerows, len)
+    csvWriter = None if isCsvOutToMem else csvOut
+    if stats is not None and (engine == "numpy" or workers > 1):
+        # npProcessTrxns y parallelProcessTrxns leen la entrada (y escriben la
+        # salida si no es en memoria) dentro de su propia fase.
+        stats.nestedStages.add("read")
+        if csvWriter is not None:
+            stats.nestedStages.add("write")
+
+    # Dar antes la opción de agrupar las transacciones itertools groupby
+
+    def mergeTrxnsGroups(trxnsGroups):
+        trxnsGroups = matchTrxnsGroups(list(trxnsGroups))
+        counters["groupsMerged"] += sum(len(g) > 1 for g in trxnsGroups)
+        if stats is not None:
+            stats.countGroups(trxnsGroups, outFieldNames[0], \
+                    trxnsProcess["typeMerges"])
+        return mergeTrxnsGroupsByType(trxnsGroups)
+
+    # Los bloques por día solo se usan al escribir por bloques: en memoria se
+    # agrupan todas las transacciones aunque la entrada no esté ordenada.
+    getTrxnBlockId = None if isCsvOutToMem else \
+            trxnsProcess["getTrxnBlockId"]
+    if engine == "numpy":
+        outTrxns = processNpTrxns(trxnsIn, csvWriter, mergeTrxnsGroups, \
+                trxnsProcess["getDates"])
+    elif engine == "sqlite":
+        if stage is None:
+            stage = loadTrxnsStage(stageFileName, stageKey, trxnsIn, \
+                    processTrxn, getTrxnGroupId, outFieldNames, stats=stats)
+        outTrxns = sqliteProcessTrxns(stage[0], csvWriter, mergeTrxnsGroups, \
+                stats)
+        stage[0].close()
+    elif workers > 1:
+        getTrxnDay = lambda trxn: trxnsProcess["getDates"]( \
+                trxn[inFieldNames[1]])[1]
+        with timeStage("workers"):
+            outTrxns = parallelProcessTrxns(trxnsIn, getTrxnDay, workers, \
+                    csvWriter, isGrouped=isStream or isSort, \
+                    isPlanCompiled=isPlanCompiled, \
+                    tradeTolerance=tradeTolerance, stats=stats)
+        if stats is not None:
+            stats.getStage("workers")["rows"] += counters["rowsIn"]
+    else:
+        outTrxns = csvProcessTrxns(trxnsIn, processTrxn, csvWriter, \
+                mergeTrxnsGroups, getTrxnGroupId, getTrxnBlockId)
+
+    if inFile is not None:
+        inFile.close()
 
     if isCsvOutToMem:
-        csvOut = csvOpen(outFile, 'w', dialect="excel", isDict=True, \
-                fieldnames=outFieldNames)
         csvOut.writeheader()
         csvOut.writerows(outTrxns)
 
+    if isPipeline:
+        csvOut.close()
+    sink.close()
+
+    if stats is not None:
+        stats.counters.update(rowsIn=counters["rowsIn"], \
+                rowsOut=csvOut.rowsWritten)
+    return {"inFile": inFileName, "outFile": outFileName, \
+            "rowsIn": counters["rowsIn"], "rowsOut": csvOut.rowsWritten, \
+            "groupsMerged": None if workers > 1 or engine != "rows" else \
+                counters["groupsMerged"], \
+            "seconds": time.perf_counter() - startTime}
+
+
+
+
+def hashBytes(binFile, start, end):
+    """
+    Obtener el hash sha1 (hex) de los bytes [start, end) de un archivo
+    binario.
+    """
+    binFile.seek(start)
+    return hl.sha1(binFile.read(end - start)).hexdigest()
+
+
+
+
+def loadCheckpoint(checkpointFileName, binFile, outFileName, planFingerprint):
+    """
+    Cargar el checkpoint de la ejecución incremental anterior y comprobar que
+    sigue siendo válido: debe ser de la misma huella del plan y reglas de
+    clasificación, el archivo de entrada debe tener la misma cabecera y la
+    misma fila justo antes del día abierto, y el de salida debe contener al
+    menos lo escrito hasta los días cerrados.
+
+    RETORNO:
+        Diccionario checkpoint, o None si no existe, está dañado o no es
+        válido.
+    """
+
+    try:
+        with open(checkpointFileName, encoding="utf-8") as checkpointFile:
+            checkpoint = json.load(checkpointFile)
+        inSize = os.fstat(binFile.fileno()).st_size
+        if checkpoint["planFingerprint"] != planFingerprint or \
+                inSize < checkpoint["inOffset"] or \
+                os.path.getsize(outFileName) < checkpoint["outOffset"] or \
+                hashBytes(binFile, 0, checkpoint["headerEnd"]) != \
+                    checkpoint["headerHash"] or \
+                hashBytes(binFile, checkpoint["prevRowStart"], \
+                    checkpoint["inOffset"]) != checkpoint["prevRowHash"]:
+            logger.warning("Checkpoint no válido, se procesa todo: %s", \
+                    checkpointFileName)
+            return None
+    except FileNotFoundError:
+        return None
+    except (ValueError, KeyError, TypeError):
+        logger.warning("Checkpoint dañado, se procesa todo: %s", \
+                checkpointFileName)
+        return None
+
+    return checkpoint
+
+
+
+
+def incrementalConvertTrxnsFile(inFileName, outFileName, \
+        checkpointFileName=None, trxnsProcess=None, tradeTolerance=0):
+    """
+    Convertir un extracto de manera incremental. Tras cada ejecución se
+    guarda un checkpoint con el último día cerrado (todos menos el último día
+    de la entrada, que puede estar incompleto), la posición en bytes de la
+    entrada donde empieza el día abierto, el hash de la fila anterior, y la
+    posición y número de filas de la salida hasta los días cerrados. La
+    siguiente ejecución sobre un extracto que contiene al anterior salta
+    directamente al día abierto, trunca la salida de ese día y añade el
+    resultado de ese día y los nuevos. El checkpoint guarda también la huella
+    del plan de campos, las reglas de clasificación y la tolerancia de
+    trading (ver getPlanFingerprint). Si el checkpoint está dañado, es de
+    otra huella o no es válido, se procesa todo el archivo y se reescribe la
+    salida.
+
+    La entrada debe estar ordenada por día de manera ascendente. Se procesa
+    por bloques de un día, como en convertTrxnsFile con isStream.
+
+    ARGUMENTOS:
+        - inFileName: nombre del archivo csv de entrada.
+        - outFileName: nombre del archivo csv de salida.
+        - checkpointFileName: archivo JSON del checkpoint. Si None,
+        outFileName + ".checkpoint".
+        - trxnsProcess: funciones de proceso obtenidas con getTrxnsProcess.
+        Si None se construyen.
+        - tradeTolerance: ver getTrxnsProcess. Solo se usa si trxnsProcess es
+        None.
+
+    RETORNO:
+        Diccionario resumen como el de convertTrxnsFile, con el día desde el
+        que se ha reanudado (resumedFrom, None si se procesa todo).
+
+    EXCEPCIONES:
+        Si hay transacciones de días ya cerrados tras el día abierto.
+    """
+
+    startTime = time.perf_counter()
+    if checkpointFileName is None:
+        checkpointFileName = outFileName + ".checkpoint"
+    if trxnsProcess is None:
+        trxnsProcess = getTrxnsProcess(tradeTolerance=tradeTolerance)
+    getDates = trxnsProcess["getDates"]
+
+    inFile = open(inFileName, "rb")
+    headerLine = inFile.readline()
+    headerEnd = inFile.tell()
+    inFile.seek(0)
+    dialect = sniffDialect(inFile.read(1024).decode("utf-8", "ignore"))
+    fieldNames = next(csv.reader([headerLine.decode("utf-8-sig")], dialect))
+
+    planFingerprint = getPlanFingerprint(trxnsProcess["outFieldsPlan"], \
+            trxnsProcess["tradeTolerance"])
+    checkpoint = loadCheckpoint(checkpointFileName, inFile, outFileName, \
+            planFingerprint)
+    if checkpoint is None:
+        checkpoint = {"planFingerprint": planFingerprint, "day": None, \
+                "lastClosedDay": None, "inOffset": headerEnd, \
+                "prevRowStart": 0, "outOffset": 0, "outRows": 0}
+        outFile = open(outFileName, "w", newline='')
+    else:
+        with open(outFileName, "r+b") as outBinFile:
+            outBinFile.truncate(checkpoint["outOffset"])
+        outFile = open(outFileName, "a", newline='')
+    resumedFrom = checkpoint["day"]
+
+    csvOut = csvOpen(outFile, 'w', dialect="excel", isDict=True, \
+            fieldnames=outFieldNames, amountKeys=outAmountFieldNames)
+    if checkpoint["outOffset"] == 0:
+        csvOut.writeheader()
+
+    def processDay(dayTrxns):
+        outTrxns = csvProcessTrxns(dayTrxns, trxnsProcess["processTrxn"], \
+                None, trxnsProcess["mergeTrxnsGroups"], \
+                trxnsProcess["getTrxnGroupId"])
+        csvWriteRows(csvOut, outTrxns)
+
+    # Se retiene en memoria un día; al empezar el siguiente, el retenido está
+    # cerrado y se escribe.
+    inFile.seek(checkpoint["inOffset"])
+    rowsIn = 0
+    day = dayStart = prevRowStart = None
+    dayTrxns = []
+    closedDays = set()
+    for rowStart, trxn in csvReadOffsets(inFile, fieldNames, dialect):
+        rowsIn += 1
+        trxnDay = getDates(trxn.get(inFieldNames[1], ""))[1]
+        if trxnDay != day:
+            assert trxnDay not in closedDays and (trxnDay != \
+                    checkpoint["lastClosedDay"] or day is not None), \
+                    trxnErrors["DAY_BEFORE_CHECKPOINT"] + f": {trxn}"
+            if day is not None:
+                processDay(dayTrxns)
+                closedDays.add(day)
+                checkpoint["lastClosedDay"] = day
+                checkpoint["prevRowStart"] = prevRowStart
+            day, dayStart, dayTrxns = trxnDay, rowStart, []
+            checkpoint["outOffset"] = outFile.tell()
+            checkpoint["outRows"] += csvOut.rowsWritten
+            csvOut.rowsWritten = 0
+        dayTrxns.append(trxn)
+        prevRowStart = rowStart
+
+    if day is not None:
+        checkpoint["day"] = day
+        checkpoint["inOffset"] = dayStart
+        processDay(dayTrxns)
+    rowsOut = checkpoint["outRows"] + csvOut.rowsWritten
     outFile.close()
 
+    checkpoint["inFile"] = inFileName
+    checkpoint["headerEnd"] = headerEnd
+    checkpoint["headerHash"] = hashBytes(inFile, 0, headerEnd)
+    checkpoint["prevRowHash"] = hashBytes(inFile, checkpoint["prevRowStart"], \
+            checkpoint["inOffset"])
+    inFile.close()
+    with open(checkpointFileName, "w", encoding="utf-8") as checkpointFile:
+        json.dump(checkpoint, checkpointFile, indent=2)
+
+    return {"inFile": inFileName, "outFile": outFileName, "rowsIn": rowsIn, \
+            "rowsOut": rowsOut, "resumedFrom": resumedFrom, \
+            "seconds": time.perf_counter() - startTime}
+
+
+
+
+def getDayIndexFileName(inFileName):
+    """
+    Obtener el nombre del archivo índice de días de un extracto.
+    """
+    return inFileName + ".dayindex"
+
+
+
+
+def buildDayIndex(inFileName, getDates, encoding="utf-8"):
+    """
+    Construir el índice de días de un extracto: por cada tramo de filas
+    seguidas del mismo día (clave newDayFormat, la misma del blockId), la
+    posición en bytes de su primera fila y su número de filas. El índice se
+    guarda junto al extracto (ver getDayIndexFileName) con el tamaño y la
+    fecha de modificación del extracto, que lo invalidan si cambian.
+
+    ARGUMENTOS:
+        - inFileName: nombre del archivo csv de entrada.
+        - getDates: función obtenida con wrapDateStage(dateFormat,
+        [newDateFormat, newDayFormat]).
+        - encoding: codificación del archivo.
+
+    RETORNO:
+        Diccionario índice con size, mtime, fieldNames y la lista runs de
+        tramos [día, posición, filas].
+    """
+
+    with open(inFileName, "rb") as inFile:
+        stat = os.fstat(inFile.fileno())
+        dialect = sniffDialect(inFile.read(1024).decode(encoding, "ignore"))
+        inFile.seek(0)
+        fieldNames = next(csv.reader([inFile.readline().decode(encoding + \
+                "-sig")], dialect))
+        runs = []
+        for rowStart, trxn in csvReadOffsets(inFile, fieldNames, dialect, \
+                encoding):
+            day = getDates(trxn.get(inFieldNames[1], ""))[1]
+            if runs and runs[-1][0] == day:
+                runs[-1][2] += 1
+            else:
+                runs.append([day, rowStart, 1])
+
+    dayIndex = {"size": stat.st_size, "mtime": stat.st_mtime, \
+            "fieldNames": fieldNames, "runs": runs}
+    with open(getDayIndexFileName(inFileName), "w", encoding="utf-8") as \
+            indexFile:
+        json.dump(dayIndex, indexFile)
+    return dayIndex
+
+
+
+
+def loadDayIndex(inFileName, getDates):
+    """
+    Cargar el índice de días de un extracto, construyéndolo si no existe o
+    si el extracto ha cambiado de tamaño o fecha de modificación.
+
+    RETORNO:
+        Diccionario índice (ver buildDayIndex).
+    """
+
+    stat = os.stat(inFileName)
+    try:
+        with open(getDayIndexFileName(inFileName), encoding="utf-8") as \
+                indexFile:
+            dayIndex = json.load(indexFile)
+        if dayIndex["size"] == stat.st_size and \
+                dayIndex["mtime"] == stat.st_mtime:
+            return dayIndex
+    except (FileNotFoundError, ValueError, KeyError):
+        pass
+
+    return buildDayIndex(inFileName, getDates)
+
+
+
+
+def readDayRange(inFileName, fromDay, toDay, getDates, encoding="utf-8"):
+    """
+    Leer solo las transacciones de un rango de días de un extracto, saltando
+    directamente a cada tramo de días del rango con el índice de días.
+
+    ARGUMENTOS:
+        - inFileName: nombre del archivo csv de entrada.
+        - fromDay: primer día (datetime.date) del rango, o None.
+        - toDay: último día (datetime.date) del rango, incluido, o None.
+        - getDates: ver buildDayIndex.
+        - encoding: codificación del archivo.
+
+    RETORNO:
+        Generador de transacciones (diccionarios) del rango, en el orden del
+        extracto.
+    """
+
+    dayIndex = loadDayIndex(inFileName, getDates)
+    with open(inFileName, "rb") as inFile:
+        dialect = sniffDialect(inFile.read(1024).decode(encoding, "ignore"))
+        for day, rowStart, numRows in dayIndex["runs"]:
+            date = parseDate(day, newDayFormat).date()
+            if (fromDay is not None and date < fromDay) or \
+                    (toDay is not None and date > toDay):
+                continue
+            inFile.seek(rowStart)
+            rows = csvReadOffsets(inFile, dayIndex["fieldNames"], dialect, \
+                    encoding)
+            for _, trxn in it.islice(rows, numRows):
+                yield trxn
+
+
+
+
+# Formato de la caché binaria de transacciones procesadas: TRXNS_CACHE_MAGIC,
+# longitud (uint32) de una cabecera JSON y, por cada columna, sus datos:
+# - "str": códigos array("I") sobre la lista de valores distintos guardada en
+#   la cabecera.
+# - "amount": cantidades array("q") seguidas de una máscara de bytes (1 si la
+#   fila tiene cantidad; 0 si vale "").
+TRXNS_CACHE_MAGIC = b"BNTRXNS1"
+
+
+def hashFile(fileName, blockSize=1 << 20):
+    """
+    Obtener el hash sha1 (hex) del contenido de un archivo.
+    """
+    fileHash = hl.sha1()
+    with open(fileName, "rb") as binFile:
+        for block in iter(lambda: binFile.read(blockSize), b""):
+            fileHash.update(block)
+    return fileHash.hexdigest()
+
+
+
+
+def getPlanFingerprint(newKeysPlan, *extra):
+    """
+    Obtener una huella (sha1 hex) del plan de campos de salida, que cambia si
+    cambian sus campos, claves de entrada, argumentos fijos o el código de sus
+    funciones, las tablas de tipos, operaciones y monedas, o los formatos de
+    fecha.
+
+    ARGUMENTOS:
+        - newKeysPlan: plan de campos de salida (ver getPlanEntry).
+        - extra: otros valores (con repr estable) a incluir en la huella.
+
+    RETORNO:
+        Cadena hex con la huella.
+    """
+
+    def describeCode(code):
+        return repr((code.co_qualname if hasattr(code, "co_qualname") else \
+                code.co_name, code.co_code, code.co_names, tuple( \
+                describeCode(const) if hasattr(const, "co_code") else \
+                repr(const) for const in code.co_consts)))
+
+    def describe(value):
+        value = getattr(value, "__wrapped__", value)
+        if hasattr(value, "__code__"):
+            return describeCode(value.__code__)
+        if callable(value):
+            return getattr(value, "__qualname__", type(value).__qualname__)
+        return repr(value)
+
+    parts = [repr((inTypes, outTypes, outOps, dateFormat, newDateFormat, \
+            newDayFormat, inFieldsParsers.keys())), \
+            json.dumps(mappingRules, sort_keys=True), repr(extra)]
+    parts += [describe(parser) for parser in inFieldsParsers.values()]
+    for newKey, planEntry in newKeysPlan.items():
+        getValue, keys, endArgs = getPlanEntry(planEntry)
+        parts.append(repr((newKey, keys)))
+        parts += [describe(value) for value in (getValue,) + endArgs]
+
+    return hl.sha1("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+
+
+def saveTrxnsCache(fileName, trxns):
+    """
+    Guardar transacciones ya procesadas (mappings con las mismas claves) en un
+    archivo binario por columnas. Las columnas con enteros y "" se guardan
+    como cantidades; el resto como cadenas (o None) codificadas por
+    diccionario. Las posiciones de las transacciones con isTradeLeg (ver
+    OutTrxn) se guardan en la cabecera como tradeLegs.
+
+    ARGUMENTOS:
+        - fileName: nombre del archivo de caché.
+        - trxns: lista de transacciones procesadas.
+    """
+
+    keys = list(trxns[0].keys()) if trxns else []
+    header = {"keys": keys, "numRows": len(trxns), \
+            "byteorder": sys.byteorder, "columns": [], \
+            "tradeLegs": [pos for pos, trxn in enumerate(trxns) \
+                if isTradeLeg(trxn)]}
+    blocks = []
+    for key in keys:
+        values = [trxn.get(key) for trxn in trxns]
+        if any(type(v) is int for v in values) and \
+                all(type(v) is int or v == "" for v in values):
+            header["columns"].append({"kind": "amount"})
+            blocks.append(array.array("q", (v if v != "" else 0 \
+                    for v in values)).tobytes())
+            blocks.append(bytes(type(v) is int for v in values))
+            continue
+
+        codes = {}
+        column = array.array("I", (codes.setdefault(v, len(codes)) \
+                for v in values))
+        header["columns"].append({"kind": "str", "values": list(codes)})
+        blocks.append(column.tobytes())
+
+    writeTrxnsColumns(fileName, header, blocks)
+
+
+
+def writeTrxnsColumns(fileName, header, blocks):
+    """
+    Escribir un archivo por columnas con el formato de la caché (ver
+    TRXNS_CACHE_MAGIC). Se escribe en un archivo temporal que luego se
+    renombra, para no dejar nunca un archivo a medias.
+
+    ARGUMENTOS:
+        - fileName: nombre del archivo.
+        - header: cabecera con las claves, el número de filas, el orden de
+        bytes y la descripción de cada columna.
+        - blocks: bytes de cada columna, en el orden de la cabecera.
+    """
+
+    headerBytes = json.dumps(header).encode("utf-8")
+    tmpFileName = fileName + ".tmp"
+    with open(tmpFileName, "wb") as cacheFile:
+        cacheFile.write(TRXNS_CACHE_MAGIC)
+        cacheFile.write(struct.pack("<I", len(headerBytes)))
+        cacheFile.write(headerBytes)
+        for block in blocks:
+            cacheFile.write(block)
+    os.replace(tmpFileName, fileName)
+
+
+
+
+def loadTrxnsCache(fileName):
+    """
+    Cargar las transacciones procesadas guardadas con saveTrxnsCache.
+
+    RETORNO:
+        Lista de transacciones OutTrxn, con isTradeLeg restaurado, si las
+        claves son outFieldNames; si no, OrderedDict.
+
+    EXCEPCIONES:
+        Si el archivo no tiene el formato de la caché.
+    """
+
+    with open(fileName, "rb") as cacheFile:
+        data = cacheFile.read()
+    assert data[:len(TRXNS_CACHE_MAGIC)] == TRXNS_CACHE_MAGIC, \
+            trxnErrors["CACHE_FORMAT"] + f": {fileName}"
+    pos = len(TRXNS_CACHE_MAGIC)
+    headerLen, = struct.unpack_from("<I", data, pos)
+    pos += 4
+    header = json.loads(data[pos:pos + headerLen].decode("utf-8"))
+    pos += headerLen
+    numRows = header["numRows"]
+
+    columns = []
+    for column in header["columns"]:
+        typeCode = "q" if column["kind"] == "amount" else "I"
+        values = array.array(typeCode)
+        end = pos + numRows * values.itemsize
+        values.frombytes(data[pos:end])
+        if header["byteorder"] != sys.byteorder:
+            values.byteswap()
+        pos = end
+        if column["kind"] == "amount":
+            mask = data[pos:pos + numRows]
+            pos += numRows
+            columns.append([v if m else "" for v, m in zip(values, mask)])
+        else:
+            strValues = column["values"]
+            columns.append([strValues[c] for c in values])
+
+    keys = header["keys"]
+    if keys == outFieldNames:
+        trxns = [OutTrxn.fromValues(row) for row in zip(*columns)]
+        for pos in header.get("tradeLegs", []):
+            trxns[pos].isTradeLeg = True
+        return trxns
+    return [cl.OrderedDict(zip(keys, row)) for row in zip(*columns)]
+
+
+
+
+class TrxnsSink:
+    """
+    Destino de las transacciones de salida con la misma interfaz que el
+    writer csv de csvProcessTrxns (writeheader, writerow, writerows y
+    rowsWritten), pero que escribe por lotes: writerows escribe cada lote que
+    recibe (p. ej. un bloque de un día) con writeBatch, y las filas sueltas de
+    writerow se acumulan hasta batchSize. writerow y writerows devuelven 0.
+    Hay que llamar a close al terminar. Cada subclase define writeBatch,
+    closeSink y la extensión de sus archivos.
+    """
+
+    isBatched = True
+    extension = ""
+
+    def __init__(self, fileName, fieldNames, amountKeys=(), batchSize=10000):
+        self.fileName = fileName
+        self.fieldNames = list(fieldNames)
+        self.amountKeys = tuple(amountKeys)
+        self.batchSize = batchSize
+        self.batch = []
+        self.rowsWritten = 0
+
+    def getRowValues(self, rows):
+        """
+        Valores de cada fila en el orden de fieldNames, con las cantidades
+        formateadas como en el csv y "" en los campos que falten.
+        """
+        fieldNames, amountKeys = self.fieldNames, self.amountKeys
+        return [[row.get(key, "") for key in fieldNames] for row in \
+                (formatTrxnAmounts(row, amountKeys) for row in rows)]
+
+    def writeheader(self):
+        return 0
+
+    def writerow(self, rowdict):
+        self.batch.append(rowdict)
+        if len(self.batch) >= self.batchSize:
+            self.flush()
+        return 0
+
+    def writerows(self, rowdicts):
+        self.flush()
+        rowdicts = iter(rowdicts)
+        for batch in iter(lambda: list(it.islice(rowdicts, self.batchSize)),\
+                []):
+            self.writeBatch(batch)
+            self.rowsWritten += len(batch)
+        return 0
+
+    def flush(self):
+        if self.batch:
+            self.writeBatch(self.batch)
+            self.rowsWritten += len(self.batch)
+            self.batch = []
+
+    def close(self):
+        self.flush()
+        self.closeSink()
+
+
+
+class JsonlTrxnsSink(TrxnsSink):
+    """
+    Destino JSON Lines: un objeto JSON por transacción con los mismos valores
+    (cadenas) que las celdas del csv.
+    """
+
+    extension = ".jsonl"
+
+    def __init__(self, fileName, fieldNames, amountKeys=(), batchSize=10000):
+        super().__init__(fileName, fieldNames, amountKeys, batchSize)
+        self.file = openTrxnsFile(fileName, "w", 1 << 20, "utf-8", \
+                self.extension)
+        self.encode = json.JSONEncoder(ensure_ascii=False).encode
+
+    def writeBatch(self, rows):
+        fieldNames, encode = self.fieldNames, self.encode
+        self.file.write("".join(encode(dict(zip(fieldNames, values))) + "\n" \
+                for values in self.getRowValues(rows)))
+
+    def closeSink(self):
+        self.file.close()
+
+
+
+class SqliteTrxnsSink(TrxnsSink):
+    """
+    Destino SQLite: tabla trxns con una columna por campo. Las cantidades son
+    columnas INTEGER con enteros en unidades de 1e-8 (como las de
+    parseAmount), o NULL si están vacías, para consultarlas sin volver a
+    parsearlas; el resto son columnas TEXT con los mismos valores que las
+    celdas del csv. Cada lote se inserta con executemany y se confirma una
+    transacción cada commitRows filas. El archivo se sobrescribe si ya
+    existe.
+    """
+
+    extension = ".sqlite"
+    table = "trxns"
+
+    def __init__(self, fileName, fieldNames, amountKeys=(), batchSize=10000, \
+            commitRows=500000):
+        super().__init__(fileName, fieldNames, amountKeys, batchSize)
+        if os.path.exists(fileName):
+            os.remove(fileName)
+        self.commitRows = commitRows
+        self.uncommittedRows = 0
+        # Con ThreadedTrxnsWriter se escribe desde el hilo escritor, pero
+        # nunca desde dos hilos a la vez.
+        self.connection = sqlite3.connect(fileName, check_same_thread=False)
+        self.connection.execute("PRAGMA synchronous = OFF")
+        columns = ", ".join(f'"{key}" ' + ("INTEGER" if key in \
+                self.amountKeys else "TEXT") for key in self.fieldNames)
+        self.connection.execute(f"CREATE TABLE {self.table} ({columns})")
+        self.insert = f"INSERT INTO {self.table} VALUES " \
+                f"({', '.join('?' * len(self.fieldNames))})"
+        self.amountIndexes = [i for i, key in enumerate(self.fieldNames) \
+                if key in self.amountKeys]
+
+    def writeBatch(self, rows):
+        fieldNames = self.fieldNames
+        rowsValues = [[row.get(key, "") for key in fieldNames] for row in rows]
+        for values in rowsValues:
+            for i in self.amountIndexes:
+                value = values[i]
+                if type(value) is not int:
+                    values[i] = parseAmount(value) if value != "" else None
+        self.connection.executemany(self.insert, rowsValues)
+        self.uncommittedRows += len(rowsValues)
+        if self.uncommittedRows >= self.commitRows:
+            self.connection.commit()
+            self.uncommittedRows = 0
+
+    def closeSink(self):
+        self.connection.commit()
+        self.connection.close()
+
+
+
+class ColumnarTrxnsSink(TrxnsSink):
+    """
+    Destino por columnas para cargar en numpy o pandas: un directorio con un
+    archivo .npy estándar (ver numpy.load) por campo. Las cantidades son
+    enteros int64 en unidades de 1e-8 (como las de parseAmount), con 0 si
+    están vacías, y cada una tiene además una máscara booleana
+    "<campo>.mask.npy" que es True en las filas vacías (como en
+    numpy.ma). El resto de campos son cadenas unicode de ancho fijo.
+
+    Cada lote se añade a un archivo temporal por columna, así que la memoria
+    no crece con el tamaño de la salida (p. ej. con --stream). Al cerrar se
+    escribe cada .npy con su cabecera, ya conocidos el número de filas y el
+    ancho de cada columna de cadenas.
+    """
+
+    extension = ".columns"
+
+    def __init__(self, fileName, fieldNames, amountKeys=(), batchSize=10000):
+        assert np is not None, trxnErrors["NO_NUMPY"]
+        super().__init__(fileName, fieldNames, amountKeys, batchSize)
+        os.makedirs(fileName, exist_ok=True)
+        # Por campo: [archivo temporal, ancho máximo] (ancho None en las
+        # cantidades). Las cadenas se guardan como JSON, una por línea.
+        self.columns = {}
+        for key in self.fieldNames:
+            tmpFileName = self.getColumnFileName(key) + ".tmp"
+            self.columns[key] = [open(tmpFileName, "w+b"), None if key in \
+                    self.amountKeys else 1]
+            if key in self.amountKeys:
+                self.columns[key + ".mask"] = [open(self.getColumnFileName( \
+                        key + ".mask") + ".tmp", "w+b"), None]
+
+    def getColumnFileName(self, key):
+        return os.path.join(self.fileName, key + ".npy")
+
+    def writeBatch(self, rows):
+        for key in self.fieldNames:
+            tmpFile, width = column = self.columns[key]
+            values = [row.get(key, "") for row in rows]
+            if key in self.amountKeys:
+                values = [value if type(value) is int else parseAmount(value) \
+                        if value != "" else None for value in values]
+                tmpFile.write(np.array([0 if value is None else value \
+                        for value in values], dtype="<i8").tobytes())
+                self.columns[key + ".mask"][0].write(np.array([value is None \
+                        for value in values], dtype=bool).tobytes())
+            else:
+                values = [str(value) for value in values]
+                column[1] = max(width, *map(len, values))
+                tmpFile.write("".join(json.dumps(value) + "\n" \
+                        for value in values).encode("utf-8"))
+
+    def closeSink(self):
+        numRows = self.rowsWritten
+        for key, (tmpFile, width) in self.columns.items():
+            isAmount = key in self.amountKeys
+            isStr = width is not None
+            dtype = np.dtype(f"<U{width}" if isStr else "<i8" if isAmount \
+                    else bool)
+            tmpFile.seek(0)
+            fileName = self.getColumnFileName(key)
+            with open(fileName + ".part", "wb") as npyFile:
+                np.lib.format.write_array_header_1_0(npyFile, {"descr": \
+                        np.lib.format.dtype_to_descr(dtype), \
+                        "fortran_order": False, "shape": (numRows,)})
+                if isStr:
+                    lines = iter(tmpFile)
+                    for batch in iter(lambda: list(it.islice(lines, \
+                            self.batchSize)), []):
+                        npyFile.write(np.array([json.loads(line) for line in \
+                                batch], dtype=dtype).tobytes())
+                else:
+                    sh.copyfileobj(tmpFile, npyFile)
+            tmpFile.close()
+            os.remove(tmpFile.name)
+            os.replace(fileName + ".part", fileName)
+
+
+
+# Destinos de salida por formato, además de csv (ver openTrxnsSink).
+trxnsSinks = {"jsonl": JsonlTrxnsSink, "sqlite": SqliteTrxnsSink, \
+        "columnar": ColumnarTrxnsSink}
+
+
+def openTrxnsSink(fileName, outFormat="csv", buffering=-1):
+    """
+    Abrir el destino de las transacciones de salida. Los destinos csv y
+    jsonl se comprimen según la extensión de fileName (ver openTrxnsFile).
+
+    ARGUMENTOS:
+        - fileName: nombre del archivo de salida.
+        - outFormat: "csv" o un formato de trxnsSinks.
+        - buffering: búfer del archivo csv (ver open).
+
+    RETORNO:
+        Writer con la interfaz de csvProcessTrxns y un método close que
+        cierra el archivo de salida.
+    """
+
+    if outFormat != "csv":
+        return trxnsSinks[outFormat](fileName, outFieldNames, \
+                outAmountFieldNames)
+
+    outFile = openTrxnsFile(fileName, "w", buffering)
+    csvOut = csvOpen(outFile, 'w', dialect="excel", isDict=True, \
+            fieldnames=outFieldNames, amountKeys=outAmountFieldNames)
+    csvOut.close = outFile.close
+    return csvOut
+
+
+
+
+def convertTrxnsFileWorker(inFileName, outFileName, convertOptions):
+    """
+    Convertir un archivo en un proceso trabajador de batchConvertTrxnsFiles,
+    reutilizando las funciones de proceso construidas al iniciarlo.
+    """
+    return convertTrxnsFile(inFileName, outFileName, workerTrxnsProcess, \
+            **convertOptions)
+
+
+
+
+def getBatchFileNames(inPath):
+    """
+    Obtener los archivos de entrada de un batch.
+
+    ARGUMENTOS:
+        - inPath: directorio (se toman sus archivos *.csv, también comprimidos
+        con alguna de compressionExtensions) o patrón glob.
+
+    RETORNO:
+        Lista ordenada de nombres de archivo.
+    """
+    if os.path.isdir(inPath):
+        return sorted(fileName for pattern in ("*.csv", "*.csv.gz", \
+                "*.csv.zst", "*.zip") for fileName in \
+                glob.glob(os.path.join(inPath, pattern)))
+    return sorted(glob.glob(inPath))
+
+
+
+
+def batchConvertTrxnsFiles(inFileNames, outDirName, workers=1, \
+        isPlanCompiled=True, tradeTolerance=0, **convertOptions):
+    """
+    Convertir varios extractos a la vez en un pool de procesos. Cada proceso
+    construye una sola vez las funciones de proceso y las reutiliza en todos
+    los archivos que convierte.
+
+    ARGUMENTOS:
+        - inFileNames: lista de archivos de entrada.
+        - outDirName: directorio donde escribir cada archivo de salida, con el
+        mismo nombre que el de entrada.
+        - workers: número de procesos.
+        - isPlanCompiled, tradeTolerance: ver getTrxnsProcess.
+        - convertOptions: resto de opciones de convertTrxnsFile para todos
+        los archivos (cada archivo se procesa en un solo proceso).
+
+    RETORNO:
+        Diccionario resumen con la lista de resúmenes de cada archivo
+        (ver convertTrxnsFile) en el orden de inFileNames, los totales y los
+        segundos empleados. Los archivos que fallan tienen "error" en su
+        resumen.
+    """
+
+    startTime = time.perf_counter()
+    convertOptions = dict(convertOptions, workers=1, \
+            isPlanCompiled=isPlanCompiled, tradeTolerance=tradeTolerance)
+    os.makedirs(outDirName, exist_ok=True)
+
+    futures = []
+    with cf.ProcessPoolExecutor(workers, initializer=initTrxnsProcessWorker, \
+            initargs=(isPlanCompiled, logState and logState["config"], \
+            tradeTolerance, mappingRules)) as executor:
+        for inFileName in inFileNames:
+            outFileName = os.path.join(outDirName, os.path.basename(inFileName))
+            outFormat = convertOptions.get("outFormat", "csv")
+            if outFormat != "csv":
+                # jsonl se comprime igual que la entrada (ver openTrxnsSink).
+                compression = getCompression(outFileName)
+                if compression is not None:
+                    outFileName = os.path.splitext(outFileName)[0]
+                outFileName = os.path.splitext(outFileName)[0] + \
+                        trxnsSinks[outFormat].extension
+                if compression is not None and outFormat == "jsonl":
+                    outFileName += compression
+            assert os.path.abspath(outFileName) != os.path.abspath(inFileName),\
+                    trxnErrors["SAME_IN_OUT_FILE"] + f": {inFileName}"
+            futures.append((inFileName, outFileName, executor.submit( \
+                    convertTrxnsFileWorker, inFileName, outFileName, \
+                    convertOptions)))
+
+        files = []
+        for inFileName, outFileName, future in futures:
+            try:
+                files.append(future.result())
+            except Exception as e:
+                logger.exception("Error al convertir %s", inFileName)
+                files.append({"inFile": inFileName, "outFile": outFileName, \
+                        "error": repr(e)})
+
+    totals = cl.Counter()
+    for fileSummary in files:
+        totals["files"] += 1
+        totals["errors"] += "error" in fileSummary
+        for key in ("rowsIn", "rowsOut", "groupsMerged"):
+            totals[key] += fileSummary.get(key) or 0
+
+    return {"files": files, "totals": dict(totals), \
+            "seconds": time.perf_counter() - startTime}
+
+
+
+
+def main():
+    """
+    Función principal.
+
+    El programa permite cuatro combinaciones entrada/salida: Procesar las
+    transacciones directamente desde un reader csv o desde una lista de
+    transacciones de entrada almacenadas ya en memoria hacia un writer csv o
+    para almacenarlas en otra lista de transacciones de salida en memoria.
+
+    MEJORAS:
+        - Dar la opción de ir escribiendo en el archivo de salida cada día de
+        transacciones procesado o, en cambio, escribir todas las transacciones
+        de golpe.
+        Las opciones que maneja el programa son:
+        - Agrupar transacciones por día para reducir el número.
+        - Elegir el orden de los campos de salida.
+        - Cambiar el nombre de los campos de salida.
+        - Eliminar campos de salida.
+
+        Desde el programa principal se puede elegir los campos de salida que
+        se quiera y darle un nombre. A cada campo de salida se le asocia la
+        función get que está relacionada con el tipo de campo que es y los
+        campos de entrada necesarios para poder obtener el dato correctamente
+        para esa función. La función get a elegir y el tipo de dato de ese
+        campo de salida están ligados. La forma de dar al usuario a elegir
+        qué tipo de dato de salida es qué campo se hace eligiendo una función
+        get entre las posibles.
+    """
+    argParser = argparse.ArgumentParser(description="Convertir un extracto " \
+            "de transacciones de Binance agrupando transacciones por día.")
+    argParser.add_argument("inFileName", help="archivo csv de entrada (sin " \
+            "comprimir, .gz, .zst o .zip) o, con --batch, directorio o " \
+            "patrón glob de archivos de entrada")
+    argParser.add_argument("outFileName", help="archivo csv de salida " \
+            "(comprimido si acaba en .gz, .zst o .zip) o, con --batch, " \
+            "directorio de salida")
+    argParser.add_argument("--engine", choices=["rows", "numpy", "sqlite"], \
+            default="rows", help="motor de procesamiento: fila a fila, por " \
+            "columnas con numpy (todo en memoria) o uniendo en una base de " \
+            "datos SQLite de staging (un día en memoria)")
+    argParser.add_argument("--stage-db", metavar="ARCHIVO", help="con " \
+            "--engine sqlite, base de datos de staging, reutilizada si la " \
+            "entrada no cambia (por defecto: archivo de entrada + " \
+            ".stage.sqlite)")
+    argParser.add_argument("--stream", action="store_true", help="leer y " \
+            "escribir las transacciones por bloques de un día, sin cargar " \
+            "todo el archivo en memoria. La entrada debe estar ordenada por " \
+            "UTC_Time de manera ascendente (salvo desórdenes dentro de " \
+            "--reorder-window)")
+    argParser.add_argument("--reorder-window", type=float, default=60, \
+            metavar="SEGUNDOS", help="en modo --stream, ventana en segundos " \
+            "para reordenar transacciones ligeramente desordenadas " \
+            "(por defecto: %(default)s)")
+    argParser.add_argument("--sort", action="store_true", help="ordenar " \
+            "antes la entrada por UTC_Time usando archivos temporales, para " \
+            "extractos desordenados o de más reciente a más antiguo")
+    argParser.add_argument("--sort-run-size", type=int, default=100000, \
+            metavar="N", help="transacciones en memoria por cada tramo " \
+            "ordenado con --sort (por defecto: %(default)s)")
+    argParser.add_argument("--workers", type=int, default=1, metavar="N", \
+            help="procesar los días en paralelo en N procesos " \
+            "(por defecto: %(default)s)")
+    argParser.add_argument("--batch", action="store_true", help="convertir " \
+            "todos los archivos de entrada en paralelo (--workers procesos), " \
+            "escribiendo un archivo de salida por archivo de entrada")
+    argParser.add_argument("--summary", metavar="ARCHIVO", help="con " \
+            "--batch, archivo JSON del resumen de la ejecución (por defecto: " \
+            "summary.json en el directorio de salida)")
+    argParser.add_argument("--mmap", action="store_true", help="leer la " \
+            "entrada mapeándola en memoria, sin crear un diccionario por " \
+            "transacción. No admite archivos comprimidos")
+    argParser.add_argument("--from", dest="fromDay", metavar="AAAA-MM-DD", \
+            type=dt.date.fromisoformat, help="convertir solo desde este día " \
+            "(usa un índice de días junto al archivo de entrada, que no puede " \
+            "estar comprimido)")
+    argParser.add_argument("--to", dest="toDay", metavar="AAAA-MM-DD", \
+            type=dt.date.fromisoformat, help="convertir solo hasta este día, " \
+            "incluido")
+    argParser.add_argument("--cache-dir", metavar="DIR", help="guardar y " \
+            "reutilizar en DIR las transacciones ya procesadas de cada " \
+            "entrada, para no volver a leerla ni procesarla")
+    argParser.add_argument("--trade-tolerance", type=float, default=0, \
+            metavar="SEGUNDOS", help="juntar las partes de un trade (compra, " \
+            "venta y comisión) anotadas con hasta SEGUNDOS de diferencia; 0 " \
+            "para no juntarlas (por defecto: %(default)s)")
+    argParser.add_argument("--format", choices=["csv", *trxnsSinks], \
+            default="csv", help="formato de salida: csv, JSON Lines, base de " \
+            "datos SQLite (tabla trxns, con las cantidades como enteros en " \
+            "unidades de 1e-8) o directorio con un .npy por columna (necesita " \
+            "numpy) (por defecto: %(default)s)")
+    argParser.add_argument("--rules", metavar="ARCHIVO", help="archivo " \
+            "JSON con reglas de clasificación (operations, coinRemaps y " \
+            "signRules) que amplían o cambian las de defaultMappingRules")
+    argParser.add_argument("--pipeline", action="store_true", help="leer " \
+            "y escribir en hilos aparte con colas acotadas, solapando la " \
+            "E/S (p. ej. en discos de red) con el proceso de transacciones")
+    argParser.add_argument("--stats", choices=["table", "json"], help=\
+            "mostrar al terminar el tiempo, las transacciones y la memoria " \
+            "de cada fase de la conversión como tabla o JSON. Con --engine " \
+            "numpy el proceso va en la fase numpy, y con --workers en la " \
+            "fase workers")
+    argParser.add_argument("--log-file", default="binance.log", \
+            metavar="ARCHIVO", help="archivo de log (por defecto: " \
+            "%(default)s)")
+    argParser.add_argument("--log-level", default="WARNING", \
+            choices=["DEBUG", "INFO", "WARNING", "ERROR"], help="nivel " \
+            "mínimo de los registros del log (por defecto: %(default)s)")
+    argParser.add_argument("--log-max-per-key", type=int, default=10, \
+            metavar="N", help="avisos de transacciones a anotar por cada " \
+            "Operation; del resto solo se anota cuántos hay (por defecto: " \
+            "%(default)s)")
+    argParser.add_argument("--incremental", action="store_true", help=\
+            "convertir solo desde el último día abierto de la ejecución " \
+            "anterior y añadirlo a la salida existente. La entrada debe " \
+            "estar ordenada por día de manera ascendente")
+    argParser.add_argument("--checkpoint", metavar="ARCHIVO", help="con " \
+            "--incremental, archivo del checkpoint (por defecto: archivo de " \
+            "salida + .checkpoint)")
+    args = argParser.parse_args()
+    if args.stream and args.engine == "numpy":
+        argParser.error("--stream no es compatible con --engine numpy")
+    if args.workers > 1 and args.engine != "rows" and not args.batch:
+        argParser.error(f"--workers no es compatible con --engine " \
+                f"{args.engine}")
+    if args.engine == "sqlite" and (args.cache_dir or args.stage_db and \
+            args.batch):
+        argParser.error("--engine sqlite no es compatible con --cache-dir, " \
+                "ni --stage-db con --batch")
+    if args.format != "csv" and args.incremental:
+        argParser.error("--incremental solo admite --format csv")
+    if args.incremental and (getCompression(args.inFileName) or \
+            getCompression(args.outFileName)):
+        argParser.error("--incremental no admite archivos comprimidos")
+    if args.mmap or args.fromDay is not None or args.toDay is not None:
+        inFileNames = getBatchFileNames(args.inFileName) if args.batch else \
+                [args.inFileName]
+        if any(map(getCompression, inFileNames)):
+            argParser.error("--mmap y --from/--to no admiten archivos " \
+                    "comprimidos")
+    if args.stats and (args.batch or args.incremental):
+        argParser.error("--stats no es compatible con --batch ni " \
+                "--incremental")
+    if args.rules:
+        try:
+            setMappingRules(loadMappingRules(args.rules))
+        except (OSError, ValueError) as error:
+            argParser.error(str(error))
+    setupLogging(args.log_file, args.log_level, args.log_max_per_key)
+    convertOptions = {"engine": args.engine, "isStream": args.stream, \
+            "reorderWindow": args.reorder_window, "isSort": args.sort, \
+            "sortRunSize": args.sort_run_size, "isMmap": args.mmap, \
+            "dayRange": None if args.fromDay is None and args.toDay is None \
+                else (args.fromDay, args.toDay), "cacheDir": args.cache_dir, \
+            "tradeTolerance": args.trade_tolerance, \
+            "isPipeline": args.pipeline, "outFormat": args.format, \
+            "stageDbFileName": args.stage_db}
+
+    if args.incremental:
+        incrementalConvertTrxnsFile(args.inFileName, args.outFileName, \
+                args.checkpoint, tradeTolerance=args.trade_tolerance)
+        return
+
+    if args.batch:
+        inFileNames = getBatchFileNames(args.inFileName)
+        summary = batchConvertTrxnsFiles(inFileNames, args.outFileName, \
+                args.workers, **convertOptions)
+        summaryFileName = args.summary or os.path.join(args.outFileName, \
+                "summary.json")
+        with open(summaryFileName, "w", encoding="utf-8") as summaryFile:
+            json.dump(summary, summaryFile, indent=2)
+        return
+
+    stats = TrxnsStats() if args.stats else None
+    convertTrxnsFile(args.inFileName, args.outFileName, workers=args.workers,\
+            stats=stats, **convertOptions)
+    if args.stats == "table":
+        print(stats.formatTable())
+    elif args.stats == "json":
+        print(json.dumps(stats.getReport(), indent=2))
+
 
 
 if __name__ in ("__main__", "__console__"):
@@ -0,0 +1,668 @@
+#!/usr/bin/env python3
+"""
+Pruebas de la conversión de extractos de binance.py. Se ejecutan con
+"python -m pytest" o "python -m unittest" desde el directorio del proyecto.
+"""
+
+import contextlib
+import csv
+import io
+import itertools as it
+import os
+import pickle
+import sys
+import tempfile as tf
+import unittest
+from unittest import mock
+
+import binance
+
+
+
+inHeader = ",".join(binance.inFieldNames)
+
+
+
+def writeRows(fileName, inRows):
+    """
+    Escribir un extracto con las filas inRows (cadenas csv sin cabecera),
+    comprimido según la extensión de fileName.
+    """
+
+    with binance.openTrxnsFile(fileName, "w", encoding="utf-8") as inFile:
+        inFile.write("\n".join([inHeader, *inRows]) + "\n")
+
+
+
+def readRows(fileName):
+    """
+    Leer las filas de un csv de salida, comprimido o no, como diccionarios.
+    """
+
+    with binance.openTrxnsFile(fileName, encoding="utf-8") as outFile:
+        return list(csv.DictReader(outFile))
+
+
+
+def convertRows(inRows, inExtension=".csv", outExtension=".csv", \
+        **convertOptions):
+    """
+    Convertir un extracto con las filas inRows (cadenas csv sin cabecera) y
+    obtener las filas del csv de salida como diccionarios.
+    """
+
+    with tf.TemporaryDirectory() as dirName:
+        inFileName = os.path.join(dirName, "in" + inExtension)
+        outFileName = os.path.join(dirName, "out" + outExtension)
+        writeRows(inFileName, inRows)
+        binance.convertTrxnsFile(inFileName, outFileName, **convertOptions)
+        return readRows(outFileName)
+
+
+
+def runMain(*args):
+    """
+    Ejecutar main con los argumentos args y devolver el código de salida y
+    lo escrito en stderr.
+    """
+
+    stderr = io.StringIO()
+    with mock.patch.object(sys, "argv", ["binance.py", *args]), \
+            contextlib.redirect_stderr(stderr):
+        try:
+            binance.main()
+        except SystemExit as error:
+            return error.code, stderr.getvalue()
+    return 0, stderr.getvalue()
+
+
+
+class StakingTest(unittest.TestCase):
+
+    # Intereses cero y negativos de varias monedas el mismo día, junto a
+    # intereses positivos que sí se unen.
+    edgeRows = ["1,2021-03-01 08:00:00,Spot,POS savings interest,DOT," \
+                    "0.00000000,", \
+                "1,2021-03-01 09:00:00,Spot,Savings Interest,ADA," \
+                    "-0.00010000,", \
+                "1,2021-03-01 10:00:00,Spot,Savings Interest,BTC," \
+                    "-0.00000100,", \
+                "1,2021-03-01 11:00:00,Spot,Savings Interest,BTC," \
+                    "0.00000300,", \
+                "1,2021-03-01 12:00:00,Spot,Savings Interest,BTC," \
+                    "0.00000200,"]
+
+    def testNonPositiveInterestIsNotMerged(self):
+        outRows = convertRows(self.edgeRows)
+        self.assertEqual([(row["Compra"], row["MonedaC"], row["Venta"], \
+                row["MonedaV"]) for row in outRows], \
+                [("", "", "", ""), \
+                 ("", "", "0.00010000", "ADA"), \
+                 ("", "", "0.00000100", "BTC"), \
+                 ("0.00000500", "BTC", "", "")])
+
+    def testStakedAmountWithoutCoin(self):
+        trxns = [binance.OutTrxn(), binance.OutTrxn()]
+        for trxn in trxns:
+            trxn["Tipo"], trxn["Compra"] = "Staking", 100
+        with self.assertRaises(AssertionError):
+            binance.mergeStakingTrxns(trxns, "MonedaC", "Compra")
+
+
+
+class EngineTest(unittest.TestCase):
+
+    # Extracto mixto: depósitos, trading con comisión, polvo a BNB y
+    # staking con intereses positivos, cero y negativos en varios días.
+    mixedRows = ["1,2021-03-01 00:46:52,Spot,Deposit,BTC,0.22322111,dep", \
+                 "1,2021-03-01 02:02:36,Spot,Withdraw,BTC,-0.16179939," \
+                    "\"wd, test\"", \
+                 "1,2021-03-01 07:34:07,Spot,Buy,BTC,0.04367992,", \
+                 "1,2021-03-01 07:34:07,Spot,Sell,BUSD,-1.74719699,", \
+                 "1,2021-03-01 07:34:07,Spot,Fee,BUSD,-0.00004368,", \
+                 "1,2021-03-01 08:10:00,Spot,Small assets exchange BNB,ADA," \
+                    "-0.50000000,", \
+                 "1,2021-03-01 08:10:00,Spot,Small assets exchange BNB,BNB," \
+                    "0.00100000,", \
+                 *StakingTest.edgeRows, \
+                 "1,2021-03-02 00:00:00,Spot,POS savings interest,DOT," \
+                    "0.00000000,", \
+                 "1,2021-03-02 01:00:00,Spot,Super BNB Mining,BNB," \
+                    "0.00000010,", \
+                 "1,2021-03-02 02:00:00,Spot,Super BNB Mining,BNB," \
+                    "0.00000020,"]
+
+    def assertSameAsRows(self, engine):
+        self.assertEqual(convertRows(self.mixedRows, engine=engine), \
+                convertRows(self.mixedRows))
+
+    @unittest.skipIf(binance.np is None, "numpy no está instalado")
+    def testNumpyEngine(self):
+        self.assertSameAsRows("numpy")
+
+    def testSqliteEngine(self):
+        self.assertSameAsRows("sqlite")
+
+    @unittest.skipIf(binance.np is None, "numpy no está instalado")
+    def testNumpyZeroInterest(self):
+        outRows = convertRows(StakingTest.edgeRows[:1], engine="numpy")
+        self.assertEqual(outRows[0]["Compra"], "")
+
+
+
+class TradeTest(unittest.TestCase):
+
+    def testDustOfSeveralCoinsToOneBuy(self):
+        # Sin precios no hay un reparto del BNB entre las monedas que no sea
+        # inventado, así que el grupo no se une.
+        with self.assertRaisesRegex(AssertionError, "varias monedas"):
+            convertRows( \
+                    ["1,2021-03-01 08:10:00,Spot,Small assets exchange BNB," \
+                        "ADA,-0.50000000,", \
+                     "1,2021-03-01 08:10:00,Spot,Small assets exchange BNB," \
+                        "SOL,-0.02000000,", \
+                     "1,2021-03-01 08:10:00,Spot,Small assets exchange BNB," \
+                        "ETH,-0.03000000,", \
+                     "1,2021-03-01 08:10:00,Spot,Small assets exchange BNB," \
+                        "BNB,0.00100001,"])
+
+    def testSeveralCoinsOnBothSidesIsAmbiguous(self):
+        for sellCoins in (["USDT", "BUSD"], ["USDT", "BUSD", "ETH"]):
+            with self.assertRaisesRegex(AssertionError, "varias monedas"):
+                convertRows( \
+                        ["1,2021-03-01 08:10:00,Spot,Buy,ADA,1.00000000,", \
+                         "1,2021-03-01 08:10:00,Spot,Buy,SOL,1.00000000,", \
+                         *(f"1,2021-03-01 08:10:00,Spot,Sell,{coin}," \
+                            "-1.00000000," for coin in sellCoins)])
+
+    def testFillsOfOneOrderAreSummed(self):
+        outRows = convertRows( \
+                ["1,2021-03-01 08:10:00,Spot,Buy,BTC,0.01000000,", \
+                 "1,2021-03-01 08:10:00,Spot,Sell,USDT,-500.00000000,", \
+                 "1,2021-03-01 08:10:00,Spot,Buy,BTC,0.02000000,", \
+                 "1,2021-03-01 08:10:00,Spot,Sell,USDT,-1000.00000000,", \
+                 "1,2021-03-01 08:10:00,Spot,Fee,BNB,-0.00100000,"])
+        self.assertEqual([(row["Compra"], row["MonedaC"], row["Venta"], \
+                row["MonedaV"], row["Comision"], row["MonedaF"]) \
+                for row in outRows], \
+                [("0.03000000", "BTC", "1500.00000000", "USDT", "", ""), \
+                 ("", "", "0.00100000", "BNB", "0.00100000", "BNB")])
+
+    splitRows = ["1,2021-03-01 10:00:00,Spot,Buy,BTC,0.10000000,", \
+                 "1,2021-03-01 10:00:01,Spot,Sell,USDT,-5000.00000000,", \
+                 "1,2021-03-01 10:00:01,Spot,Fee,BTC,-0.00010000,"]
+
+    def testSplitLegsAreNotJoinedByDefault(self):
+        with self.assertRaises(AssertionError):
+            convertRows(self.splitRows)
+
+    def testSplitLegsAreJoinedWithTolerance(self):
+        for engine in ["rows", "sqlite"] + \
+                (["numpy"] if binance.np is not None else []):
+            outRows = convertRows(self.splitRows, engine=engine, \
+                    tradeTolerance=2)
+            self.assertEqual([(row["Compra"], row["MonedaC"], row["Venta"], \
+                    row["MonedaV"], row["Comision"]) for row in outRows], \
+                    [("0.09990000", "BTC", "5000.00000000", "USDT", \
+                    "0.00010000")], engine)
+
+    def testNestedOrdersAreJoinedToTheNearestLeg(self):
+        # Orden A: BTC a 10:00:00 y USDT a 10:00:03; orden B, dentro de A:
+        # ETH a 10:00:01 y USDT a 10:00:02. La venta de 10:00:02 está a la
+        # misma distancia de tolerancia de las dos compras, pero más cerca
+        # de la de B.
+        rows = ["1,2021-03-01 10:00:00,Spot,Buy,BTC,0.10000000,", \
+                "1,2021-03-01 10:00:01,Spot,Buy,ETH,1.00000000,", \
+                "1,2021-03-01 10:00:02,Spot,Sell,USDT,-2000.00000000,", \
+                "1,2021-03-01 10:00:03,Spot,Sell,USDT,-5000.00000000,"]
+        for convertOptions in ({}, {"engine": "sqlite"}, {"workers": 2, \
+                "isStream": True}, {"engine": "numpy"} if binance.np is not \
+                None else {}):
+            outRows = convertRows(rows, tradeTolerance=3, **convertOptions)
+            self.assertEqual(sorted((row["Compra"], row["MonedaC"], \
+                    row["Venta"], row["MonedaV"]) for row in outRows), \
+                    [("0.10000000", "BTC", "5000.00000000", "USDT"), \
+                     ("1.00000000", "ETH", "2000.00000000", "USDT")], \
+                    convertOptions)
+
+    def testTradeLegFlagIsKept(self):
+        trxn = binance.markTradeLeg(binance.OutTrxn(), "Buy")
+        self.assertTrue(trxn.isTradeLeg)
+        self.assertTrue(pickle.loads(pickle.dumps(trxn)).isTradeLeg)
+        self.assertTrue(trxn.copy().isTradeLeg)
+        self.assertEqual(trxn, binance.OutTrxn())
+        self.assertFalse(binance.isTradeLeg({"Tipo": "Trade"}))
+        self.assertNotIn("isTradeLeg", trxn.keys())
+
+    def testOtherTradeOperationsAreNotJoined(self):
+        with self.assertRaises(AssertionError):
+            convertRows(["1,2021-03-01 10:00:00,Spot,Transaction Related," \
+                            "BTC,0.50000000,", \
+                         "1,2021-03-01 10:00:01,Spot,Transaction Related," \
+                            "USDT,-3.00000000,"], tradeTolerance=2)
+
+
+
+class StatsTest(unittest.TestCase):
+
+    def getGroups(self, **convertOptions):
+        stats = binance.TrxnsStats()
+        convertRows(EngineTest.mixedRows, stats=stats, **convertOptions)
+        return stats.getReport()["groups"]
+
+    def testGroupsAreTheSameInEveryEngine(self):
+        groups = self.getGroups()
+        self.assertEqual(groups["Staking"], {"merged": 3, "passed": 1})
+        self.assertEqual(self.getGroups(engine="sqlite"), groups)
+        self.assertEqual(self.getGroups(workers=2, isStream=True), groups)
+        if binance.np is not None:
+            self.assertEqual(self.getGroups(engine="numpy"), groups)
+
+    @unittest.skipIf(binance.np is None, "numpy no está instalado")
+    def testNumpyStageCountsRows(self):
+        stats = binance.TrxnsStats()
+        convertRows(EngineTest.mixedRows, engine="numpy", stats=stats)
+        self.assertEqual(stats.getReport()["stages"]["numpy"]["rows"], \
+                len(EngineTest.mixedRows))
+
+
+
+class SinkTest(unittest.TestCase):
+
+    def convertTo(self, dirName, outFormat, **convertOptions):
+        inFileName = os.path.join(dirName, "in.csv")
+        outFileName = os.path.join(dirName, "out")
+        writeRows(inFileName, EngineTest.mixedRows)
+        binance.convertTrxnsFile(inFileName, outFileName, \
+                outFormat=outFormat, **convertOptions)
+        return outFileName
+
+    def testSqliteAmountsAreIntegers(self):
+        outRows = convertRows(EngineTest.mixedRows)
+        with tf.TemporaryDirectory() as dirName:
+            connection = binance.sqlite3.connect(self.convertTo(dirName, \
+                    "sqlite"))
+            rows = connection.execute('SELECT "Compra", "Venta", ' \
+                    'typeof("Compra") FROM trxns').fetchall()
+            connection.close()
+        self.assertEqual([(binance.formatAmount(buy) if buy is not None else \
+                "", binance.formatAmount(sell) if sell is not None else "") \
+                for buy, sell, _ in rows], [(row["Compra"], row["Venta"]) \
+                for row in outRows])
+        self.assertEqual({buyType for _, _, buyType in rows}, \
+                {"integer", "null"})
+
+    @unittest.skipIf(binance.np is None, "numpy no está instalado")
+    def testColumnarIsOneNpyFilePerField(self):
+        np = binance.np
+        for convertOptions in ({}, {"isStream": True}):
+            outRows = convertRows(EngineTest.mixedRows, **convertOptions)
+            with tf.TemporaryDirectory() as dirName:
+                outDirName = self.convertTo(dirName, "columnar", \
+                        **convertOptions)
+                load = lambda key: np.load(os.path.join(outDirName, \
+                        key + ".npy"))
+                for key in binance.outFieldNames:
+                    if key in binance.outAmountFieldNames:
+                        values = np.ma.array(load(key), \
+                                mask=load(key + ".mask"))
+                        self.assertEqual(values.dtype, np.int64)
+                        values = [binance.formatAmount(int(value)) if \
+                                value is not np.ma.masked else "" for value \
+                                in values]
+                    else:
+                        values = load(key).tolist()
+                    self.assertEqual(values, [row[key] for row in outRows], \
+                            key)
+
+    @unittest.skipIf(binance.np is None, "numpy no está instalado")
+    def testColumnarIsWrittenPerBatch(self):
+        np = binance.np
+        with tf.TemporaryDirectory() as dirName:
+            sink = binance.ColumnarTrxnsSink(dirName, binance.outFieldNames, \
+                    binance.outAmountFieldNames, batchSize=2)
+            for day in range(1, 6):
+                trxn = binance.OutTrxn()
+                trxn["Tipo"], trxn["Compra"] = "Deposito", day * 100
+                sink.writerow(trxn)
+                self.assertLess(len(sink.batch), 2)
+            sink.close()
+            self.assertEqual(np.load(os.path.join(dirName, \
+                    "Compra.npy")).tolist(), [100, 200, 300, 400, 500])
+            self.assertEqual(np.load(os.path.join(dirName, \
+                    "Venta.mask.npy")).tolist(), [True] * 5)
+            self.assertEqual(sorted(os.listdir(dirName)), sorted( \
+                    [key + ".npy" for key in binance.outFieldNames] + \
+                    [key + ".mask.npy" for key in \
+                    binance.outAmountFieldNames]))
+
+
+
+class MappingRulesTest(unittest.TestCase):
+
+    def loadRules(self, text):
+        with tf.TemporaryDirectory() as dirName:
+            fileName = os.path.join(dirName, "rules.json")
+            with open(fileName, "w", encoding="utf-8") as rulesFile:
+                rulesFile.write(text)
+            return binance.loadMappingRules(fileName)
+
+    def testSectionThatIsNotAnObject(self):
+        with self.assertRaisesRegex(ValueError, \
+                r"rules\.json: la sección operations"):
+            self.loadRules('{"operations": []}')
+
+    def testUnknownSectionAndOperation(self):
+        with self.assertRaisesRegex(ValueError, r"rules\.json: .*opers"):
+            self.loadRules('{"opers": {}}')
+        with self.assertRaisesRegex(ValueError, \
+                r"rules\.json: operación Deposit"):
+            self.loadRules('{"operations": {"Deposit": {"type": "X"}}}')
+
+    def testFileThatIsNotJson(self):
+        with self.assertRaisesRegex(ValueError, r"rules\.json"):
+            self.loadRules('{"operations"')
+
+    def testRulesAreMerged(self):
+        rules = self.loadRules('{"coinRemaps": {"LUNA": "LUNA2"}}')
+        self.assertEqual(rules["coinRemaps"]["LUNA"], "LUNA2")
+        self.assertEqual(rules["operations"], \
+                binance.defaultMappingRules["operations"])
+
+
+
+class ReorderTest(unittest.TestCase):
+
+    # Un interés del 1 de marzo que llega tras uno del 2 de marzo.
+    lateRows = ["1,2021-03-01 23:50:00,Spot,Savings Interest,BTC," \
+                    "0.00000300,", \
+                "1,2021-03-02 00:05:00,Spot,Savings Interest,BTC," \
+                    "0.00000100,", \
+                "1,2021-03-01 23:55:00,Spot,Savings Interest,BTC," \
+                    "0.00000200,"]
+
+    def testReorderWithinWindow(self):
+        trxns = [(0, "a"), (3, "b"), (1, "c"), (3, "d"), (5, "e")]
+        self.assertEqual(list(binance.reorderTrxns(trxns, \
+                lambda trxn: trxn[0], 2)), \
+                [(0, "a"), (1, "c"), (3, "b"), (3, "d"), (5, "e")])
+
+    def testReorderBeyondWindowIsWarned(self):
+        trxns = [(0, "a"), (5, "b"), (1, "c"), (6, "d")]
+        with self.assertLogs(binance.logger, "WARNING") as logs:
+            self.assertEqual(list(binance.reorderTrxns(trxns, \
+                    lambda trxn: trxn[0], 2)), \
+                    [(0, "a"), (1, "c"), (5, "b"), (6, "d")])
+        self.assertIn("fuera de la ventana", logs.output[0])
+
+    def testStreamWithReorderWindow(self):
+        outRows = convertRows(self.lateRows, isStream=True, reorderWindow=3600)
+        self.assertEqual(outRows, convertRows(self.lateRows))
+        self.assertEqual([row["Compra"] for row in outRows], \
+                ["0.00000500", "0.00000100"])
+        # Sin ventana el día 1 se parte en dos bloques.
+        self.assertEqual(len(convertRows(self.lateRows, isStream=True, \
+                reorderWindow=0)), 3)
+
+
+
+class SortTest(unittest.TestCase):
+
+    def testSmallRunsAreMergedStably(self):
+        trxns = [{"t": str(t), "n": str(n)} for n, t in \
+                enumerate([5, 1, 4, 1, 3, 5, 2, 1])]
+        sortedTrxns = list(binance.externalSortTrxns(trxns, \
+                lambda trxn: trxn["t"], ["t", "n"], runSize=3))
+        self.assertEqual(sortedTrxns, sorted(trxns, \
+                key=lambda trxn: trxn["t"]))
+        self.assertEqual([trxn["n"] for trxn in sortedTrxns if trxn["t"] == \
+                "1"], ["1", "3", "7"])
+
+    def testOneRunIsReturnedAsIs(self):
+        trxns = [{"t": 2}, {"t": 1}]
+        self.assertEqual(list(binance.externalSortTrxns(trxns, \
+                lambda trxn: trxn["t"], ["t"], runSize=3)), \
+                [{"t": 1}, {"t": 2}])
+
+    def testSortedConversion(self):
+        shuffledRows = EngineTest.mixedRows[::-1]
+        sortedRows = sorted(EngineTest.mixedRows, key=lambda row: row[2:21])
+        outRows = convertRows(sortedRows, isStream=True)
+        for convertOptions in ({}, {"isStream": True}):
+            self.assertEqual(convertRows(shuffledRows, isSort=True, \
+                    sortRunSize=4, **convertOptions), outRows, \
+                    convertOptions)
+
+
+
+class MmapTest(unittest.TestCase):
+
+    # Remark entre comillas con comas, comillas y saltos de línea.
+    remarkRows = ["1,2021-03-01 00:46:52,Spot,Deposit,BTC,0.22322111," \
+                    "\"primera línea\nsegunda, con \"\"coma\"\"\"", \
+                  "1,2021-03-01 02:02:36,Spot,Withdraw,BTC,-0.16179939,", \
+                  "1,2021-03-01 03:00:00,Spot,Deposit,ETH,1.00000000," \
+                    "\"a\r\nb\""]
+
+    def testQuotedMultilineRemark(self):
+        with tf.TemporaryDirectory() as dirName:
+            inFileName = os.path.join(dirName, "in.csv")
+            writeRows(inFileName, self.remarkRows)
+            with open(inFileName, newline="", encoding="utf-8") as inFile:
+                expected = [tuple(row) for row in csv.reader(inFile)][1:]
+            for chunkSize in (16, 1 << 22):
+                self.assertEqual([tuple(trxn) for trxn in \
+                        binance.mmapReadTrxns(inFileName, \
+                        chunkSize=chunkSize)], expected, chunkSize)
+        self.assertEqual(expected[0][6], "primera línea\nsegunda, con " \
+                "\"coma\"")
+
+    def testMmapConversion(self):
+        for inRows in (self.remarkRows, EngineTest.mixedRows):
+            self.assertEqual(convertRows(inRows, isMmap=True), \
+                    convertRows(inRows))
+
+
+
+class DayRangeTest(unittest.TestCase):
+
+    # Filas en el primer y último segundo de cada día, y un tramo del 2 de
+    # marzo que vuelve a aparecer tras el 3.
+    dayRows = ["1,2021-03-01 23:59:59,Spot,Deposit,BTC,1.00000000,", \
+               "1,2021-03-02 00:00:00,Spot,Deposit,BTC,2.00000000,", \
+               "1,2021-03-02 23:59:59,Spot,Deposit,BTC,3.00000000,", \
+               "1,2021-03-03 00:00:00,Spot,Deposit,BTC,4.00000000,", \
+               "1,2021-03-02 12:00:00,Spot,Deposit,BTC,5.00000000,", \
+               "1,2021-03-04 00:00:00,Spot,Deposit,BTC,6.00000000,"]
+
+    def readChanges(self, inFileName, fromDay, toDay):
+        getDates = binance.getTrxnsProcess()["getDates"]
+        return [trxn["Change"].split(".")[0] for trxn in \
+                binance.readDayRange(inFileName, fromDay, toDay, getDates)]
+
+    def testRangeEdges(self):
+        day = lambda num: binance.dt.date(2021, 3, num)
+        with tf.TemporaryDirectory() as dirName:
+            inFileName = os.path.join(dirName, "in.csv")
+            writeRows(inFileName, self.dayRows)
+            self.assertEqual(self.readChanges(inFileName, day(2), day(3)), \
+                    ["2", "3", "4", "5"])
+            self.assertEqual(self.readChanges(inFileName, day(2), day(2)), \
+                    ["2", "3", "5"])
+            self.assertEqual(self.readChanges(inFileName, None, day(1)), \
+                    ["1"])
+            self.assertEqual(self.readChanges(inFileName, day(4), None), \
+                    ["6"])
+            self.assertEqual(self.readChanges(inFileName, day(5), None), [])
+            self.assertTrue(os.path.exists(binance.getDayIndexFileName( \
+                    inFileName)))
+
+            # Si cambia el extracto el índice se vuelve a construir.
+            writeRows(inFileName, self.dayRows + \
+                    ["1,2021-03-04 23:59:59,Spot,Deposit,BTC,7.00000000,"])
+            self.assertEqual(self.readChanges(inFileName, day(4), day(4)), \
+                    ["6", "7"])
+
+    def testDayRangeConversion(self):
+        day = lambda num: binance.dt.date(2021, 3, num)
+        self.assertEqual(convertRows(self.dayRows, dayRange=(day(2), \
+                day(3))), convertRows(self.dayRows[1:5]))
+
+
+
+class CacheTest(unittest.TestCase):
+
+    def convertCached(self, cacheDir, **convertOptions):
+        stats = binance.TrxnsStats()
+        outRows = convertRows(EngineTest.mixedRows, cacheDir=cacheDir, \
+                stats=stats, **convertOptions)
+        return "cache" in stats.getReport()["stages"], outRows
+
+    def testHitAndMissAfterPlanChange(self):
+        with tf.TemporaryDirectory() as cacheDir:
+            isHit, outRows = self.convertCached(cacheDir)
+            self.assertFalse(isHit)
+            self.assertEqual(outRows, convertRows(EngineTest.mixedRows))
+            self.assertEqual(len(os.listdir(cacheDir)), 1)
+
+            self.assertEqual(self.convertCached(cacheDir), (True, outRows))
+
+            rules = dict(binance.defaultMappingRules, \
+                    coinRemaps={"BTC": "XBT"})
+            binance.setMappingRules(rules)
+            try:
+                isHit, rulesRows = self.convertCached(cacheDir)
+            finally:
+                binance.setMappingRules()
+            self.assertFalse(isHit)
+            self.assertIn("XBT", [row["MonedaC"] for row in rulesRows])
+            self.assertEqual(len(os.listdir(cacheDir)), 2)
+
+            isHit, _ = self.convertCached(cacheDir, tradeTolerance=2)
+            self.assertFalse(isHit)
+            self.assertEqual(self.convertCached(cacheDir), (True, outRows))
+
+
+
+class PipelineTest(unittest.TestCase):
+
+    class FailingWriter:
+        def writeheader(self):
+            pass
+
+        def writerows(self, rowdicts):
+            raise OSError("disco lleno")
+
+    def testWriterErrorReachesCaller(self):
+        writer = binance.ThreadedTrxnsWriter(self.FailingWriter(), \
+                batchSize=1, queueSize=1)
+        with self.assertRaisesRegex(OSError, "disco lleno"):
+            for num in range(100):
+                writer.writerow({"n": num})
+            writer.close()
+        self.assertFalse(writer.writer.is_alive())
+
+    def testReaderErrorReachesCaller(self):
+        def readTrxns():
+            yield from range(5)
+            raise ValueError("fila incorrecta")
+        trxns = binance.readAheadTrxns(readTrxns(), batchSize=2)
+        with self.assertRaisesRegex(ValueError, "fila incorrecta"):
+            self.assertEqual(list(it.islice(trxns, 5)), list(range(5)))
+            next(trxns)
+
+    def testPipelineConversion(self):
+        outRows = convertRows(EngineTest.mixedRows)
+        for convertOptions in ({}, {"isStream": True}):
+            self.assertEqual(convertRows(EngineTest.mixedRows, \
+                    isPipeline=True, pipelineBatchSize=2, **convertOptions), \
+                    convertRows(EngineTest.mixedRows, **convertOptions))
+        self.assertEqual(convertRows(EngineTest.mixedRows, isPipeline=True), \
+                outRows)
+
+    def testPipelineWriteErrorReachesCaller(self):
+        with mock.patch.object(binance.AmountsDictWriter, "writerows", \
+                side_effect=OSError("disco lleno")), \
+                mock.patch.object(binance.AmountsDictWriter, "writerow", \
+                side_effect=OSError("disco lleno")):
+            with self.assertRaisesRegex(OSError, "disco lleno"):
+                convertRows(EngineTest.mixedRows, isPipeline=True, \
+                        isStream=True, pipelineBatchSize=2)
+
+
+
+class IncrementalTest(unittest.TestCase):
+
+    # Extracto ordenado por día; a la segunda ejecución se le añaden filas
+    # del último día y de un día nuevo.
+    firstRows = ["1,2021-03-01 00:46:52,Spot,Deposit,BTC,0.22322111,", \
+                 "1,2021-03-01 07:34:07,Spot,Buy,BTC,0.04367992,", \
+                 "1,2021-03-01 07:34:07,Spot,Sell,BUSD,-1.74719699,", \
+                 "1,2021-03-02 01:00:00,Spot,Super BNB Mining,BNB," \
+                    "0.00000010,"]
+    newRows = ["1,2021-03-02 02:00:00,Spot,Super BNB Mining,BNB,0.00000020,", \
+               "1,2021-03-03 10:00:00,Spot,Withdraw,BTC,-0.10000000,"]
+
+    def convertTwice(self, betweenRuns=lambda checkpointFileName: None):
+        with tf.TemporaryDirectory() as dirName:
+            inFileName = os.path.join(dirName, "in.csv")
+            outFileName = os.path.join(dirName, "out.csv")
+            writeRows(inFileName, self.firstRows)
+            binance.incrementalConvertTrxnsFile(inFileName, outFileName)
+            betweenRuns(outFileName + ".checkpoint")
+            writeRows(inFileName, self.firstRows + self.newRows)
+            summary = binance.incrementalConvertTrxnsFile(inFileName, \
+                    outFileName)
+            return summary["resumedFrom"], readRows(outFileName)
+
+    def testResumeMatchesFullConversion(self):
+        resumedFrom, outRows = self.convertTwice()
+        self.assertEqual(resumedFrom, "02-03-2021")
+        self.assertEqual(outRows, convertRows(self.firstRows + \
+                self.newRows, isStream=True))
+
+    def testCorruptCheckpointConvertsEverything(self):
+        def corrupt(checkpointFileName):
+            with open(checkpointFileName, "r+", encoding="utf-8") as \
+                    checkpointFile:
+                checkpointFile.truncate(10)
+        resumedFrom, outRows = self.convertTwice(corrupt)
+        self.assertIsNone(resumedFrom)
+        self.assertEqual(outRows, convertRows(self.firstRows + \
+                self.newRows, isStream=True))
+
+    def testOtherRulesConvertEverything(self):
+        rules = dict(binance.defaultMappingRules, coinRemaps={"BTC": "XBT"})
+        try:
+            resumedFrom, outRows = self.convertTwice(lambda \
+                    checkpointFileName: binance.setMappingRules(rules))
+            self.assertIsNone(resumedFrom)
+            self.assertNotIn("BTC", [row["MonedaC"] for row in outRows])
+        finally:
+            binance.setMappingRules()
+
+
+
+class CompressionTest(unittest.TestCase):
+
+    def testRoundTrip(self):
+        outRows = convertRows(EngineTest.mixedRows)
+        for extension in (".gz", ".zip"):
+            self.assertEqual(convertRows(EngineTest.mixedRows, extension, \
+                    extension), outRows, extension)
+
+    def testModesWithoutCompressionAreUsageErrors(self):
+        with tf.TemporaryDirectory() as dirName:
+            inFileName = os.path.join(dirName, "in.csv.gz")
+            outFileName = os.path.join(dirName, "out.csv")
+            writeRows(inFileName, EngineTest.mixedRows)
+            for args in (["--mmap"], ["--from", "2021-03-01"]):
+                code, stderr = runMain(inFileName, outFileName, *args)
+                self.assertEqual(code, 2, args)
+                self.assertIn("no admiten archivos comprimidos", stderr)
+            self.assertFalse(os.path.exists(outFileName))
+
+
+
+if __name__ == "__main__":
+    unittest.main()